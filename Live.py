@@ -0,0 +1,445 @@
+#Live tracking for Falling Sand
+
+import argparse
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+import SandTracking as st
+
+class frame_queue:
+	"""This is a class holding the frames waiting to be tracked in a bounded queue, counting the frames it drops or the time it holds the source back"""
+
+	def __init__(self, maxsize = 8, policy = "drop"):
+		"""
+		The method that creates the queue.
+
+		Parameters:
+			maxsize (int): The number of frames the queue holds.
+			policy (String): What happens to a frame arriving at a full queue, either "block" to hold the source back until there's room, "drop"
+				to drop the arriving frame as a camera's full buffer would, or "oldest" to drop the oldest frame so that the newest are tracked.
+		"""
+		if policy not in ("block", "drop", "oldest"):
+			raise ValueError("Unknown queue policy " + policy)
+
+		self.queue = queue.Queue(maxsize)
+		self.policy = policy
+		self.received = 0
+		"""The number of frames put in the queue."""
+		self.dropped = 0
+		"""The number of frames dropped because the queue was full."""
+		self.stalled = 0.0
+		"""The seconds the source spent waiting for room in the queue."""
+		self.peak = 0
+		"""The largest number of frames the queue has held."""
+
+	def put(self, item):
+		"""
+		The method that puts a frame in the queue following the policy.
+
+		Parameters:
+			item (tuple): The frame number, the time it arrived and the greyscale frame.
+
+		Returns:
+			queued (boolean): Whether the frame was queued rather than dropped.
+		"""
+		self.received += 1
+		queued = True
+
+		if self.policy == "block":
+			begin = time.perf_counter()
+			self.queue.put(item)
+			self.stalled += time.perf_counter() - begin
+		elif self.policy == "drop":
+			try:
+				self.queue.put_nowait(item)
+			except queue.Full:
+				self.dropped += 1
+				queued = False
+		else:
+			while True:
+				try:
+					self.queue.put_nowait(item)
+					break
+				except queue.Full:
+					try:
+						self.queue.get_nowait()
+						self.dropped += 1
+					except queue.Empty:
+						pass
+
+		self.peak = max(self.peak, self.queue.qsize())
+
+		return queued
+
+	def get(self):
+		"""
+		The method that waits for the next item in the queue.
+
+		Returns:
+			item (tuple): The frame number, the time it arrived and the greyscale frame, an exception raised by the source, or None once the
+				source has finished.
+		"""
+		return self.queue.get()
+
+	def close(self, error = None):
+		"""
+		The method that marks the end of the frames, always waiting for room so that the end is never dropped.
+
+		Parameters:
+			error (Exception): The exception that stopped the source, raised by the consumer. Leave blank if the source finished.
+		"""
+		if error is not None:
+			self.queue.put(error)
+
+		self.queue.put(None)
+
+class frame_source:
+	"""
+		This is a class producing frames on a thread of its own, such as from a camera. Subclasses either implement frames as a generator, or
+		call emit from the camera's callback for each frame in place of run.
+	"""
+
+	def __init__(self):
+		self.output = None
+		self.thread = None
+		self.stopping = threading.Event()
+		"""The event set when the consumer wants no more frames."""
+
+	def frames(self):
+		"""
+		The method that yields the frames of the source, stopping early once stopping is set. By default it yields none and only waits until
+		stopping is set, for sources that call emit from a camera's callback, so that the queue is still closed once they're stopped.
+
+		Returns:
+			frames (generator): The generator of the number and greyscale NumpyArray of each frame.
+		"""
+		self.stopping.wait()
+
+		yield from ()
+
+	def emit(self, frame_no, frame):
+		"""
+		The method that puts a frame in the output queue, stamped with the time it arrived.
+
+		Parameters:
+			frame_no (int): The number of the frame.
+			frame (NumpyArray): The greyscale frame.
+
+		Returns:
+			queued (boolean): Whether the frame was queued rather than dropped.
+		"""
+		return self.output.put((frame_no, time.perf_counter(), frame))
+
+	def run(self):
+		#Helper method run by the source's thread, which emits each frame and then closes the queue, passing on any exception to the consumer.
+
+		error = None
+
+		try:
+			for frame_no, frame in self.frames():
+				if self.stopping.is_set():
+					break
+
+				self.emit(frame_no, frame)
+		except Exception as exception:
+			error = exception
+
+		self.output.close(error)
+
+	def start(self, output):
+		"""
+		The method that starts emitting frames into a queue on a new thread.
+
+		Parameters:
+			output (frame_queue): The queue the frames are put in.
+		"""
+		self.output = output
+		self.stopping.clear()
+		self.thread = threading.Thread(target = self.run, daemon = True)
+		self.thread.start()
+
+	def stop(self):
+		"""The method that asks the source to stop emitting frames."""
+		self.stopping.set()
+
+class replay_source(frame_source):
+	"""This is a class standing in for a camera by emitting the frames of a video file at a fixed frame rate"""
+
+	def __init__(self, video_name, fps = None, start_frame = 0, length = None, dtype = None, decode_grey = True, roi = None):
+		"""
+		The method that sets up the replay.
+
+		Parameters:
+			video_name (String): The name of the video stored in the Recordings folder, or of a .npy file written by transcode.
+			fps (double): The frame rate frames are emitted at, on a fixed schedule. Leave blank to emit frames as fast as they're decoded, such
+				as with a "block" queue to measure the frame rate the tracking sustains.
+			start_frame (int): The first frame emitted.
+			length (int): The number of frames emitted. Leave blank to emit frames until the end of the video.
+			dtype (numpy dtype): The dtype of the greyscale frames passed to process_video.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale.
+			roi (integer tuple): The (x, y, width, height) rectangle the frames are cropped to.
+		"""
+		super().__init__()
+		self.video_name = video_name
+		self.fps = fps
+		self.start_frame = start_frame
+		self.length = length
+		self.dtype = dtype
+		self.decode_grey = decode_grey and not video_name.endswith(".npy")
+		self.roi = roi
+		self.lag = 0.0
+		"""The most seconds a frame was emitted behind its schedule, when decoding couldn't keep up with the frame rate."""
+
+	def frames(self):
+		video_frames = st.process_video(self.video_name, self.dtype, self.decode_grey, self.roi)
+		stop = len(video_frames) if self.length is None else min(self.start_frame + self.length, len(video_frames))
+		begin = time.perf_counter()
+
+		for k, i in enumerate(range(self.start_frame, stop)):
+			frame = video_frames[i]
+
+			if self.fps is not None:
+				delay = begin + k / self.fps - time.perf_counter()
+
+				if delay > 0:
+					self.stopping.wait(delay)
+				else:
+					self.lag = max(self.lag, -delay)
+
+			yield i, frame
+
+class live_tracker:
+	"""This is a class keeping rolling statistics of the particles linked in each frame, their count, fall velocity and acceleration"""
+
+	def __init__(self, frame_rate = st.frames_per_second, pixel_size = None, window = 100):
+		"""
+		The method that sets up the statistics.
+
+		Parameters:
+			frame_rate (double): The frames per second the camera recorded at, which the velocities and accelerations are measured in.
+			pixel_size (double): The meters each pixel spans, to give the acceleration in meters per second squared to compare with g. Leave
+				blank to give it in pixels per second squared.
+			window (int): The number of recent frames the statistics are taken over.
+		"""
+		self.frame_rate = frame_rate
+		self.pixel_size = pixel_size
+		self.frames = collections.deque(maxlen = window)
+		"""The count of particles and the arrays of fall velocities and accelerations of each recent frame."""
+		self.last = None
+		"""The particle IDs, y positions and frame number of the last frame."""
+		self.last_velocity = None
+		"""The particle IDs, y velocities and times of the last frame's velocities."""
+
+	def update(self, data_frame):
+		"""
+		The method that adds a linked frame to the statistics, matching its particles with those of the last frame. Dropped frames leave gaps
+		that the velocities and accelerations are measured across.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of the features of a frame linked by Trackpy.
+		"""
+		ids = data_frame["particle"].to_numpy()
+		y = data_frame["y"].to_numpy(dtype = float)
+		frame = data_frame["frame"].iloc[0] if len(data_frame) > 0 else None
+		velocity = np.zeros(0)
+		acceleration = np.zeros(0)
+
+		if frame is not None and self.last is not None:
+			last_ids, last_y, last_frame = self.last
+			common, now, before = np.intersect1d(ids, last_ids, assume_unique = True, return_indices = True)
+			dt = (frame - last_frame) / self.frame_rate
+			velocity = (y[now] - last_y[before]) / dt
+			t = (frame + last_frame) / 2 / self.frame_rate
+
+			if self.last_velocity is not None:
+				velocity_ids, last_velocity, last_t = self.last_velocity
+				matched, now, before = np.intersect1d(common, velocity_ids, assume_unique = True, return_indices = True)
+				acceleration = (velocity[now] - last_velocity[before]) / (t - last_t)
+
+			self.last_velocity = (common, velocity, t)
+
+		if frame is not None:
+			self.last = (ids, y, frame)
+
+		self.frames.append((len(ids), velocity, acceleration))
+
+	def statistics(self):
+		"""
+		The method that summarises the recent frames.
+
+		Returns:
+			statistics (Dictionary): The mean particle count per frame, the mean and median fall velocity in pixels per second, and the mean and
+				median acceleration in pixels per second squared, or meters per second squared with a pixel size.
+		"""
+		count = np.array([c for c, v, a in self.frames])
+		velocity = np.concatenate([v for c, v, a in self.frames] + [np.zeros(0)])
+		acceleration = np.concatenate([a for c, v, a in self.frames] + [np.zeros(0)])
+		scale = 1 if self.pixel_size is None else self.pixel_size
+
+		return dict({"count": float(count.mean()) if len(count) > 0 else 0.0,
+					"fall_velocity": float(velocity.mean()) if len(velocity) > 0 else None,
+					"median_fall_velocity": float(np.median(velocity)) if len(velocity) > 0 else None,
+					"acceleration": float(acceleration.mean() * scale) if len(acceleration) > 0 else None,
+					"median_acceleration": float(np.median(acceleration) * scale) if len(acceleration) > 0 else None})
+
+def format_value(value, unit):
+	#Helper function that formats a statistic with its unit, or as a dash while there's nothing to measure it from.
+
+	return "-" if value is None else "{:.2f} {}".format(value, unit)
+
+def run_live(source, particle_size, particle_minmass, noise, search_size, lb_search_size = None, step = 0.9, particle_memory = 3,
+			predictor = "velocity", velocity = (0, 0), acceleration = (0, 0), tracker = None, queue_size = 8, policy = "drop", max_frames = None,
+			report_interval = 1.0, keep = False):
+	"""
+		The function that tracks frames as they arrive from a source, locating the features of each frame and linking them to the trajectories
+		so far before the next frame is taken, while the source keeps emitting frames into a bounded queue.
+
+		Parameters:
+			source (frame_source): The source of the frames, such as a replay_source.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			search_size (int): The radius of pixels the trajectory searching program will look for the particle.
+			lb_search_size (int): The lower bound of the search size. Leave blank to link without adapting the search size.
+			step (double): The rate at which the search size decreases to the lb_search_size.
+			particle_memory (int): The number of frames that a particle cannot be found before it is pruned from memory.
+			predictor (String): The predictor linking uses, as in evaluate_trajectories.
+			velocity (tuple): The starting velocity of new particles for the ballistic predictor, in pixels per frame.
+			acceleration (tuple): The acceleration of the particles for the ballistic predictor, in pixels per frame squared.
+			tracker (live_tracker): The rolling statistics updated with each linked frame. Leave blank to use the camera frame rate and pixels.
+			queue_size (int): The number of frames waiting to be tracked before the queue's policy applies.
+			policy (String): The frame_queue policy, "block", "drop" or "oldest".
+			max_frames (int): The number of frames tracked before the source is stopped. Leave blank to track until the source finishes.
+			report_interval (double): The seconds between printed reports of the rolling statistics and latency. Leave blank to print nothing.
+			keep (boolean): Whether to keep and return every linked feature.
+
+		Returns:
+			summary (Dictionary): The counts of frames received, dropped and tracked, the percentiles of end-to-end latency from arrival to linked
+				in milliseconds, the mean time spent waiting in the queue, locating and linking, the frame rate tracked and the frame rate the
+				tracking could sustain from its busy time, and the final rolling statistics.
+			t (DataFrame): The DataFrame of every linked feature, if keep.
+	"""
+	tracker = tracker if tracker is not None else live_tracker()
+	frames = frame_queue(queue_size, policy)
+	pending = collections.deque()
+	timings = []
+	kept = []
+
+	def features():
+		#Generator feeding the linker, which takes the next frame only once the last one has been linked.
+
+		while True:
+			item = frames.get()
+
+			if item is None:
+				return
+
+			if isinstance(item, Exception):
+				raise item
+
+			frame_no, arrival, frame = item
+			dequeued = time.perf_counter()
+			f = tp.locate(frame, particle_size, minmass = particle_minmass, noise_size = noise).drop(columns = "frame", errors = "ignore")
+			f["frame"] = frame_no
+			pending.append((arrival, dequeued, time.perf_counter()))
+
+			yield f
+
+	options = dict(memory = particle_memory) if lb_search_size is None else dict(memory = particle_memory, adaptive_stop = lb_search_size,
+																					adaptive_step = step)
+	linker = st.make_predictor(predictor, velocity, acceleration).link_df_iter(features(), search_size, **options)
+
+	begin = time.perf_counter()
+	last_report = begin
+	source.start(frames)
+
+	try:
+		for f in linker:
+			arrival, dequeued, located = pending.popleft()
+			linked = time.perf_counter()
+			tracker.update(f)
+			timings.append((arrival, dequeued, located, linked, time.perf_counter()))
+
+			if keep:
+				kept.append(f)
+
+			if report_interval is not None and timings[-1][-1] - last_report >= report_interval:
+				last_report = timings[-1][-1]
+				recent = np.array(timings[-100:])
+				statistics = tracker.statistics()
+				print("{} frames: {:.1f} particles, fall velocity {}, acceleration {}, latency {:.1f} ms, {} dropped".format(len(timings),
+					statistics["count"], format_value(statistics["median_fall_velocity"], "px/s"), format_value(statistics["median_acceleration"],
+					"px/s^2" if tracker.pixel_size is None else "m/s^2"), np.median(recent[:, 4] - recent[:, 0]) * 1000, frames.dropped))
+
+			if max_frames is not None and len(timings) >= max_frames:
+				break
+	finally:
+		#The source is stopped and its queue drained, so that a source held back by a full queue can finish.
+		source.stop()
+
+		while source.thread is not None and source.thread.is_alive():
+			try:
+				frames.queue.get(timeout = 0.1)
+			except queue.Empty:
+				pass
+
+	elapsed = time.perf_counter() - begin
+	timings = np.array(timings).reshape(-1, 5)
+	latency = (timings[:, 4] - timings[:, 0]) * 1000
+	busy = np.sum(timings[:, 4] - timings[:, 1])
+
+	summary = dict({"received": frames.received, "dropped": frames.dropped, "tracked": len(timings), "peak_queue": frames.peak,
+					"stalled_seconds": frames.stalled, "source_lag_seconds": getattr(source, "lag", None),
+					"latency_ms": {"median": float(np.median(latency)) if len(latency) > 0 else None,
+						"p95": float(np.percentile(latency, 95)) if len(latency) > 0 else None, "max": float(latency.max()) if len(latency) > 0 else None},
+					"queue_ms": float(np.mean(timings[:, 1] - timings[:, 0]) * 1000) if len(timings) > 0 else None,
+					"locate_ms": float(np.mean(timings[:, 2] - timings[:, 1]) * 1000) if len(timings) > 0 else None,
+					"link_ms": float(np.mean(timings[:, 4] - timings[:, 2]) * 1000) if len(timings) > 0 else None,
+					"frames_per_second": len(timings) / elapsed if elapsed > 0 else None,
+					"sustainable_frames_per_second": len(timings) / busy if busy > 0 else None, "statistics": tracker.statistics()})
+
+	if keep:
+		return summary, pd.concat(kept, ignore_index = True) if len(kept) > 0 else pd.DataFrame()
+
+	return summary
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Track a recording as if it were arriving live from a camera.")
+	parser.add_argument("video_name")
+	parser.add_argument("--fps", type = float, default = None, help = "the frame rate frames are replayed at, or as fast as possible if left out")
+	parser.add_argument("--frames", type = int, default = None)
+	parser.add_argument("--size", type = int, default = 7)
+	parser.add_argument("--minmass", type = float, default = 500)
+	parser.add_argument("--noise", type = float, default = 1)
+	parser.add_argument("--search", type = float, default = 10)
+	parser.add_argument("--memory", type = int, default = 3)
+	parser.add_argument("--predictor", default = "velocity", choices = ["velocity", "ballistic"])
+	parser.add_argument("--queue", type = int, default = 8)
+	parser.add_argument("--policy", default = "drop", choices = ["block", "drop", "oldest"])
+	parser.add_argument("--camera-fps", type = float, default = st.frames_per_second, help = "the frame rate the recording was made at")
+	parser.add_argument("--pixel-size", type = float, default = None, help = "the meters each pixel spans, to give accelerations in m/s^2")
+	args = parser.parse_args()
+
+	tp.quiet()
+
+	source = replay_source(args.video_name, args.fps, length = args.frames)
+	tracker = live_tracker(args.camera_fps, args.pixel_size)
+	summary = run_live(source, args.size, args.minmass, args.noise, args.search, particle_memory = args.memory, predictor = args.predictor,
+					tracker = tracker, queue_size = args.queue, policy = args.policy)
+
+	print("Tracked {tracked} of {received} frames ({dropped} dropped) at {frames_per_second:.1f} frames per second, ".format(**summary)
+		+ "sustainable {:.1f} frames per second".format(summary["sustainable_frames_per_second"]))
+	print("Latency: median {median:.1f} ms, 95th percentile {p95:.1f} ms, max {max:.1f} ms".format(**summary["latency_ms"])
+		+ " (queue {queue_ms:.1f} ms, locate {locate_ms:.1f} ms, link {link_ms:.1f} ms on average)".format(**summary))
+
+	statistics = summary["statistics"]
+	unit = "px/s^2" if args.pixel_size is None else "m/s^2"
+	print("Last {} frames: {:.1f} particles, fall velocity {} (median {}), acceleration {} (median {})".format(len(tracker.frames),
+		statistics["count"], format_value(statistics["fall_velocity"], "px/s"), format_value(statistics["median_fall_velocity"], "px/s"),
+		format_value(statistics["acceleration"], unit), format_value(statistics["median_acceleration"], unit)))
@@ -0,0 +1,546 @@
+#Rendering for Falling Sand
+
+import math
+import os
+import queue
+import threading
+import time
+
+import av
+import matplotlib as mpl
+import numpy as np
+import trackpy as tp
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.image import imsave
+
+import SandTracking as st
+
+def new_figure(size = (8, 6), dpi = 100):
+	#Helper function that returns a figure and its axes drawn by the Agg canvas, without pyplot or any GUI backend.
+
+	fig = Figure(figsize = size, dpi = dpi)
+	FigureCanvasAgg(fig)
+
+	return fig, fig.add_subplot()
+
+def trajectory_segments(data_frame, last_frame = None, trail = None):
+	"""
+		The function that turns the trajectories of a DataFrame into the line segments between consecutive positions of each particle.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			last_frame (int): The last frame of the segments kept. Leave blank to keep every segment.
+			trail (int): The number of frames before last_frame whose segments are kept. Leave blank to keep every segment up to last_frame.
+
+		Returns:
+			segments (NumpyArray): The (segments, 2, 2) NumpyArray of the x and y of the start and end of each segment.
+			particles (NumpyArray): The particle ID of each segment.
+			frames (NumpyArray): The frame each segment ends in.
+	"""
+	ordered = data_frame.sort_values(["particle", "frame"], kind = "mergesort")
+	ids = ordered["particle"].to_numpy()
+	position = ordered[["x", "y"]].to_numpy(dtype = float)
+	frame = ordered["frame"].to_numpy()
+
+	same = ids[1:] == ids[:-1]
+
+	if last_frame is not None:
+		same &= frame[1:] <= last_frame
+
+		if trail is not None:
+			same &= frame[:-1] >= last_frame - trail
+
+	segments = np.stack((position[:-1][same], position[1:][same]), axis = 1)
+
+	return segments, ids[1:][same], frame[1:][same]
+
+def trajectory_lines(data_frame):
+	"""
+		The function that splits the trajectories of a DataFrame into one polyline per particle, which a LineCollection draws faster than the
+		segments between each pair of positions.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+
+		Returns:
+			lines (list): The (positions, 2) NumpyArray of the x and y of each particle's positions.
+			particles (NumpyArray): The particle ID of each line.
+	"""
+	ordered = data_frame.sort_values(["particle", "frame"], kind = "mergesort")
+	ids = ordered["particle"].to_numpy()
+	position = ordered[["x", "y"]].to_numpy(dtype = float)
+	starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+
+	return np.split(position, starts[1:]), ids[starts]
+
+def plot_trajectories(data_frame, file_name = None, color = "particle", cmap = "tab20", linewidth = 0.5, image = None, ax = None, size = (8, 6),
+					dpi = 150):
+	"""
+		The function that draws every trajectory at once as a single LineCollection, in place of one line per trajectory.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			file_name (String): The name of the PNG, SVG or PDF file to save the figure to. Leave blank to only return the figure.
+			color (String): Either "particle" to color each trajectory by its ID, "frame" to color each segment by its frame, or a matplotlib color.
+			cmap (String): The colormap used to color the trajectories.
+			linewidth (double): The width of the lines in points.
+			image (NumpyArray): The greyscale frame drawn behind the trajectories. Leave blank to draw them on blank axes.
+			ax (Axes): The axes to draw on, such as axes of a pyplot figure for interactive use. Leave blank to draw on a new figure without a GUI.
+			size (tuple): The width and height of a new figure in inches.
+			dpi (int): The dots per inch of a new figure.
+
+		Returns:
+			fig (Figure): The figure drawn on.
+	"""
+	if ax is None:
+		fig, ax = new_figure(size, dpi)
+	else:
+		fig = ax.figure
+
+	#Only coloring by frame needs each segment as its own line, as the other colorings are constant along a trajectory.
+	if color == "frame":
+		segments, particles, frames = trajectory_segments(data_frame)
+		lines = LineCollection(segments, linewidths = linewidth, cmap = cmap)
+		lines.set_array(frames)
+	elif color == "particle":
+		polylines, particles = trajectory_lines(data_frame)
+		lines = LineCollection(polylines, linewidths = linewidth, cmap = cmap, norm = mpl.colors.Normalize(0, mpl.colormaps[cmap].N))
+		lines.set_array(particles % mpl.colormaps[cmap].N)
+	else:
+		lines = LineCollection(trajectory_lines(data_frame)[0], linewidths = linewidth, colors = color)
+
+	if image is not None:
+		ax.imshow(image, cmap = "gray")
+
+	ax.add_collection(lines)
+
+	if image is None:
+		ax.autoscale()
+		ax.set_aspect("equal")
+		ax.invert_yaxis()
+
+	ax.set(xlabel = "x [px]", ylabel = "y [px]")
+
+	if file_name is not None:
+		fig.savefig(file_name)
+
+	return fig
+
+def density_image(data_frame, shape = None, scale = 1, step = 0.5):
+	"""
+		The function that rasterises every trajectory into an image counting how often trajectories pass through each pixel, with NumPy only.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			shape (tuple): The height and width of the video in pixels. Leave blank to fit the trajectories.
+			scale (double): The amount of image pixels per video pixel.
+			step (double): The distance in image pixels between the points sampled along each segment.
+
+		Returns:
+			density (NumpyArray): The (height, width) NumpyArray of the amount of samples in each pixel.
+	"""
+	segments = trajectory_segments(data_frame)[0] * scale
+
+	if shape is None:
+		shape = (int(math.ceil(data_frame["y"].max() + 1)), int(math.ceil(data_frame["x"].max() + 1)))
+
+	height, width = int(math.ceil(shape[0] * scale)), int(math.ceil(shape[1] * scale))
+
+	#Each segment is sampled at step spaced points excluding its end, which is sampled as the start of the next segment.
+	difference = segments[:, 1] - segments[:, 0]
+	samples = np.maximum(np.ceil(np.hypot(difference[:, 0], difference[:, 1]) / step).astype(int), 1)
+	segment = np.repeat(np.arange(len(segments)), samples)
+	t = (np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)) / samples[segment]
+	points = segments[segment, 0] + t[:, None] * difference[segment]
+
+	x = np.floor(points[:, 0]).astype(int)
+	y = np.floor(points[:, 1]).astype(int)
+	inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+
+	return np.bincount(y[inside] * width + x[inside], minlength = height * width).reshape(height, width)
+
+def save_density(data_frame, file_name, shape = None, scale = 1, log = True, cmap = "inferno"):
+	"""
+		The function that saves the density image of the trajectories straight to an image file, one pixel per image pixel.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			file_name (String): The name of the PNG file to save the image to.
+			shape (tuple): The height and width of the video in pixels. Leave blank to fit the trajectories.
+			scale (double): The amount of image pixels per video pixel.
+			log (boolean): Whether the colors follow the logarithm of the density, so that rarely visited pixels are still visible.
+			cmap (String): The colormap of the image.
+
+		Returns:
+			density (NumpyArray): The density image saved.
+	"""
+	density = density_image(data_frame, shape, scale)
+	values = np.log1p(density) if log else density
+
+	imsave(file_name, values, cmap = cmap, vmin = 0, vmax = max(values.max(), 1))
+
+	return density
+
+def save_histogram(values, file_name, bins = 100, label = None, value_range = None, size = (6, 4), dpi = 150):
+	"""
+		The function that computes a histogram of an array with NumPy and saves it straight to an image file.
+
+		Parameters:
+			values (NumpyArray): The values to count. Values that aren't finite are left out.
+			file_name (String): The name of the PNG, SVG or PDF file to save the histogram to.
+			bins (int): The amount of bins that the values are put into.
+			label (String): The label of the x axis.
+			value_range (tuple): The lower and upper edges of the bins. Leave blank to fit the values.
+			size (tuple): The width and height of the figure in inches.
+			dpi (int): The dots per inch of the figure.
+
+		Returns:
+			counts (NumpyArray): The amount of values in each bin.
+			edges (NumpyArray): The edges of the bins.
+	"""
+	values = np.asarray(values, dtype = float)
+	counts, edges = np.histogram(values[np.isfinite(values)], bins = bins, range = value_range)
+
+	fig, ax = new_figure(size, dpi)
+	ax.stairs(counts, edges, fill = True)
+	ax.set(xlabel = label, ylabel = "count")
+	fig.savefig(file_name)
+
+	return counts, edges
+
+def derivative_histograms(data_frame, output_name = "histograms", angle = math.pi / 12, bins = 100, file_format = "png", derivatives = None,
+						x_restriction = 0, y_restriction = 0):
+	"""
+		The function that saves histograms of the velocity and acceleration of every particle in a DataFrame of trajectory information, in pixels
+		per second and pixels per second squared as calc_derivatives gives them.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			output_name (String): The name of the folder the histograms are saved to.
+			angle (double): The maximum angle in radians a particle can move between positions before it's considered an irregular motion.
+			bins (int): The amount of bins of each histogram.
+			file_format (String): The extension of the image files, such as "png" or "svg".
+			derivatives (tuple of DataFrames): The velocity and acceleration DataFrames generated by calc_derivatives. Leave blank to calculate them.
+			x_restriction (double): The restriction of x motion passed to calc_derivatives.
+			y_restriction (double): The restriction of y motion passed to calc_derivatives.
+
+		Returns:
+			file_names (list): The names of the files written.
+	"""
+	if derivatives is None:
+		derivatives = st.calc_derivatives(data_frame, angle, x_restriction, y_restriction)
+
+	velocity_data, acceleration_data = derivatives[:2]
+	os.makedirs(output_name, exist_ok = True)
+	file_names = []
+
+	for table, columns, unit in ((velocity_data, ("x_vel", "y_vel"), "px/s"), (acceleration_data, ("x_accel", "y_accel"), "px/s²")):
+		for column in columns:
+			file_names.append(os.path.join(output_name, "{}.{}".format(column, file_format)))
+			save_histogram(table[column].to_numpy(), file_names[-1], bins, "{} [{}]".format(column, unit))
+
+	return file_names
+
+def overlay_frame(video_name, i, data_frame = None, file_name = None, trail = None, particle_size = None, particle_minmass = None, color = "particle",
+				size = (8, 6), dpi = 150):
+	"""
+		The function that draws the trajectories up to a frame over the decoded frame, circling the positions in it, in place of get_frame and
+		Trackpy's annotate.
+
+		Parameters:
+			video_name (String): The name of the video file in the Recordings folder to be processed.
+			i (int): The frame of the video to draw.
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy. Leave blank to locate and circle the features of
+				the frame instead.
+			file_name (String): The name of the PNG, SVG or PDF file to save the figure to. Leave blank to only return the figure.
+			trail (int): The number of frames of each trajectory drawn before frame i. Leave blank to draw each trajectory from its start.
+			particle_size (int): The odd number average pixel size of a feature, used to locate the features when no DataFrame is given.
+			particle_minmass (double): The minimum feature brightness used to locate the features when no DataFrame is given.
+			color (String): The coloring of the trajectories, as in plot_trajectories.
+			size (tuple): The width and height of the figure in inches.
+			dpi (int): The dots per inch of the figure.
+
+		Returns:
+			fig (Figure): The figure drawn on.
+	"""
+	image = st.process_video(video_name)[i]
+	fig, ax = new_figure(size, dpi)
+	ax.imshow(image, cmap = "gray")
+
+	if data_frame is None:
+		current = tp.locate(image, particle_size, minmass = particle_minmass) if particle_size is not None else None
+	else:
+		shown = data_frame[(data_frame["frame"] <= i) & (data_frame["frame"] >= (i - trail if trail is not None else -math.inf))]
+		plot_trajectories(shown, color = color, ax = ax)
+		current = data_frame[data_frame["frame"] == i]
+
+	if current is not None and len(current) > 0:
+		ax.scatter(current["x"], current["y"], s = 60, facecolors = "none", edgecolors = "red", linewidths = 0.8)
+
+	ax.set(xlim = (-0.5, image.shape[1] - 0.5), ylim = (image.shape[0] - 0.5, -0.5))
+
+	if file_name is not None:
+		fig.savefig(file_name)
+
+	return fig
+
+digits = np.array([[int(c) for c in glyph] for glyph in ("111101101101111", "010110010010111", "111001111100111", "111001111001111", "101101111001001",
+				"111100111001111", "111100111101111", "111001001001001", "111101111101111", "111101111001111")]).reshape(10, 5, 3)
+"""The 3 by 5 pixel bitmaps of the digits 0 to 9, used to label particles without a font renderer."""
+
+class video_annotator:
+	"""This is a class drawing the positions, IDs and fading trails of the particles of a DataFrame of trajectories onto video frames with NumPy"""
+
+	def __init__(self, data_frame, trail = 30, radius = 5, labels = True, label_scale = 1, cmap = "tab20"):
+		"""
+		The method that arranges the positions and trail points of every frame so that each frame only selects its slice of them.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			trail (int): The number of frames each trail fades over. Set to 0 to draw no trails.
+			radius (int): The radius in pixels of the circle drawn around each particle.
+			labels (boolean): Whether to write the ID of each particle next to it.
+			label_scale (int): The size in pixels of each pixel of the digits of the labels.
+			cmap (String): The colormap each particle's color is taken from by its ID.
+		"""
+		self.trail = trail
+		self.labels = labels
+		self.label_scale = label_scale
+		self.palette = (mpl.colormaps[cmap](np.arange(mpl.colormaps[cmap].N))[:, :3] * 255).astype(np.float32)
+		"""The RGB colors particles are drawn in, indexed by particle ID modulo their amount."""
+
+		ordered = data_frame.sort_values("frame", kind = "mergesort")
+		self.frame = ordered["frame"].to_numpy()
+		self.position = np.rint(ordered[["x", "y"]].to_numpy(dtype = float)).astype(int)
+		self.particle = ordered["particle"].to_numpy()
+
+		#Trails are sampled once every half pixel along each segment and sorted by the frame the segment ends in.
+		segments, particles, frames = trajectory_segments(data_frame)
+		difference = segments[:, 1] - segments[:, 0]
+		samples = np.maximum(np.ceil(np.hypot(difference[:, 0], difference[:, 1]) / 0.5).astype(int), 1)
+		segment = np.repeat(np.arange(len(segments)), samples)
+		t = (np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)) / samples[segment]
+		points = np.rint(segments[segment, 0] + t[:, None] * difference[segment]).astype(int)
+		order = np.argsort(frames[segment], kind = "stable")
+		self.trail_point = points[order]
+		self.trail_frame = frames[segment][order]
+		self.trail_particle = particles[segment][order]
+
+		angles = np.linspace(0, 2 * math.pi, max(int(2 * math.pi * radius * 2), 8), endpoint = False)
+		self.ring = np.unique(np.rint(np.column_stack((np.cos(angles), np.sin(angles))) * radius).astype(int), axis = 0)
+		"""The x and y offsets of the pixels of the circle drawn around each particle."""
+		self.glyphs = dict()
+		"""The x and y offsets of the pixels of the label of each particle ID drawn so far."""
+
+	def label(self, ID):
+		#Helper method that returns the x and y offsets of the pixels of a particle ID written in the digit bitmaps.
+
+		if ID not in self.glyphs:
+			offsets = []
+
+			for k, digit in enumerate(str(int(ID))):
+				y, x = np.nonzero(digits[int(digit)]) if digit != "-" else (np.array([2, 2, 2]), np.array([0, 1, 2]))
+				offsets.append(np.column_stack((x + 4 * k, y)))
+
+			#Each pixel of the digits becomes a square of label_scale pixels.
+			block = np.stack(np.meshgrid(np.arange(self.label_scale), np.arange(self.label_scale)), axis = -1).reshape(-1, 2)
+			self.glyphs[ID] = (np.concatenate(offsets)[:, None, :] * self.label_scale + block[None, :, :]).reshape(-1, 2)
+
+		return self.glyphs[ID]
+
+	def draw(self, frame, i):
+		"""
+		The method that draws the particles of a frame, their IDs and their trails over the greyscale frame.
+
+		Parameters:
+			frame (NumpyArray): The greyscale frame, either 8-bit or with brightness from 0 to 255.
+			i (int): The number of the frame.
+
+		Returns:
+			image (NumpyArray): The (height, width, 3) 8-bit RGB image.
+		"""
+		grey = frame if frame.dtype == np.uint8 else np.clip(frame, 0, 255).astype(np.uint8)
+		image = np.repeat(np.asarray(grey)[:, :, None], 3, axis = 2)
+		height, width = grey.shape
+
+		if self.trail > 0:
+			begin, end = np.searchsorted(self.trail_frame, (i - self.trail + 1, i + 1))
+			points = self.trail_point[begin: end]
+			alpha = (1 - (i - self.trail_frame[begin: end]) / self.trail).astype(np.float32)[:, None]
+			self.blend(image, points, self.palette[self.trail_particle[begin: end] % len(self.palette)], alpha)
+
+		begin, end = np.searchsorted(self.frame, (i, i + 1))
+		position = self.position[begin: end]
+		particle = self.particle[begin: end]
+		color = self.palette[particle % len(self.palette)]
+
+		ring = (position[:, None, :] + self.ring[None, :, :]).reshape(-1, 2)
+		self.blend(image, ring, np.repeat(color, len(self.ring), axis = 0), None)
+
+		if self.labels and len(particle) > 0:
+			glyphs = [self.label(ID) for ID in particle]
+			counts = np.array([len(g) for g in glyphs])
+			offset = np.array([self.ring[:, 0].max() + 2, -2 * self.label_scale])
+			pixels = np.concatenate(glyphs) + np.repeat(position + offset, counts, axis = 0)
+			self.blend(image, pixels, np.repeat(color, counts, axis = 0), None)
+
+		return image
+
+	@staticmethod
+	def blend(image, points, colors, alpha):
+		#Helper method that draws colored points onto an image, mixed with the pixels under them by alpha, leaving out those outside the image.
+
+		height, width = image.shape[:2]
+		inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+		x, y = points[inside, 0], points[inside, 1]
+
+		if alpha is None:
+			image[y, x] = colors[inside]
+		else:
+			a = alpha[inside]
+			image[y, x] = image[y, x] * (1 - a) + colors[inside] * a
+
+@st.instrumented
+def export_video(video_name, data_frame, output_name, start_frame = 0, length = None, fps = 30, trail = 30, radius = 5, labels = True,
+				label_scale = 1, codec = "libx264", options = None, queue_size = 16):
+	"""
+		The function that writes a video of the source footage with each particle's position, ID and fading trail drawn on it. Decoding, drawing
+		and encoding run at once in a pipeline of two threads and the calling thread, joined by bounded queues. The frames written are counted
+		as "frames annotated" in the active run_report, whose record of the stage gives the time taken.
+
+		Parameters:
+			video_name (String): The name of the video stored in the Recordings folder, or of a .npy file written by transcode.
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			output_name (String): The name of the video file to write, such as "annotated.mp4".
+			start_frame (int): The first frame of the video to draw.
+			length (int): The number of frames to draw. Leave blank to draw until the end of the video.
+			fps (double): The frame rate of the annotated video, such as slower than the camera's so that fast motion can be followed.
+			trail (int): The number of frames each trail fades over. Set to 0 to draw no trails.
+			radius (int): The radius in pixels of the circle drawn around each particle.
+			labels (boolean): Whether to write the ID of each particle next to it.
+			label_scale (int): The size in pixels of each pixel of the digits of the labels.
+			codec (String): The codec PyAV encodes with, such as "libx264", "mpeg4" or "ffv1".
+			options (Dictionary): The options of the codec. Leave blank to use the veryfast preset of libx264, which encodes over twice as fast
+				as its default, or the default options of other codecs.
+			queue_size (int): The number of frames each queue holds before the stage filling it waits.
+
+		Returns:
+			stats (Dictionary): The frames written, the seconds taken and the frames written per second.
+	"""
+	begin = time.perf_counter()
+	video_frames = st.process_video(video_name, decode_grey = not video_name.endswith(".npy"))
+	stop = len(video_frames) if length is None else min(start_frame + length, len(video_frames))
+	annotator = video_annotator(data_frame, trail, radius, labels, label_scale)
+
+	decoded = queue.Queue(queue_size)
+	drawn = queue.Queue(queue_size)
+	cancelled = threading.Event()
+
+	def put(q, item):
+		#Helper function that waits for room in a queue until the item fits, returning False if the pipeline is cancelled first.
+
+		while not cancelled.is_set():
+			try:
+				q.put(item, timeout = 0.1)
+
+				return True
+			except queue.Full:
+				pass
+
+		return False
+
+	def get(q):
+		#Helper function that waits for an item of a queue, returning None if the pipeline is cancelled first.
+
+		while not cancelled.is_set():
+			try:
+				return q.get(timeout = 0.1)
+			except queue.Empty:
+				pass
+
+		return None
+
+	#Each stage passes on None once it's finished, or the exception that stopped it so that the calling thread raises it, and stops waiting
+	#on its queues once the calling thread cancels the pipeline, such as when the encoder fails.
+	def decode():
+		try:
+			for i in range(start_frame, stop):
+				if not put(decoded, (i, video_frames[i])):
+					return
+		except Exception as error:
+			put(decoded, error)
+
+		put(decoded, None)
+
+	def draw():
+		while True:
+			item = get(decoded)
+
+			if item is None or isinstance(item, Exception):
+				put(drawn, item)
+
+				if item is None:
+					return
+
+				continue
+
+			try:
+				if not put(drawn, annotator.draw(item[1], item[0])):
+					return
+			except Exception as error:
+				put(drawn, error)
+				put(drawn, None)
+
+				return
+
+	height, width = video_frames.frame_shape[:2]
+	container = av.open(output_name, "w")
+	stream = container.add_stream(codec, rate = fps, options = options if options is not None else {"preset": "veryfast"} if codec == "libx264" else {})
+	stream.thread_type = "AUTO"
+
+	#Codecs subsampling chroma need an even width and height, so an odd last row or column is left out.
+	if codec != "ffv1":
+		height, width = height - height % 2, width - width % 2
+		stream.pix_fmt = "yuv420p"
+
+	stream.width = width
+	stream.height = height
+
+	threads = [threading.Thread(target = decode, daemon = True), threading.Thread(target = draw, daemon = True)]
+
+	for thread in threads:
+		thread.start()
+
+	frames = 0
+
+	try:
+		while True:
+			item = drawn.get()
+
+			if item is None:
+				break
+
+			if isinstance(item, Exception):
+				raise item
+
+			for packet in stream.encode(av.VideoFrame.from_ndarray(np.ascontiguousarray(item[:height, :width]), format = "rgb24")):
+				container.mux(packet)
+
+			frames += 1
+
+		for packet in stream.encode():
+			container.mux(packet)
+	finally:
+		cancelled.set()
+
+		for thread in threads:
+			thread.join()
+
+		container.close()
+
+	elapsed = time.perf_counter() - begin
+	st.count("frames annotated", frames)
+
+	return dict({"frames": frames, "seconds": elapsed, "frames_per_second": frames / elapsed if elapsed > 0 else None})
@@ -8,13 +8,221 @@ import trackpy as tp
 import av
 import pims
 import math
+import cProfile
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+	import resource
+except ImportError:
+	resource = None
 
 import pandas as pd
 from pandas import DataFrame, Series
+from scipy.spatial import cKDTree
 
 frames_per_second = 1000
 """The frames per second of the camera being used"""
 
+def peak_rss():
+	#Helper function that returns the peak resident memory of the process in megabytes, or None where it can't be read, as on Windows.
+	#Linux gives ru_maxrss in kilobytes and macOS gives it in bytes.
+
+	if resource is None:
+		return None
+
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 1024)
+
+def child_cpu_time():
+	#Helper function that returns the CPU seconds used by the child processes that have finished and been waited for, such as the workers
+	#of a closed pool, or None where it can't be read.
+
+	if resource is None:
+		return None
+
+	usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+	return usage.ru_utime + usage.ru_stime
+
+class run_report:
+	"""
+		This is a class recording the wall time, CPU time, memory, rows and frame rate of each stage of the pipeline, and counters of the work
+		done inside them, while it is active as a context manager. Stages that run outside an active report aren't recorded. The CPU time of
+		the worker processes of a stage is recorded apart from the process's own once the workers have exited, which a stage's pool does
+		before the stage ends, and the peak memory is only the process's own.
+	"""
+
+	active = None
+	"""The run_report recording the stages currently running, or None."""
+
+	def __init__(self, trace_memory = False, profile_stage = None, profile_name = "profile"):
+		"""
+			The constructor of the run_report class.
+
+			Parameters:
+				trace_memory (boolean): Whether to record the peak memory allocated by Python in each stage with tracemalloc, which slows the stages down.
+				profile_stage (String): The name of the stage to run under cProfile, such as "postfiltering", or None to profile no stage.
+				profile_name (String): The prefix of the file the profile of the stage is dumped to, followed by the stage name and ".prof".
+		"""
+		self.trace_memory = trace_memory
+		self.profile_stage = profile_stage
+		self.profile_name = profile_name
+		self.stages = []
+		self.counters = dict()
+		self.depth = 0
+
+	def __enter__(self):
+		run_report.active = self
+		self.begin = time.perf_counter()
+
+		if self.trace_memory:
+			tracemalloc.start()
+
+		return self
+
+	def __exit__(self, *exception):
+		run_report.active = None
+		self.wall_time = time.perf_counter() - self.begin
+
+		if self.trace_memory:
+			tracemalloc.stop()
+
+	def count(self, name, amount = 1):
+		"""
+			The function that adds to a counter of the work done inside the stages.
+
+			Parameters:
+				name (String): The name of the counter.
+				amount (int): The amount to add.
+		"""
+		self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+	def peak(self, name, value):
+		"""
+			The function that raises a counter to a value, for counters of the largest amount seen inside the stages rather than a total.
+
+			Parameters:
+				name (String): The name of the counter.
+				value (int): The amount seen.
+		"""
+		self.counters[name] = max(self.counters.get(name, 0), int(value))
+
+	def run(self, function, args, kwargs):
+		"""
+			The function that runs a stage of the pipeline and records it.
+
+			Parameters:
+				function (function): The stage to run.
+				args (tuple): The positional arguments of the stage.
+				kwargs (Dictionary): The keyword arguments of the stage.
+
+			Returns:
+				result: The result of the stage.
+		"""
+		record = dict({"stage": function.__name__, "depth": self.depth})
+		record["rows_in"] = len(args[0]) if len(args) > 0 and isinstance(args[0], DataFrame) else None
+		profiler = cProfile.Profile() if function.__name__ == self.profile_stage else None
+
+		if self.trace_memory:
+			traced_begin = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+
+		rss_begin = peak_rss()
+		child_begin = child_cpu_time()
+		cpu_begin = time.process_time()
+		wall_begin = time.perf_counter()
+		self.depth += 1
+
+		try:
+			if profiler is not None:
+				profiler.enable()
+
+			result = function(*args, **kwargs)
+		finally:
+			if profiler is not None:
+				profiler.disable()
+
+			self.depth -= 1
+
+		record["wall_time"] = time.perf_counter() - wall_begin
+		record["cpu_time"] = time.process_time() - cpu_begin
+		record["child_cpu_time"] = None if child_begin is None else child_cpu_time() - child_begin
+		record["peak_rss_mb"] = peak_rss()
+		record["rss_growth_mb"] = None if rss_begin is None else record["peak_rss_mb"] - rss_begin
+
+		if self.trace_memory:
+			record["traced_peak_mb"] = (tracemalloc.get_traced_memory()[1] - traced_begin) / 2 ** 20
+
+		output = result[0] if isinstance(result, tuple) else result
+		record["rows_out"] = len(output) if hasattr(output, "__len__") else None
+
+		#The frame rate is of the frames in the output, or in the input if the output has none.
+		for data_frame in (output, args[0] if len(args) > 0 else None):
+			if isinstance(data_frame, DataFrame) and "frame" in data_frame and len(data_frame) > 0:
+				record["frames"] = int(data_frame["frame"].max() - data_frame["frame"].min() + 1)
+				record["frames_per_second"] = record["frames"] / record["wall_time"] if record["wall_time"] > 0 else None
+				break
+
+		if profiler is not None:
+			record["profile"] = "{}_{}.prof".format(self.profile_name, function.__name__)
+			profiler.dump_stats(record["profile"])
+
+		self.stages.append(record)
+
+		return result
+
+	def to_dict(self):
+		"""
+			The function that returns the report as a Dictionary of built-in types.
+
+			Returns:
+				report (Dictionary): The Dictionary of the stages in the order they finished, the counters and the total wall time.
+		"""
+		return dict({"stages": self.stages, "counters": self.counters, "wall_time": getattr(self, "wall_time", time.perf_counter() - self.begin)})
+
+	def write(self, file_name = "report.json"):
+		"""
+			The function that writes the report to a json file.
+
+			Parameters:
+				file_name (String): The name of the json file.
+		"""
+		with open(file_name, "w") as file:
+			json.dump(self.to_dict(), file, indent = 4)
+
+def instrumented(function):
+	#Helper decorator that records a stage of the pipeline in the active run_report, adding nothing but a check when no report is active.
+
+	@functools.wraps(function)
+	def stage(*args, **kwargs):
+		if run_report.active is None:
+			return function(*args, **kwargs)
+
+		return run_report.active.run(function, args, kwargs)
+
+	return stage
+
+def count(name, amount = 1):
+	#Helper function that adds to a counter of the active run_report, if there is one.
+
+	if run_report.active is not None:
+		run_report.active.count(name, amount)
+
+def peak(name, value):
+	#Helper function that raises a counter of the active run_report to a value, if there is one.
+
+	if run_report.active is not None:
+		run_report.active.peak(name, value)
+
 class particle:
 	"""This is a class representing a single particle found by Trackpy"""
 
@@ -144,60 +352,1202 @@ class particle:
 		self.calc_accel()
 		self.calc_jerk()
 
-def get_cos(v1, v2):
-	#Helper function to get the angle of two vectors.
+def get_cos(v1, v2):
+	#Helper function to get the angle of two vectors.
+
+	numerator = v1[0] * v2[0] + v1[1] * v2[1]
+	denominator = math.sqrt(math.pow(v1[0], 2) + math.pow(v1[1], 2)) * math.sqrt(math.pow(v2[0], 2) + math.pow(v2[1], 2))
+
+	return numerator / denominator
+
+class particle_store:
+	"""This is a class representing every particle found by Trackpy as contiguous arrays, in place of a Dictionary of particles"""
+
+	def __init__(self, data_frame):
+		"""
+		The method that builds the arrays from TrackPy's trajectory DataFrame in a single pass, ordering the rows by particle and frame.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+		"""
+		frame = data_frame["frame"].to_numpy()
+		ID = data_frame["particle"].to_numpy().astype(np.int64)
+		order = np.lexsort((frame, ID))
+
+		self.index = data_frame.index.to_numpy()[order]
+		"""The integer array of DataFrame indices generated by Trackpy of each row."""
+		self.position = data_frame[["x", "y"]].to_numpy(dtype = float)[order]
+		"""The double array of (x, y) positions of each row, in pixels."""
+		self.err = data_frame["ep"].to_numpy(dtype = float)[order] / 2
+		"""The double array of positional errors of each row."""
+		self.frame = frame[order]
+		"""The integer array of frames of each row."""
+		self.diameter = data_frame["size"].to_numpy(dtype = float)[order] * 2
+		"""The double array of particle diameters of each row, in pixels."""
+		self.ecc = data_frame["ecc"].to_numpy(dtype = float)[order]
+		"""The double array of particle eccentricities of each row."""
+		self.particle = ID[order]
+		"""The integer array of particle IDs of each row, which split and merge relabel in place."""
+		self.kept = np.ones(len(order), dtype = bool)
+		"""The boolean array of whether each row passes filtering, in place of particle.used_index."""
+
+		start = np.ones(len(order), dtype = bool)
+		start[1:] = self.particle[1:] != self.particle[:-1]
+
+		self.offset = np.flatnonzero(start)
+		"""The integer array of the first row of each contiguous run of rows sharing a particle ID."""
+		self.length = np.diff(np.append(self.offset, len(order)))
+		"""The integer array of the amount of rows in each contiguous run."""
+
+	def segments(self, ID):
+		"""
+		The method that finds the contiguous runs of rows belonging to a particle.
+
+		Parameters:
+			ID (int): The particle ID.
+
+		Returns:
+			segments (integer array): The positions in offset and length of the particle's runs.
+		"""
+		return np.flatnonzero(self.particle[self.offset] == ID)
+
+	def rows(self, ID, kept = True):
+		"""
+		The method that finds the rows belonging to a particle, in order of frame.
+
+		Parameters:
+			ID (int): The particle ID.
+			kept (boolean): Whether to only find the rows that pass filtering.
+
+		Returns:
+			rows (integer array): The positions of the particle's rows in the arrays.
+		"""
+		segments = self.segments(ID)
+
+		if len(segments) == 1:
+			rows = np.arange(self.offset[segments[0]], self.offset[segments[0]] + self.length[segments[0]])
+		else:
+			rows = np.concatenate([np.arange(self.offset[s], self.offset[s] + self.length[s]) for s in segments] + [np.zeros(0, dtype = np.int64)])
+			rows = rows[np.argsort(self.frame[rows], kind = "mergesort")]
+
+		return rows[self.kept[rows]] if kept else rows
+
+	def next_ID(self):
+		"""
+		The method that finds the smallest particle ID above every ID in the store.
+
+		Returns:
+			ID (int): The next unused particle ID.
+		"""
+		return int(self.particle.max()) + 1 if len(self.particle) > 0 else 0
+
+	def split(self, irregular, filter_stub = 0):
+		"""
+		The method that splits particles into new particles at their irregular motions by relabelling their rows in place, all in one pass, as done
+		by split. The pieces take new IDs in order of particle ID and frame.
+
+		Parameters:
+			irregular (Dictionary of integer lists): The DataFrame indices where an irregular motion occurs, which each begin a new particle, of each
+				particle being split with the format {keys = ID: values: indices}.
+			filter_stub (int): The minimum amount of frames the recoverable trajectories must persist for.
+
+		Returns:
+			IDs (integer array): The IDs of the new particles that persist for at least filter_stub frames.
+			origins (integer array): The ID of the particle each of them was split from.
+		"""
+		IDs = np.fromiter(irregular.keys(), dtype = np.int64, count = len(irregular))
+		cuts = np.concatenate([np.asarray(i).reshape(-1) for i in irregular.values()] + [np.zeros(0, dtype = self.index.dtype)])
+
+		rows = np.flatnonzero(np.isin(self.particle, IDs))
+		rows = rows[np.lexsort((self.frame[rows], self.particle[rows]))]
+		ID = self.particle[rows]
+
+		#Every particle begins a piece and every irregular motion begins the next, so a particle cut n times takes n + 1 IDs.
+		first = np.concatenate(([True], ID[1:] != ID[:-1])) if len(rows) > 0 else np.zeros(0, dtype = bool)
+		start = np.isin(self.index[rows], cuts)
+		piece = np.cumsum(first.astype(np.int64) + start) - 1
+		pieces = int(piece.max(initial = -1)) + 1
+		new_ID = self.next_ID()
+
+		self.particle[rows] = new_ID + piece
+		self.offset = np.union1d(self.offset, rows[first | start])
+		self.length = np.diff(np.append(self.offset, len(self.particle)))
+
+		stub = np.bincount(piece[self.kept[rows]], minlength = pieces) < filter_stub
+		self.kept[rows[stub[piece]]] = False
+
+		origins = np.zeros(pieces, dtype = np.int64)
+		origins[piece] = ID
+
+		return new_ID + np.flatnonzero(~stub), origins[~stub]
+
+	def merge(self, ID, other):
+		"""
+		The method that merges a particle into another by relabelling its rows in place, as done by merge.
+
+		Parameters:
+			ID (int): The ID of the particle that absorbs the other.
+			other (int): The ID of the particle being absorbed.
+		"""
+		for s in self.segments(other):
+			self.particle[self.offset[s]: self.offset[s] + self.length[s]] = ID
+
+	def remove(self, IDs):
+		"""
+		The method that removes particles from the rows that pass filtering.
+
+		Parameters:
+			IDs (integer array): The IDs of the particles being removed.
+		"""
+		self.kept[np.isin(self.particle, np.asarray(IDs, dtype = np.int64))] = False
+
+	def to_frame(self, data_frame):
+		"""
+		The method that selects the kept rows of a DataFrame with their particle IDs relabelled, in place of data_frame.loc[particle.used_index].
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information the store was built from.
+
+		Returns:
+			t (DataFrame): The DataFrame of trajectory information of the kept rows in order of DataFrame index.
+		"""
+		order = np.argsort(self.index[self.kept], kind = "mergesort")
+
+		t = data_frame.loc[self.index[self.kept][order]].copy()
+		t["particle"] = self.particle[self.kept][order]
+
+		return t
+
+	def get_memory(self):
+		"""
+		The method that calculates the memory used by the arrays of the store.
+
+		Returns:
+			nbytes (int): The amount of bytes used by the arrays.
+		"""
+		return sum(a.nbytes for a in (self.index, self.position, self.err, self.frame, self.diameter, self.ecc, self.particle, self.kept,
+									self.offset, self.length))
+
+grey_weights = np.array([0.2125, 0.7154, 0.0721], dtype = np.float32)
+"""The BT.709 luma weights of the red, green and blue channels of a frame."""
+
+@pims.pipeline
+def to_grey(frame):
+	"""
+		The function that converts a NumpyArray to greyscale.
+
+		Parameters:
+			frame (NumpyArray): The NumpyArray representing a video frame.
+
+		Returns:
+			frame (NumpyArray): The NumpyArray taken in and converted to greyscale.
+	"""
+	red = frame[:, :, 0]
+	green = frame[:, :, 1]
+	blue = frame[:, :, 2]
+
+	return red * 0.2125 + green * 0.7154 + blue * 0.0721
+
+class grey_converter:
+	"""
+		This is a class converting video frames to greyscale without any float64 temporaries, accumulating the weighted channels in float32
+		scratch buffers reused across frames. Each frame returned is a new NumpyArray, so frames can be kept or stacked.
+	"""
+
+	def __init__(self, dtype = np.float32):
+		self.dtype = np.dtype(dtype)
+		"""The dtype of the greyscale frames."""
+		self.buffers = threading.local()
+		"""The scratch buffers of each thread, holding a float32 weighted channel and, for other dtypes, the float32 weighted sum. Trackpy reads
+		frames from two threads when it locates features with a process pool, so the threads must not share buffers."""
+
+	def convert(self, frame):
+		"""
+		The method that converts a NumpyArray to greyscale.
+
+		Parameters:
+			frame (NumpyArray): The NumpyArray representing a video frame.
+
+		Returns:
+			frame (NumpyArray): The new NumpyArray of the frame taken in converted to greyscale.
+		"""
+		buffers = self.buffers
+
+		if getattr(buffers, "scratch", None) is None or buffers.scratch.shape != frame.shape[:2]:
+			buffers.scratch = np.empty(frame.shape[:2], dtype = np.float32)
+			buffers.sum = None if self.dtype == np.float32 else np.empty(frame.shape[:2], dtype = np.float32)
+
+		#A float32 frame is summed straight into the array returned, and other dtypes are summed into a buffer and then cast into it.
+		output = np.empty(frame.shape[:2], dtype = self.dtype)
+		total = output if buffers.sum is None else buffers.sum
+
+		np.multiply(frame[:, :, 0], grey_weights[0], out = total, dtype = np.float32)
+
+		for channel in (1, 2):
+			np.multiply(frame[:, :, channel], grey_weights[channel], out = buffers.scratch, dtype = np.float32)
+			total += buffers.scratch
+
+		if total is not output:
+			if np.issubdtype(self.dtype, np.integer):
+				np.rint(total, out = total)
+
+			np.copyto(output, total, casting = "unsafe")
+
+		return pims.Frame(output, frame_no = getattr(frame, "frame_no", None))
+
+class grey_reader(pims.FramesSequence):
+	"""This is a class reading a video with PyAV decoded straight to 8-bit greyscale, so that no RGB frame is ever made"""
+
+	def __init__(self, video_name, fast_forward = 32, cache_size = 16):
+		"""
+		The method that opens the video and finds the timestamp of its first frame.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
+			fast_forward (int): The maximum number of frames the reader decodes through before seeking instead.
+			cache_size (int): The number of recently decoded frames kept in memory.
+		"""
+		self.container = av.open(video_name)
+		self.stream = self.container.streams.video[0]
+		"""The PyAV video stream being decoded."""
+		self.fast_forward = fast_forward
+		self.next_frame = None
+		"""The number of the next frame the decoder will produce, or None if unknown."""
+		self.cache = [None] * cache_size
+		"""The list of recently decoded frames, indexed by frame number modulo the cache size."""
+		self.lock = threading.Lock()
+		"""The lock keeping threads from using the decoder at the same time."""
+
+		try:
+			self.duration = self.stream.duration * self.stream.time_base
+		except TypeError:
+			self.duration = self.container.duration / av.time_base
+
+		self.length = self.stream.frames if self.stream.frames > 0 else int(self.duration * self.stream.average_rate)
+		"""The number of frames counted by the container, or estimated from the duration until decoding runs out of frames before it."""
+
+		self.first_pts = next(self.container.decode(self.stream)).pts
+		self.seek(0)
+
+	def __len__(self):
+		return self.length
+
+	@property
+	def frame_shape(self):
+		return (self.stream.height, self.stream.width)
+
+	@property
+	def pixel_type(self):
+		return np.uint8
+
+	def seek(self, i):
+		"""
+		The method that moves the decoder to the keyframe before a frame.
+
+		Parameters:
+			i (int): The frame to seek to.
+		"""
+		self.container.seek(int(i / (self.stream.average_rate * self.stream.time_base)) + self.first_pts, stream = self.stream)
+		self.frames = self.container.decode(self.stream)
+		self.next_frame = None
+
+	def get_frame(self, i):
+		"""
+		The method that decodes a frame of the video to greyscale.
+
+		Parameters:
+			i (int): The frame to decode.
+
+		Returns:
+			frame (NumpyArray): The NumpyArray of the greyscale frame.
+		"""
+		with self.lock:
+			cached = self.cache[i % len(self.cache)]
+
+			if cached is None or cached.frame_no != i:
+				cached = self.decode(i)
+				self.cache[i % len(self.cache)] = cached
+
+			return cached
+
+	def decode(self, i):
+		#Helper method that decodes forward to a frame, seeking first if the frame is behind the decoder or too far ahead of it.
+
+		target = i
+
+		while True:
+			seeked = self.next_frame is None or not self.next_frame <= i <= self.next_frame + self.fast_forward
+
+			if seeked:
+				self.seek(target)
+
+			for frame in self.frames:
+				number = int(round((frame.pts - self.first_pts) * self.stream.time_base * self.stream.average_rate))
+
+				#Seeking can land after the frame, in which case the decoder seeks further back.
+				if seeked and number > i and target > 0:
+					break
+
+				seeked = False
+				self.next_frame = number + 1
+
+				if number >= i:
+					return pims.Frame(frame.to_ndarray(format = "gray"), frame_no = i)
+			else:
+				#The duration overestimated the frames, so the video ends at the last frame decoded.
+				if self.next_frame is not None:
+					self.length = min(self.length, self.next_frame)
+
+				self.next_frame = None
+
+				raise IndexError("Frame {} is past the last frame of the video".format(i))
+
+			target = max(target - 16, 0)
+			self.next_frame = None
+
+class frame_store(pims.FramesSequence):
+	"""This is a class reading the greyscale frames of a video transcoded by transcode from a memory-mapped file, without decoding"""
+
+	def __init__(self, store_name):
+		"""
+		The method that maps the frames and reads the header of the store.
+
+		Parameters:
+			store_name (String): The name of the .npy file written by transcode.
+		"""
+		self.frames = np.load(store_name, mmap_mode = "r")
+		"""The memory-mapped NumpyArray of every frame."""
+
+		with open(os.path.splitext(store_name)[0] + ".json") as file:
+			self.header = json.load(file)
+			"""The Dictionary of the shape, dtype, frame rate and source video of the frames, and the dtype and decoding transcode was given."""
+
+	def __len__(self):
+		return self.frames.shape[0]
+
+	@property
+	def frame_shape(self):
+		return self.frames.shape[1:]
+
+	@property
+	def pixel_type(self):
+		return self.frames.dtype
+
+	@property
+	def frame_rate(self):
+		return self.header["fps"]
+
+	def get_frame(self, i):
+		"""
+		The method that returns a frame as a view of the mapped file, without copying.
+
+		Parameters:
+			i (int): The frame to return.
+
+		Returns:
+			frame (NumpyArray): The NumpyArray of the greyscale frame.
+		"""
+		return pims.Frame(self.frames[i], frame_no = i)
+
+def transcode(video_name, store_name = None, dtype = np.uint8, decode_grey = False, overwrite = False):
+	"""
+		The function that converts a video to greyscale once and writes every frame to a file that process_video can memory-map.
+
+		Parameters:
+			video_name (String): The name of the video to be transcoded stored in the Recordings folder.
+			store_name (String): The name of the .npy file to write, next to which a .json header is written. Leave blank to replace the
+				extension of video_name with .npy.
+			dtype (numpy dtype): The dtype of the greyscale frames passed to process_video.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale.
+			overwrite (boolean): Whether to transcode again even if the store was written from the same video with the same dtype and decoding.
+
+		Returns:
+			store_name (String): The name of the .npy file, to be passed to process_video in place of the video name.
+	"""
+	if store_name is None:
+		store_name = os.path.splitext(video_name)[0] + ".npy"
+
+	header_name = os.path.splitext(store_name)[0] + ".json"
+	stat = os.stat(video_name)
+
+	if not overwrite and os.path.exists(store_name) and os.path.exists(header_name):
+		with open(header_name) as file:
+			header = json.load(file)
+
+		#A store written with another dtype or decoding holds different frames, so it's only reused if both match.
+		if (header["source_size"] == stat.st_size and header["source_mtime"] == stat.st_mtime_ns
+			and header.get("requested_dtype") == np.dtype(dtype).name and header.get("decode_grey") == bool(decode_grey)):
+			return store_name
+
+	content = hashlib.sha1()
+
+	with open(video_name, "rb") as video:
+		for block in iter(lambda: video.read(2 ** 20), b""):
+			content.update(block)
+
+	video_frames = process_video(video_name, dtype, decode_grey)
+	first = video_frames[0]
+	frames = np.lib.format.open_memmap(store_name + ".tmp", mode = "w+", dtype = first.dtype, shape = (len(video_frames),) + first.shape)
+
+	for i in range(len(video_frames)):
+		frames[i] = video_frames[i]
+
+	frames.flush()
+	del frames
+	os.replace(store_name + ".tmp", store_name)
+
+	header = dict(shape = [len(video_frames)] + list(first.shape), dtype = first.dtype.name, fps = float(pims.PyAVReaderTimed(video_name).frame_rate),
+				source = os.path.abspath(video_name), source_size = stat.st_size, source_mtime = stat.st_mtime_ns, source_hash = content.hexdigest(),
+				requested_dtype = np.dtype(dtype).name, decode_grey = bool(decode_grey))
+
+	with open(header_name, "w") as file:
+		json.dump(header, file)
+
+	return store_name
+
+class frame_cropper:
+	"""This is a class cropping video frames to a region of interest as views of the frames, so no pixels are copied"""
+
+	def __init__(self, roi):
+		self.roi = tuple(int(r) for r in roi)
+		"""The (x, y, width, height) rectangle of the region of interest, in pixels."""
+
+	def crop(self, frame):
+		"""
+		The method that crops a frame to the region of interest.
+
+		Parameters:
+			frame (NumpyArray): The NumpyArray representing a video frame.
+
+		Returns:
+			frame (NumpyArray): The view of the region of interest of the frame.
+		"""
+		x, y, width, height = self.roi
+
+		return frame[y: y + height, x: x + width]
+
+def find_roi(video_name, start_frame = 0, length = None, samples = 64, projection = "max", threshold = None, margin = 8):
+	"""
+		The function that finds the rectangle of a video where particles move, from a temporal projection of a sample of frames.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder, or of a .npy file written by transcode.
+			start_frame (int): The first frame of the range the sample is taken from.
+			length (int): The number of frames of the range the sample is taken from. Leave blank to sample until the end of the video.
+			samples (int): The number of frames sampled evenly from the range.
+			projection (String): Either "max" to measure the activity of each pixel as its maximum brightness above its mean, or "variance" to
+				measure it as the standard deviation of its brightness.
+			threshold (double): The activity above which a pixel is active. Leave blank to use the median activity plus 6 robust standard deviations.
+			margin (int): The amount of pixels added to each side of the rectangle around the active pixels, such as the size of the particles.
+
+		Returns:
+			roi (integer tuple): The (x, y, width, height) rectangle of the region of interest, or of the whole frame if no pixel is active.
+	"""
+	video_frames = process_video(video_name, decode_grey = not video_name.endswith(".npy"))
+	stop = len(video_frames) if length is None else min(start_frame + length, len(video_frames))
+	height, width = video_frames.frame_shape[:2]
+
+	total = np.zeros((height, width))
+	square = np.zeros((height, width))
+	maximum = np.full((height, width), -np.inf)
+	sampled = np.unique(np.linspace(start_frame, stop - 1, samples).astype(int))
+
+	for i in sampled:
+		frame = np.asarray(video_frames[i], dtype = float)
+		frame = frame if frame.ndim == 2 else frame @ grey_weights
+		total += frame
+		square += frame ** 2
+		np.maximum(maximum, frame, out = maximum)
+
+	mean = total / len(sampled)
+	activity = maximum - mean if projection == "max" else np.sqrt(np.maximum(square / len(sampled) - mean ** 2, 0))
+
+	if threshold is None:
+		median = np.median(activity)
+		threshold = median + 6 * 1.4826 * np.median(np.abs(activity - median))
+
+	#Rows and columns need two active pixels so that single noisy pixels don't stretch the rectangle.
+	active = activity > threshold
+	columns = np.flatnonzero(active.sum(axis = 0) >= 2)
+	rows = np.flatnonzero(active.sum(axis = 1) >= 2)
+
+	if len(columns) == 0 or len(rows) == 0:
+		return (0, 0, width, height)
+
+	x0, x1 = max(columns[0] - margin, 0), min(columns[-1] + margin + 1, width)
+	y0, y1 = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, height)
+
+	return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+class background_subtractor:
+	"""
+		This is a class subtracting the static scenery from greyscale video frames, so that still specks, dust on the lens and stuck particles
+		are never detected, and optionally masking the tiles of each frame without motion so that Trackpy only searches the rest.
+	"""
+
+	def __init__(self, method = "median", rate = None, tile_size = None, threshold = None, samples = 32):
+		"""
+		The method that sets the parameters of the background model.
+
+		Parameters:
+			method (String): Either "median" to track the background with a running median, moving each pixel a fixed step towards each frame,
+				or "exponential" to track it with an exponential moving average.
+			rate (double): The step in grey levels each pixel of a running median moves by each frame, or the weight of each frame in an
+				exponential moving average. Leave blank for 0.5 grey levels or 0.02.
+			tile_size (int): The size in pixels of the square tiles of the motion mask, which should be larger than the particles. Leave blank
+				to keep whole frames.
+			threshold (double): The brightness above the background a tile needs to be active. Leave blank to use 6 times the noise of the
+				background measured by fit.
+			samples (int): The number of frames sampled evenly from the video whose median starts the background.
+		"""
+		self.method = method
+		self.rate = rate if rate is not None else 0.5 if method == "median" else 0.02
+		self.tile_size = tile_size
+		self.threshold = threshold
+		self.samples = samples
+		self.background = None
+		"""The float32 NumpyArray of the current background, updated by each frame subtracted."""
+		self.noise = None
+		"""The robust standard deviation of the frames about the background, measured by fit."""
+
+	def identity(self):
+		"""
+		The method that returns the parameters of the background model, such as to identify the features it produces in a feature_cache.
+
+		Returns:
+			identity (dict): The dictionary of the method, rate, tile size, threshold and samples.
+		"""
+		return dict(method = self.method, rate = float(self.rate), tile_size = self.tile_size, threshold = self.threshold, samples = self.samples)
+
+	def fit(self, video_frames, start = 0, stop = None):
+		"""
+		The method that starts the background as the median of frames sampled evenly from a range, so that anything still for more than half
+		of the range is part of it.
+
+		Parameters:
+			video_frames (list): The list of greyscale NumpyArrays representing the video frames.
+			start (int): The first frame of the range.
+			stop (int): The frame after the range. Leave blank to sample until the end of the video.
+
+		Returns:
+			self (background_subtractor): The fitted background model.
+		"""
+		stop = len(video_frames) if stop is None else min(stop, len(video_frames))
+		sampled = np.unique(np.linspace(start, stop - 1, self.samples).astype(int))
+		stack = np.stack([np.array(video_frames[i], dtype = np.float32, copy = True) for i in sampled])
+
+		self.background = np.median(stack, axis = 0).astype(np.float32)
+		self.noise = float(1.4826 * np.median(np.abs(stack - self.background)))
+
+		return self
+
+	def subtract(self, frame):
+		"""
+		The method that subtracts the background from a greyscale frame and then updates the background with it. Frames are expected roughly
+		in order, as the background follows the frames it's given.
+
+		Parameters:
+			frame (NumpyArray): The NumpyArray representing a greyscale video frame.
+
+		Returns:
+			frame (NumpyArray): The float32 brightness above the background, cropped to the active tiles of the motion mask with their offset
+				in the metadata, or an empty NumpyArray when no tile is active.
+		"""
+		image = np.asarray(frame, dtype = np.float32)
+
+		if self.background is None or self.background.shape != image.shape:
+			self.background = image.copy()
+			self.noise = 0.0
+
+		difference = image - self.background
+
+		if self.method == "median":
+			self.background += self.rate * np.sign(difference)
+		else:
+			self.background += self.rate * difference
+
+		np.maximum(difference, 0, out = difference)
+		frame_no = getattr(frame, "frame_no", None)
+
+		if self.tile_size is None:
+			return pims.Frame(difference, frame_no = frame_no)
+
+		#The tiles next to active ones are kept, so that particles crossing the edge of a tile are searched with the pixels around them.
+		size = self.tile_size
+		height, width = difference.shape
+		rows, columns = -(-height // size), -(-width // size)
+		padded = np.zeros((rows * size, columns * size), dtype = np.float32)
+		padded[:height, :width] = difference
+		threshold = self.threshold if self.threshold is not None else 6 * self.noise
+		tiles = padded.reshape(rows, size, columns, size).max(axis = (1, 3)) > threshold
+
+		active = tiles.copy()
+		active[1:] |= tiles[:-1]
+		active[:-1] |= tiles[1:]
+		active[:, 1:] |= active[:, :-1].copy()
+		active[:, :-1] |= active[:, 1:].copy()
+
+		if not active.any():
+			return pims.Frame(np.empty((0, 0), dtype = np.float32), frame_no = frame_no, metadata = dict(offset = (0, 0)))
+
+		padded *= np.repeat(np.repeat(active, size, axis = 0), size, axis = 1)
+		tile_rows = np.flatnonzero(active.any(axis = 1))
+		tile_columns = np.flatnonzero(active.any(axis = 0))
+		y0, y1 = tile_rows[0] * size, min((tile_rows[-1] + 1) * size, height)
+		x0, x1 = tile_columns[0] * size, min((tile_columns[-1] + 1) * size, width)
+
+		return pims.Frame(padded[y0: y1, x0: x1], frame_no = frame_no, metadata = dict(offset = (int(x0), int(y0))))
+
+def process_video(video_name, dtype = None, decode_grey = False, roi = None, background = None):
+	"""
+		The function that converts a video to a list of greyscale NumpyArrays.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder, or of a .npy file written by transcode
+				whose frames are returned as views of the mapped file.
+			dtype (numpy dtype): The dtype of the frames converted by a grey_converter, without float64 temporaries. Leave blank to convert
+				each frame to a new float64 NumpyArray with to_grey.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale, in which case dtype is ignored.
+			roi (integer tuple): The (x, y, width, height) rectangle each frame is cropped to before it's converted to greyscale, such as one found
+				by find_roi. Leave blank to keep whole frames.
+			background (background_subtractor): The background model subtracted from each greyscale frame. Leave blank to keep the scenery.
+	"""
+	if video_name.endswith(".npy") or decode_grey:
+		video_frames = frame_store(video_name) if video_name.endswith(".npy") else grey_reader(video_name)
+
+		if roi is not None:
+			video_frames = pims.pipeline(frame_cropper(roi).crop)(video_frames)
+	else:
+		video_frames = pims.PyAVReaderTimed(video_name)
+
+		if roi is not None:
+			video_frames = pims.pipeline(frame_cropper(roi).crop)(video_frames)
+
+		video_frames = to_grey(video_frames) if dtype is None else pims.pipeline(grey_converter(dtype).convert)(video_frames)
+
+	return video_frames if background is None else pims.pipeline(background.subtract)(video_frames)
+
+def locate_frames(video_frames, start, stop, particle_size, particle_minmass, noise, roi = None, stride = 1):
+	#Helper function that yields the DataFrame of features of each frame in a range of frames that has any features, keeping only the frames
+	#whose number is a multiple of stride and shifting the features of cropped and motion masked frames back to whole frame pixels.
+
+	for i in range(start + (-start) % stride, min(stop, len(video_frames)), stride):
+		#Readers whose length is estimated from the duration of the video can run out of frames before it.
+		try:
+			frame = video_frames[i]
+		except IndexError:
+			break
+
+		if frame.size == 0:
+			continue
+
+		f = tp.locate(frame, particle_size, minmass = particle_minmass, noise_size = noise).drop(columns = "frame", errors = "ignore")
+		f["frame"] = i
+		x, y = getattr(frame, "metadata", {}).get("offset", (0, 0))
+
+		if roi is not None:
+			x, y = x + roi[0], y + roi[1]
+
+		if x != 0 or y != 0:
+			f["x"] += x
+			f["y"] += y
+
+		if len(f) > 0:
+			yield f
+
+def locate_chunk(chunk):
+	#Helper function run by each worker process of evaluate_features, which opens its own reader and locates the features in a range of frames.
+	#Each chunk starts from its own copy of the background, so the features of a chunk don't depend on the chunks evaluated before it.
+
+	video_name, start, stop, particle_size, particle_minmass, noise, dtype, decode_grey, roi, stride, background = chunk
+	background = copy.deepcopy(background)
+	video_frames = process_video(video_name, dtype, decode_grey, roi, background)
+	features = list(locate_frames(video_frames, start, stop, particle_size, particle_minmass, noise, roi, stride))
+
+	return pd.concat(features, ignore_index = True) if len(features) > 0 else pd.DataFrame()
+
+class feature_cache:
+	"""This is a class storing the DataFrames of features found in videos on disk as Parquet files, one for each chunk of frames"""
+
+	def __init__(self, directory = "Cache", max_size = 2 ** 30, chunk_size = 100, hash_content = False):
+		"""
+		The method that creates the directory of the cache.
+
+		Parameters:
+			directory (String): The name of the directory the cache is stored in.
+			max_size (int): The maximum amount of bytes stored before the least recently used chunks are removed.
+			chunk_size (int): The number of frames in each chunk. Chunks begin at multiples of chunk_size so that overlapping ranges share them.
+			hash_content (boolean): Whether a video is identified by a hash of its contents instead of its modification time.
+		"""
+		self.directory = directory
+		self.max_size = max_size
+		self.chunk_size = chunk_size
+		self.hash_content = hash_content
+
+		os.makedirs(directory, exist_ok = True)
+
+	def key(self, video_name, particle_size, particle_minmass, noise, dtype = None, decode_grey = False, roi = None, stride = 1, background = None):
+		"""
+		The method that identifies the features found in a video with a set of detection parameters, in chunks of the cache's chunk_size.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			dtype (numpy dtype): The dtype of the greyscale frames passed to process_video.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale.
+			roi (integer tuple): The (x, y, width, height) rectangle the frames are cropped to.
+			stride (int): The step between the frames evaluated.
+			background (background_subtractor): The background model subtracted from the frames.
+
+		Returns:
+			key (String): The name of the directory holding the chunks of features.
+		"""
+		stat = os.stat(video_name)
+		identity = dict(video = os.path.abspath(video_name), size = stat.st_size, particle_size = int(particle_size), minmass = float(particle_minmass),
+						noise = float(noise), dtype = None if dtype is None else np.dtype(dtype).name, decode_grey = bool(decode_grey),
+						chunk_size = int(self.chunk_size))
+
+		#Whole frames without a stride keep the keys they had before cropping and striding were options.
+		if roi is not None:
+			identity["roi"] = [int(r) for r in roi]
+
+		if stride != 1:
+			identity["stride"] = int(stride)
+
+		if background is not None:
+			identity["background"] = background.identity()
+
+		if self.hash_content:
+			content = hashlib.sha1()
+
+			with open(video_name, "rb") as video:
+				for block in iter(lambda: video.read(2 ** 20), b""):
+					content.update(block)
+
+			identity["content"] = content.hexdigest()
+		else:
+			identity["mtime"] = stat.st_mtime_ns
+
+		key = hashlib.sha1(json.dumps(identity, sort_keys = True).encode()).hexdigest()
+
+		if not os.path.exists(os.path.join(self.directory, key)):
+			os.makedirs(os.path.join(self.directory, key))
+
+			with open(os.path.join(self.directory, key, "key.json"), "w") as file:
+				json.dump(identity, file)
+
+		return key
+
+	def path(self, key, start):
+		#Helper method that returns the name of the file of a chunk.
+
+		return os.path.join(self.directory, key, "{}.parquet".format(start))
+
+	def get(self, key, start):
+		"""
+		The method that reads a chunk of features, marking it as recently used.
+
+		Parameters:
+			key (String): The key generated by the key method.
+			start (int): The first frame of the chunk.
+
+		Returns:
+			f (DataFrame): The DataFrame of the features found in the chunk, or None if the chunk is not stored.
+		"""
+		if not os.path.exists(self.path(key, start)):
+			return None
+
+		os.utime(self.path(key, start))
+
+		return pd.read_parquet(self.path(key, start))
+
+	def put(self, key, start, data_frame):
+		"""
+		The method that stores a chunk of features.
+
+		Parameters:
+			key (String): The key generated by the key method.
+			start (int): The first frame of the chunk.
+			data_frame (DataFrame): The DataFrame of the features found in the chunk.
+		"""
+		data_frame.to_parquet(self.path(key, start) + ".tmp")
+		os.replace(self.path(key, start) + ".tmp", self.path(key, start))
+
+	def evict(self):
+		"""The method that removes the least recently used chunks until the cache is no larger than max_size, and the keys left without chunks."""
+		chunks = []
+
+		for key in os.listdir(self.directory):
+			for name in os.listdir(os.path.join(self.directory, key)):
+				if name.endswith(".parquet"):
+					stat = os.stat(os.path.join(self.directory, key, name))
+					chunks.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.directory, key, name)))
+
+		size = sum(chunk[1] for chunk in chunks)
+
+		for used, chunk_size, path in sorted(chunks):
+			if size <= self.max_size:
+				break
+
+			os.remove(path)
+			size -= chunk_size
+
+			if not any(name.endswith(".parquet") for name in os.listdir(os.path.dirname(path))):
+				for name in os.listdir(os.path.dirname(path)):
+					os.remove(os.path.join(os.path.dirname(path), name))
+
+				os.rmdir(os.path.dirname(path))
+
+	def clear(self, video_name = None):
+		"""
+		The method that invalidates the stored features.
+
+		Parameters:
+			video_name (String): The name of the video whose features are removed. Leave blank to remove every video's features.
+		"""
+		for key in os.listdir(self.directory):
+			if video_name is not None:
+				with open(os.path.join(self.directory, key, "key.json")) as file:
+					if json.load(file)["video"] != os.path.abspath(video_name):
+						continue
+
+			for name in os.listdir(os.path.join(self.directory, key)):
+				os.remove(os.path.join(self.directory, key, name))
+
+			os.rmdir(os.path.join(self.directory, key))
+
+@instrumented
+def evaluate_features(video_name, particle_size, particle_minmass, start_frame, length, noise, processes = 1, chunk_size = 100, dtype = None,
+					decode_grey = False, cache = None, roi = None, stride = 1, background = None):
+	"""
+		The function that  runs Trackpy's feature detection algorithm on the arrays.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			start_frame (int): The frame in the video from which to begin evaluation.
+			length (int): The number of frames to evaluate.
+			processes (int): The number of worker processes that each decode and locate chunks of frames. Leave as 1 to evaluate serially.
+			chunk_size (int): The number of frames given to a worker process at a time, and the number of frames each copy of the background
+				follows when evaluating serially.
+			dtype (numpy dtype): The dtype of the greyscale frames passed to process_video.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale.
+			cache (feature_cache): The cache to read features from, which only evaluates and stores the chunks of frames it is missing.
+			roi (integer tuple or String): The (x, y, width, height) rectangle the frames are cropped to before they're converted to greyscale, or
+				"auto" to find it with find_roi. The features are still given in whole frame pixels. Leave blank to evaluate whole frames.
+			stride (int): The step between the frames evaluated, which are those whose number is a multiple of it, such as for quick previews.
+			background (background_subtractor): The background model subtracted from each frame before Trackpy searches it. It's fitted to the
+				whole video if it hasn't been, and each chunk of chunk_size frames, or of the cache's chunk size, continues from the fitted
+				background whether it's evaluated serially or by a worker process.
+
+		Returns:
+			frame (DataFrame): The DataFrame of the features found in the video. The amount of frames evaluated, including those without features,
+				is counted as "frames evaluated" in the active run_report, whose record of the stage gives the time taken.
+	"""
+	if isinstance(roi, str):
+		roi = find_roi(video_name, start_frame, length, margin = particle_size)
+
+	if background is not None and background.background is None:
+		background.fit(process_video(video_name, dtype, decode_grey, roi))
+
+	if cache is not None:
+		key = cache.key(video_name, particle_size, particle_minmass, noise, dtype, decode_grey, roi, stride, background)
+		starts = range(start_frame - start_frame % cache.chunk_size, start_frame + length, cache.chunk_size)
+		chunks = [(video_name, i, i + cache.chunk_size, particle_size, particle_minmass, noise, dtype, decode_grey, roi, stride, background)
+				for i in starts if not os.path.exists(cache.path(key, i))]
+
+		if processes > 1 and len(chunks) > 1:
+			with multiprocessing.Pool(processes) as pool:
+				located = pool.map(locate_chunk, chunks)
+		else:
+			located = map(locate_chunk, chunks)
+
+		for chunk, features in zip(chunks, located):
+			cache.put(key, chunk[1], features)
+
+		f = pd.concat([cache.get(key, i) for i in starts], ignore_index = True)
+
+		if len(f) > 0:
+			f = f[(f["frame"] >= start_frame) & (f["frame"] < start_frame + length)].reset_index(drop = True)
+
+		cache.evict()
+
+	elif processes > 1 or background is not None:
+		#Serial runs with a background locate the same chunks as worker processes do, so that each chunk starts from the fitted background either way.
+		chunks = [(video_name, i, min(i + chunk_size, start_frame + length), particle_size, particle_minmass, noise, dtype, decode_grey, roi, stride, background)
+				for i in range(start_frame, start_frame + length, chunk_size)]
+
+		if processes > 1:
+			with multiprocessing.Pool(processes) as pool:
+				located = pool.map(locate_chunk, chunks)
+		else:
+			located = [locate_chunk(chunk) for chunk in chunks]
+
+		f = pd.concat(located, ignore_index = True)
+	else:
+		video_frames = process_video(video_name, dtype, decode_grey, roi)
+		f = tp.batch(video_frames[start_frame + (-start_frame) % stride: start_frame + length: stride], particle_size, minmass = particle_minmass,
+					noise_size = noise)
+
+		if roi is not None:
+			f["x"] += roi[0]
+			f["y"] += roi[1]
+
+	count("frames evaluated", len(range(start_frame + (-start_frame) % stride, start_frame + length, stride)))
+
+	return f
+
+class subnet_recorder:
+	"""
+		This is a class mixed into Trackpy predictors that counts the subnets the linker has to solve in each frame, the groups of predicted
+		positions and features connected by being within the search range of each other, when counting is set.
+	"""
+
+	counting = False
+	"""Whether to count the subnets, which takes a KDTree search of every frame."""
+
+	def wrap(self, linking_fcn, *args, **kw):
+		self.search_range = args[1] if len(args) > 1 else kw["search_range"]
+		self.predicted = None
+		self.frames = 0
+		self.features = 0
+		self.subnets = 0
+		"""The amount of subnets with more than one predicted position or feature."""
+		self.subnet_particles = 0
+		"""The total amount of predicted positions in those subnets."""
+		self.largest_subnet = 0
+		"""The largest amount of predicted positions in a subnet."""
+
+		return super().wrap(linking_fcn, *args, **kw)
+
+	def record(self, predicted):
+		#Helper method that keeps the positions predicted for the next frame, when counting.
+
+		predicted = np.asarray(predicted, dtype = float).reshape(-1, len(self.pos_columns))
+
+		if self.counting:
+			self.predicted = predicted
+
+		return predicted
+
+	def count_subnets(self, frame):
+		#Helper method that counts the subnets between the predicted positions and the features of a newly linked frame, when counting.
+
+		if not self.counting:
+			return
+
+		self.frames += 1
+		self.features += len(frame)
+
+		if self.predicted is None or len(self.predicted) == 0 or len(frame) == 0:
+			return
+
+		sources = len(self.predicted)
+		pairs = cKDTree(self.predicted).sparse_distance_matrix(cKDTree(frame[self.pos_columns].to_numpy(dtype = float)), self.search_range,
+															output_type = "ndarray")
+		i, j = pairs["i"], pairs["j"]
+
+		#Connected predicted positions and features share the smallest label among them, found by passing labels along the pairs until none change.
+		label = np.arange(sources + len(frame))
+		j = j + sources
+		changed = len(i) > 0
+
+		while changed:
+			smallest = np.minimum(label[i], label[j])
+			before = label.copy()
+			np.minimum.at(label, i, smallest)
+			np.minimum.at(label, j, smallest)
+			changed = np.any(label != before)
+
+		size = np.bincount(label[:sources], minlength = len(label))
+		shared = (size > 1) | (np.bincount(label[sources:], minlength = len(label)) > 1)
+
+		self.subnets += int(np.count_nonzero(shared & (size > 0)))
+		self.subnet_particles += int(size[shared].sum())
+		self.largest_subnet = max(self.largest_subnet, int(size[shared].max(initial = 0)))
+
+	def statistics(self):
+		"""
+		The method that returns the amount of frames and features linked and the subnets counted.
+
+		Returns:
+			statistics (Dictionary): The amount of frames, features, subnets, predicted positions in subnets and the largest subnet.
+		"""
+		return dict({"frames": self.frames, "features": self.features, "subnets": self.subnets, "subnet_particles": self.subnet_particles,
+					"largest_subnet": self.largest_subnet})
+
+class nearest_velocity_predict(subnet_recorder, tp.predict.NearestVelocityPredict):
+	"""This is a class adding subnet counts to Trackpy's NearestVelocityPredict"""
+
+	def observe(self, frame):
+		self.count_subnets(frame)
+		super().observe(frame)
+
+	def predict(self, t1, particles):
+		return self.record(super().predict(t1, particles))
+
+class ballistic_predict(subnet_recorder, tp.predict.NullPredict):
+	"""
+		This is a class predicting the position of every track at once from its last positions assuming constant acceleration, as for particles
+		falling along parabolic paths. Tracks with fewer than three positions use the given initial velocity or acceleration in place of the ones
+		they don't have yet.
+	"""
+
+	def __init__(self, velocity = (0, 0), acceleration = (0, 0), smoothing = 0.5):
+		"""
+		The constructor of the ballistic_predict class.
+
+		Parameters:
+			velocity (double tuple): The (x, y) velocity in pixels per frame assumed for tracks with a single position.
+			acceleration (double tuple): The (x, y) acceleration in pixels per frame squared assumed for tracks with fewer than three positions.
+			smoothing (double): The weight given to a track's previous acceleration when averaging it with the newest, from 0 to use only the newest.
+		"""
+		self.velocity = dict({"x": velocity[0], "y": velocity[1]})
+		self.acceleration = dict({"x": acceleration[0], "y": acceleration[1]})
+		self.smoothing = smoothing
+		self.position = np.zeros((0, 2, 2))
+		"""The double array of the last two positions of each track ID, in the order of pos_columns."""
+		self.time = np.zeros((0, 2))
+		"""The double array of the frames of the last two positions of each track ID."""
+		self.accel = np.zeros((0, 2))
+		"""The double array of the smoothed acceleration of each track ID."""
+		self.seen = np.zeros(0, dtype = int)
+		"""The integer array of the amount of positions of each track ID."""
+
+	def observe(self, frame):
+		self.count_subnets(frame)
+
+		ID = frame["particle"].to_numpy().astype(np.int64)
+		position = frame[self.pos_columns].to_numpy(dtype = float)
+		t = frame[self.t_column].to_numpy(dtype = float)
+
+		if len(ID) > 0 and ID.max() >= len(self.seen):
+			size = max(2 * len(self.seen), ID.max() + 1)
+			self.position = np.concatenate((self.position, np.zeros((size - len(self.seen), 2, len(self.pos_columns)))))
+			self.time = np.concatenate((self.time, np.zeros((size - len(self.seen), 2))))
+			self.accel = np.concatenate((self.accel, np.zeros((size - len(self.seen), len(self.pos_columns)))))
+			self.seen = np.concatenate((self.seen, np.zeros(size - len(self.seen), dtype = int)))
+
+		#The newest acceleration of each track with three positions is the change between its last two velocities.
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			vel = (position - self.position[ID, 1]) / (t - self.time[ID, 1])[:, None]
+			previous = (self.position[ID, 1] - self.position[ID, 0]) / (self.time[ID, 1] - self.time[ID, 0])[:, None]
+			accel = 2 * (vel - previous) / (t - self.time[ID, 0])[:, None]
+
+		first = self.seen[ID] == 2
+		later = self.seen[ID] > 2
+		self.accel[ID[first]] = accel[first]
+		self.accel[ID[later]] = self.smoothing * self.accel[ID[later]] + (1 - self.smoothing) * accel[later]
+
+		self.position[ID, 0] = self.position[ID, 1]
+		self.position[ID, 1] = position
+		self.time[ID, 0] = self.time[ID, 1]
+		self.time[ID, 1] = t
+		self.seen[ID] += 1
+
+	def predict(self, t1, particles):
+		particles = list(particles)
+		ID = np.fromiter((p.track.id for p in particles), dtype = np.int64, count = len(particles))
+		seen = self.seen[ID] if len(self.seen) > 0 else np.zeros(len(ID), dtype = int)
+
+		guess_velocity = np.array([self.velocity.get(c, 0) for c in self.pos_columns], dtype = float)
+		guess_acceleration = np.array([self.acceleration.get(c, 0) for c in self.pos_columns], dtype = float)
+
+		position = self.position[ID, 1]
+		dt = (t1 - self.time[ID, 1])[:, None]
+		accel = np.where((seen > 2)[:, None], self.accel[ID], guess_acceleration)
+
+		#The velocity at the last position is the velocity between the last two positions, moved on by half the time between them.
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			step = (self.time[ID, 1] - self.time[ID, 0])[:, None]
+			vel = (position - self.position[ID, 0]) / step + accel * step / 2
+
+		vel = np.where((seen > 1)[:, None], vel, guess_velocity)
+		predicted = position + vel * dt + accel * dt ** 2 / 2
+
+		#Tracks the predictor hasn't observed yet stay where they are.
+		unseen = seen == 0
+
+		if np.any(unseen):
+			predicted[unseen] = np.array([p.pos for p, u in zip(particles, unseen) if u])
+
+		return self.record(predicted)
+
+def make_predictor(predictor, velocity = (0, 0), acceleration = (0, 0), counting = False):
+	#Helper function that creates a fresh predictor of the given name, counting the subnets it links if counting is set.
+
+	if predictor == "velocity":
+		pred = nearest_velocity_predict()
+	elif predictor == "ballistic":
+		pred = ballistic_predict(velocity, acceleration)
+	else:
+		raise ValueError("Unknown predictor {}".format(predictor))
+
+	pred.counting = counting
 
-	numerator = v1[0] * v2[0] + v1[1] * v2[1]
-	denominator = math.sqrt(math.pow(v1[0], 2) + math.pow(v1[1], 2)) * math.sqrt(math.pow(v2[0], 2) + math.pow(v2[1], 2))
+	return pred
 
-	return numerator / denominator
+def link_chunk(chunk):
+	#Helper function that links the features of a DataFrame, given as a tuple so that it can be mapped by a Pool, returning the trajectories and statistics.
 
-@pims.pipeline
-def to_grey(frame):
-	"""
-		The function that converts a NumpyArray to greyscale.
+	data_frame, search_size, lb_search_size, step, particle_memory, predictor, velocity, acceleration, counting = chunk
+	pred = make_predictor(predictor, velocity, acceleration, counting)
 
-		Parameters:
-			frame (NumpyArray): The NumpyArray representing a video frame.
+	if len(data_frame) == 0:
+		return data_frame.assign(particle = np.zeros(0, dtype = int)), dict({"frames": 0, "features": 0, "subnets": 0, "subnet_particles": 0,
+																		"largest_subnet": 0})
 
-		Returns:
-			frame (NumpyArray): The NumpyArray taken in and converted to greyscale.
-	"""
-	red = frame[:, :, 0]
-	blue = frame[:, :, 1]
-	green = frame[:, :, 2]
+	t = pred.link_df(data_frame.copy(), search_size, adaptive_stop = lb_search_size, adaptive_step = step, memory = particle_memory)
 
-	return red * 0.2125 + green * 0.7154 + blue * 0.0721
+	return t, pred.statistics()
 
-def process_video(video_name):
-	"""
-		The function that converts a video to a list of greyscale NumpyArrays.
+def stitch_pieces(data_frame, owner, linked):
+	#Helper function that joins the trajectories of pieces of a DataFrame linked separately, through the features each piece shares with the
+	#piece owning them, preferring the pairs of trajectories sharing the most features and never joining two trajectories present in the same frame.
+	#Returns the particle ID of each row of the DataFrame.
 
-		Parameters:
-			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
-	"""
-	return to_grey(pims.PyAVReaderTimed(video_name))
+	offset = 0
+	rows = []
+	labels = []
 
-def evaluate_features(video_name, particle_size, particle_minmass, start_frame, length, noise):
-	"""
-		The function that  runs Trackpy's feature detection algorithm on the arrays.
+	for t in linked:
+		rows.append(data_frame.index.get_indexer(t.index))
+		labels.append(t["particle"].to_numpy().astype(np.int64) + offset)
+		offset += int(labels[-1].max(initial = -1)) + 1
 
-		Parameters:
-			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
-			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
-			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
-			start_frame (int): The frame in the video from which to begin evaluation.
-			length (int): The number of frames to evaluate.
+	piece = np.repeat(np.arange(len(linked)), [len(r) for r in rows])
+	rows = np.concatenate(rows + [np.zeros(0, dtype = np.int64)])
+	labels = np.concatenate(labels + [np.zeros(0, dtype = np.int64)])
 
-		Returns:
-			frame (DataFrame): The DataFrame of the features found in the video.
-	"""
-	video_frames = process_video(video_name)
-	f = tp.batch(video_frames[start_frame: start_frame + length], particle_size, minmass = particle_minmass, noise_size = noise)
+	own = piece == owner[rows]
+	label = np.zeros(len(data_frame), dtype = np.int64)
+	label[rows[own]] = labels[own]
 
-	return f
+	edges = pd.DataFrame({"a": label[rows[~own]], "b": labels[~own]}).value_counts().reset_index(name = "shared")
+	edges = edges.sort_values("shared", ascending = False, kind = "mergesort")
+
+	parent = np.arange(offset)
+	frame = data_frame["frame"].to_numpy()
+	involved = np.isin(label, np.concatenate((edges["a"].to_numpy(), edges["b"].to_numpy())))
+	frames = pd.Series(frame[involved]).groupby(label[involved]).agg(set).to_dict()
+
+	for a, b in zip(edges["a"].to_numpy(), edges["b"].to_numpy()):
+		a, b = find_root(parent, a), find_root(parent, b)
+
+		if a != b and frames.get(a, set()).isdisjoint(frames.get(b, set())):
+			parent[b] = a
+			frames[a] = frames.get(a, set()) | frames.pop(b, set())
+
+	root = np.array([find_root(parent, i) for i in label], dtype = np.int64)
 
-def evaluate_trajectories(data_frame, search_size, lb_search_size, step, particle_memory):
+	return np.unique(root, return_inverse = True)[1].reshape(-1)
+
+@instrumented
+def evaluate_trajectories(data_frame, search_size, lb_search_size, step, particle_memory, predictor = "velocity", velocity = (0, 0),
+						acceleration = (0, 0), strips = 1, segments = 1, overlap = 3, processes = 1, report = False):
 	"""
 		The function that links features previously discovered by Trackpy and creates a trajectory.
 
@@ -207,15 +1557,67 @@ def evaluate_trajectories(data_frame, search_size, lb_search_size, step, particl
 			lb_search_size (int): The lower bound of the search size.
 			step (double): The rate at which the search size decreases to the lb_search_size.
 			particle_memory (int): The number of frames that a particle cannot be found before it is pruned from memory.
+			predictor (String): Either "velocity" to predict positions with Trackpy's NearestVelocityPredict, or "ballistic" to predict them with
+				ballistic_predict, which allows a smaller search_size for falling particles and so links some trajectories differently.
+			velocity (double tuple): The (x, y) velocity in pixels per frame the ballistic predictor assumes for new tracks.
+			acceleration (double tuple): The (x, y) acceleration in pixels per frame squared the ballistic predictor assumes for new tracks.
+			strips (int): The amount of vertical strips of equal width the features are split into and linked separately.
+			segments (int): The amount of segments of consecutive frames the features are split into and linked separately.
+			overlap (int): The amount of frames each segment also links before its first frame, so its predictor knows the tracks entering it.
+				Strips also link the features within search_size pixels of their sides. Trajectories crossing into another strip or segment are
+				joined through the features both link, so a trajectory missing from every shared frame isn't joined. Each strip and segment is linked
+				without the tracks the others have seen, so near their edges crowded trajectories with missing features can be linked differently
+				than when linking every feature at once, and the trajectories are only an approximation of those. A larger overlap makes them closer.
+			processes (int): The number of worker processes linking strips and segments. Leave as 1 to link them serially.
+			report (boolean): Whether to count the subnets the linker solves, the groups of tracks and features within search_size of each other,
+				in the counters "subnets", "subnet particles" and "largest subnet" of the active run_report, which takes a KDTree search of every frame.
 
 		Returns:
 			t (DataFrame): The DataFrame of trajectory information generated from the DataFrame of features.
 	"""
-	pred = tp.predict.NearestVelocityPredict()				
-	t = pred.link_df(data_frame.copy(), search_size, adaptive_stop = lb_search_size, adaptive_step = step, memory = particle_memory)
+	options = (search_size, lb_search_size, step, particle_memory, predictor, velocity, acceleration, report)
+
+	if strips * segments == 1:
+		t, statistics = link_chunk((data_frame, ) + options)
+		statistics = [statistics]
+	else:
+		features = data_frame.sort_values("frame", kind = "mergesort")
+		x = features["x"].to_numpy(dtype = float)
+		frame = features["frame"].to_numpy()
+
+		x_edges = np.linspace(x.min(initial = 0), x.max(initial = 0), strips + 1)
+		frame_edges = np.linspace(frame.min(initial = 0), frame.max(initial = 0) + 1, segments + 1)
+		strip = np.clip(np.searchsorted(x_edges, x, side = "right") - 1, 0, strips - 1)
+		segment = np.clip(np.searchsorted(frame_edges, frame, side = "right") - 1, 0, segments - 1)
+		owner = segment * strips + strip
+
+		chunks = []
+
+		for s in range(segments):
+			in_segment = (frame >= frame_edges[s] - (overlap if s > 0 else 0)) & (frame < frame_edges[s + 1])
+
+			for i in range(strips):
+				in_strip = (x >= x_edges[i] - (search_size if i > 0 else 0)) & (x <= x_edges[i + 1] + (search_size if i < strips - 1 else 0))
+				chunks.append((features[in_segment & in_strip], ) + options)
+
+		if processes > 1:
+			with multiprocessing.Pool(processes) as pool:
+				linked = pool.map(link_chunk, chunks)
+		else:
+			linked = [link_chunk(chunk) for chunk in chunks]
+
+		statistics = [s for t, s in linked]
+		t = features.copy()
+		t["particle"] = stitch_pieces(features, owner, [t for t, s in linked])
+
+	if report:
+		count("subnets", sum(s["subnets"] for s in statistics))
+		count("subnet particles", sum(s["subnet_particles"] for s in statistics))
+		peak("largest subnet", max(s["largest_subnet"] for s in statistics))
 
 	return t
 
+@instrumented
 def extract_particles(data_frame):
 	"""
 		The function that generates particles with all relavent information from a DataFrame of trajectory.
@@ -227,6 +1629,7 @@ def extract_particles(data_frame):
 			particles (Dictionary of particles): The Dictionary containing all the particles extracted from the input DataFrame with the format {keys = ID: values: particle}.
 	"""
 	particles = dict()
+	particle.used_index = []
 
 	for i in range (0, data_frame.shape[0]):
 		ID = data_frame.at[i, "particle"]
@@ -239,6 +1642,152 @@ def extract_particles(data_frame):
 
 	return particles
 
+def calc_difference(values, errors, times, ids, index):
+	#Helper function that takes the finite difference between consecutive rows belonging to the same particle, as done in particle.calc_vel.
+
+	same = ids[1:] == ids[:-1]
+	dt = (times[1:] - times[:-1]) / frames_per_second
+
+	derivative = (values[1:] - values[:-1]) / dt[:, None]
+	err = (errors[:-1] * values[1:] - errors[1:] * values[:-1]) / dt[:, None]
+	t = (times[1:] + times[:-1]) / 2
+
+	return derivative[same], err[same], t[same], ids[1:][same], index[:-1][same]
+
+def calc_polynomial(values, errors, times, ids, window, order, block_size = 65536):
+	#Helper function that fits a polynomial to the window of rows around each row of the same particle by least squares, in frames so that gaps
+	#left by linking are weighted by their real length, returning the first three derivatives at each row, their errors propagated through
+	#the fit's coefficients, and whether each row's fit has a high enough degree for each derivative.
+
+	n = len(ids)
+	starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1]))) if n > 0 else np.zeros(0, dtype = int)
+	lengths = np.diff(np.append(starts, n))
+	first = np.repeat(starts, lengths)
+	length = np.repeat(lengths, lengths)
+	width = np.minimum(window, length)
+	degree = np.minimum(order, width - 1)
+	powers = np.arange(order + 1)
+	scale = [math.factorial(k) * frames_per_second ** k for k in range(4)]
+	errors = np.broadcast_to(errors, values.shape)
+
+	derivatives = [np.zeros(values.shape) for k in range(3)]
+	derivative_errors = [np.zeros(values.shape) for k in range(3)]
+
+	for block in range(0, n, block_size):
+		row = np.arange(block, min(block + block_size, n))
+
+		#Windows are centred on their row, and shifted to stay within the particle's rows at its ends.
+		begin = np.clip(row - window // 2, first[row], first[row] + length[row] - width[row])
+		valid = np.arange(window)[None, :] < width[row, None]
+		taps = np.where(valid, begin[:, None] + np.arange(window)[None, :], row[:, None])
+		tau = np.where(valid, times[taps] - times[row, None], 0)
+
+		#Windows with the same spacing, width and degree have the same fit, so each distinct window is only solved once.
+		#Rows are compared as raw bytes, which is much faster than np.unique along an axis.
+		keys = np.ascontiguousarray(np.column_stack((tau, width[row], degree[row])))
+		first_row, inverse = np.unique(keys.view(np.dtype((np.void, keys.itemsize * keys.shape[1]))).ravel(), return_index = True,
+									return_inverse = True)[1:]
+		patterns = keys[first_row]
+		pattern_valid = np.arange(window)[None, :] < patterns[:, -2, None]
+
+		#Powers above a fit's degree are zeroed and given a unit diagonal, so that their coefficients solve to 0.
+		used = powers[None, :] <= patterns[:, -1, None]
+		A = patterns[:, :-2, None] ** powers * (pattern_valid[:, :, None] & used[:, None, :])
+		normal = A.transpose(0, 2, 1) @ A + np.eye(order + 1) * ~used[:, None, :]
+		H = np.linalg.solve(normal, A.transpose(0, 2, 1))
+
+		for k in range(1, min(order, 3) + 1):
+			weights = H[inverse, k]
+			derivatives[k - 1][row] = scale[k] * np.einsum("nw,nwd->nd", weights, values[taps])
+			derivative_errors[k - 1][row] = scale[k] * np.sqrt(np.einsum("nw,nwd->nd", weights ** 2, errors[taps] ** 2))
+
+	return derivatives, derivative_errors, [degree >= k for k in range(1, 4)]
+
+def group_sum(values, ids, particle_ids):
+	#Helper function that sums the rows of values belonging to each particle ID, returning the sums and the amount of rows summed.
+
+	codes = np.searchsorted(particle_ids, ids)
+	sums = np.column_stack([np.bincount(codes, values[:, i], len(particle_ids)) for i in range(values.shape[1])])
+
+	return sums, np.bincount(codes, minlength = len(particle_ids))
+
+def calc_derivatives(data_frame, angle, x_restriction = 0, y_restriction = 0, window = None, order = 3):
+	"""
+		The function that calculates the derivatives of position of every particle in a DataFrame of trajectory at once, giving the same
+		values as particle.analyze without creating any particles, or smoothed values from local polynomial fits if a window is given.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			angle (double): The maximum angle in radians a particle can move between positions before it's considered an irregular motion.
+			x_restriction (double): The tuple describing the restriction of x motion, all motion in the sign of x_restriction is considered irregular.
+			y_restriction (double): The tuple describing the restriction of y motion, all motion in the sign of x_restriction is considered irregular.
+			window (int): The amount of consecutive rows of a particle each Savitzky-Golay style polynomial is fitted to, giving the derivatives at
+				every row from one fit with the position errors propagated through it. Leave blank to take finite differences of finite differences.
+			order (int): The degree of the polynomials fitted, which must be 3 or more for jerks. Particles with fewer rows than the window are
+				fitted with lower degrees, and only give the derivatives their degree allows.
+
+		Returns:
+			velocity_data (DataFrame): The DataFrame of velocities, with the DataFrame index the velocity starts from (or is fitted at, with a window)
+				and whether it is an irregular motion.
+			acceleration_data (DataFrame): The DataFrame of accelerations.
+			jerk_data (DataFrame): The DataFrame of jerks.
+			average_data (DataFrame): The DataFrame of each particle's average derivatives of position and amount of irregular motions, indexed by particle ID.
+				With a window the averages are the means of the fitted derivatives, or NaN for particles too short to fit a derivative.
+	"""
+	ordered = data_frame.sort_values(["particle", "frame"], kind = "mergesort")
+
+	ids = ordered["particle"].to_numpy()
+	index = ordered.index.to_numpy()
+	position = ordered[["x", "y"]].to_numpy(dtype = float)
+	err = ordered["ep"].to_numpy(dtype = float)[:, None] / 2
+	frame = ordered["frame"].to_numpy(dtype = float)
+
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		if window is None:
+			vel, vel_err, vel_t, vel_ids, vel_index = calc_difference(position, err, frame, ids, index)
+			accel, accel_err, accel_t, accel_ids, accel_index = calc_difference(vel, vel_err, vel_t, vel_ids, vel_index)
+			jerk, jerk_err, jerk_t, jerk_ids, jerk_index = calc_difference(accel, accel_err, accel_t, accel_ids, accel_index)
+		else:
+			derivatives, errors, fitted = calc_polynomial(position, err, frame, ids, window, order)
+			(vel, vel_err, vel_t, vel_ids, vel_index), (accel, accel_err, accel_t, accel_ids, accel_index), (jerk, jerk_err, jerk_t, jerk_ids,
+				jerk_index) = [(d[f], e[f], frame[f], ids[f], index[f]) for d, e, f in zip(derivatives, errors, fitted)]
+
+		previous = np.roll(vel, 1, axis = 0)
+		cos = (vel[:, 0] * previous[:, 0] + vel[:, 1] * previous[:, 1]) / (np.sqrt(vel[:, 0] ** 2 + vel[:, 1] ** 2) * np.sqrt(previous[:, 0] ** 2 + previous[:, 1] ** 2))
+
+	follows = np.concatenate(([False], vel_ids[1:] == vel_ids[:-1]))
+	irregular = follows & ((cos < math.cos(angle)) | (vel[:, 0] * x_restriction > 0) | (vel[:, 1] * y_restriction > 0))
+
+	velocity_data = pd.DataFrame({"x_vel": vel[:, 0], "y_vel": vel[:, 1], "x_err": vel_err[:, 0], "y_err": vel_err[:, 1], "frame": vel_t,
+								"particle": vel_ids, "index": vel_index, "irregular": irregular})
+	acceleration_data = pd.DataFrame({"x_accel": accel[:, 0], "y_accel": accel[:, 1], "x_err": accel_err[:, 0], "y_err": accel_err[:, 1],
+									"frame": accel_t, "particle": accel_ids})
+	jerk_data = pd.DataFrame({"x_jerk": jerk[:, 0], "y_jerk": jerk[:, 1], "x_err": jerk_err[:, 0], "y_err": jerk_err[:, 1],
+							"frame": jerk_t, "particle": jerk_ids})
+
+	#Finite differences are averaged the same way as particle.calc_vel, calc_accel and calc_jerk normalise them, and fitted derivatives are plain means.
+	particle_ids = np.unique(ids)
+	vel_sum, vel_count = group_sum(vel, vel_ids, particle_ids)
+	accel_sum, accel_count = group_sum(accel, accel_ids, particle_ids)
+	jerk_sum, jerk_count = group_sum(jerk, jerk_ids, particle_ids)
+	irregular_sum = group_sum(irregular[:, None].astype(int), vel_ids, particle_ids)[0]
+
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		vel_average = vel_sum / vel_count[:, None]
+
+		if window is None:
+			accel_average = accel_sum / (accel_count[:, None] + 1)
+			jerk_average = jerk_sum
+		else:
+			accel_average = accel_sum / accel_count[:, None]
+			jerk_average = jerk_sum / jerk_count[:, None]
+
+	average_data = pd.DataFrame({"x_vel": vel_average[:, 0], "y_vel": vel_average[:, 1], "x_accel": accel_average[:, 0], "y_accel": accel_average[:, 1],
+								"x_jerk": jerk_average[:, 0], "y_jerk": jerk_average[:, 1], "irregular": irregular_sum[:, 0].astype(int)},
+								index = pd.Index(particle_ids, name = "particle"))
+
+	return velocity_data, acceleration_data, jerk_data, average_data
+
 def split(data_frame, p, filter_stub, angle, x_restriction = 0, y_restriction = 0):
 		"""
 			The function that splits a single trajectory into recoverable trajectories if there is an irregular motion in the original trajectory.
@@ -308,10 +1857,11 @@ def merge(data_frame, particles, error_tolerance, angle, x_restriction = 0, y_re
 	for p1 in particles.copy():
 		evaluated_particles.append(p1.ID)
 		poly = p1.polyline
-		lse = 0
 
 		for p2 in particles.copy():
 			if p2.ID not in evaluated_particles:
+				lse = 0
+
 				for i in range(0, len(p2.pos_derivative[0])):
 					lse += math.pow(poly(p2.pos_derivative[0][i][0]) - p2.pos_derivative[0][i][1], 2)
 
@@ -320,19 +1870,13 @@ def merge(data_frame, particles, error_tolerance, angle, x_restriction = 0, y_re
 				if lse < error_tolerance:
 					evaluated_particles.append(p2.ID)
 
-					for i in range(0, len(particles)):
-						if particles[i].ID == p1.ID:
-							for x in p2.index:
-								data_frame.at[x, "particle"] = particles[i].ID
-								particles[i].add_index((data_frame.at[x, "x"], data_frame.at[x, "y"], data_frame.at[x, "ep"], data_frame.at[x, "frame"]), 
-													data_frame.at[x, "size"] * 2, data_frame.at[x, "ecc"], x)
-
-							particles[i].analyze(angle, x_restriction, y_restriction)
-							break
+					for x in p2.index:
+						data_frame.at[x, "particle"] = p1.ID
+						p1.add_index((data_frame.at[x, "x"], data_frame.at[x, "y"], data_frame.at[x, "ep"] / 2, data_frame.at[x, "frame"]), 
+									data_frame.at[x, "size"] * 2, data_frame.at[x, "ecc"], x)
 
-						if particles[i].ID == p2.ID:
-							particles.pop(i)
-							break
+					p1.analyze(angle, x_restriction, y_restriction)
+					particles.remove(p2)
 
 	return particles
 
@@ -354,7 +1898,10 @@ def unfilter_jumps(data_frame, particles, filter_stub, error_tolerance, angle, x
 	"""
 	for p in particles.copy().values():
 		if not len(p.irregular) == 0:
-			new_particles = merge(data_frame, split(data_frame, p, filter_stub, angle), error_tolerance, angle)
+			split_particles = split(data_frame, p, filter_stub, angle)
+			count("fragments created", len(split_particles))
+			new_particles = merge(data_frame, split_particles, error_tolerance, angle)
+			count("fragments merged", len(split_particles) - len(new_particles))
 			particles.pop(p.ID)
 
 			for split_particles in new_particles:
@@ -362,6 +1909,197 @@ def unfilter_jumps(data_frame, particles, filter_stub, error_tolerance, angle, x
 
 	return data_frame.loc[particle.used_index]
 
+def fit_polylines(data_frame):
+	"""
+		The function that fits the quadratic polyline of every particle at once by solving the normal equations of every particle together, giving
+		the same polylines as particle.calc_polyline. Each particle's x coordinates are centred and scaled before fitting to keep the equations well conditioned.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+
+		Returns:
+			polyline_data (DataFrame): The DataFrame of each particle's polyline coefficients, highest power first as in np.polyfit, and root mean
+				square residual, indexed by particle ID.
+			residuals (NumpyArray): The residual of each row of the DataFrame from its particle's polyline, in the order of the DataFrame.
+	"""
+	x = data_frame["x"].to_numpy(dtype = float)
+	y = data_frame["y"].to_numpy(dtype = float)
+	particle_ids, codes = np.unique(data_frame["particle"].to_numpy(), return_inverse = True)
+	codes = codes.reshape(-1)
+
+	count = np.bincount(codes, minlength = len(particle_ids))
+	mean = np.bincount(codes, x, len(particle_ids)) / np.maximum(count, 1)
+	u = x - mean[codes]
+	scale = np.zeros(len(particle_ids))
+	np.maximum.at(scale, codes, np.abs(u))
+	scale[scale == 0] = 1
+	u /= scale[codes]
+
+	power = [np.bincount(codes, u ** k, len(particle_ids)) for k in range(5)]
+	moment = [np.bincount(codes, u ** k * y, len(particle_ids)) for k in range(3)]
+	normal = np.stack([np.stack([power[i + j] for j in range(3)], axis = -1) for i in range(3)], axis = -2)
+	c = np.einsum("gij,gj->gi", np.linalg.pinv(normal), np.stack(moment, axis = -1))
+
+	residuals = (c[codes, 2] * u + c[codes, 1]) * u + c[codes, 0] - y
+	rms = np.sqrt(np.bincount(codes, residuals ** 2, len(particle_ids)) / np.maximum(count, 1))
+
+	#The coefficients of the scaled and centred coordinate are converted back to coefficients of x.
+	polyline_data = pd.DataFrame({"quadratic": c[:, 2] / scale ** 2, "linear": c[:, 1] / scale - 2 * c[:, 2] * mean / scale ** 2,
+								"constant": c[:, 0] - c[:, 1] * mean / scale + c[:, 2] * mean ** 2 / scale ** 2, "rms": rms},
+								index = pd.Index(particle_ids, name = "particle"))
+
+	return polyline_data, residuals
+
+class polyline_cache:
+	"""This is a class keeping the polylines of every particle between fits, so that only the particles whose rows changed are fitted again"""
+
+	def __init__(self):
+		self.polyline_data = pd.DataFrame(columns = ["quadratic", "linear", "constant", "rms"], index = pd.Index([], name = "particle"), dtype = float)
+		"""The DataFrame of each particle's polyline coefficients and root mean square residual generated by fit_polylines."""
+		self.signature = pd.DataFrame(columns = ["count", "index_sum", "index_square_sum"], dtype = float)
+		"""The DataFrame of the amount, sum and sum of squares of each particle's DataFrame indices, which change when its rows change."""
+		self.fitted = 0
+		"""The amount of particles fitted by the last fit."""
+
+	def fit(self, data_frame):
+		"""
+		The method that fits the polylines of the particles whose rows changed since the last fit, and forgets the particles no longer present.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+
+		Returns:
+			polyline_data (DataFrame): The DataFrame of each particle's polyline coefficients and root mean square residual, indexed by particle ID.
+			residuals (NumpyArray): The residual of each row of the DataFrame from its particle's polyline, in the order of the DataFrame.
+		"""
+		particle_ids, codes = np.unique(data_frame["particle"].to_numpy(), return_inverse = True)
+		codes = codes.reshape(-1)
+		index = np.asarray(data_frame.index, dtype = float)
+
+		signature = pd.DataFrame({"count": np.bincount(codes, minlength = len(particle_ids)).astype(float),
+								"index_sum": np.bincount(codes, index, len(particle_ids)), "index_square_sum": np.bincount(codes, index ** 2, len(particle_ids))},
+								index = particle_ids)
+		same = (signature == self.signature.reindex(signature.index)).all(axis = 1).to_numpy()
+		changed = particle_ids[~same]
+
+		polyline_data = [self.polyline_data.loc[particle_ids[same]]]
+
+		if len(changed) > 0:
+			polyline_data.append(fit_polylines(data_frame[data_frame["particle"].isin(changed)])[0])
+
+		self.polyline_data = pd.concat([p for p in polyline_data if len(p) > 0] or polyline_data[:1]).sort_index()
+		self.signature = signature
+		self.fitted = len(changed)
+
+		c = self.polyline_data.to_numpy()[codes]
+		x = data_frame["x"].to_numpy(dtype = float)
+
+		return self.polyline_data, (c[:, 0] * x + c[:, 1]) * x + c[:, 2] - data_frame["y"].to_numpy(dtype = float)
+
+def find_root(parent, i):
+	#Helper function that finds the root of a union-find forest, compressing the path to it.
+
+	root = i
+
+	while parent[root] != root:
+		root = parent[root]
+
+	while parent[i] != root:
+		parent[i], i = root, parent[i]
+
+	return root
+
+def merge_fragments(data_frame, error_tolerance, search_size = 50, max_gap = 30, fragments = None, polylines = None, origins = None):
+	"""
+		The function that merges trajectories whose positions follow the polyline of a trajectory that ends shortly before and near where they begin.
+		Each trajectory is only compared with the trajectories beginning within search_size pixels and max_gap frames of its end, found with a
+		KDTree, and each trajectory is merged with at most one trajectory before and after it, choosing the smallest residuals first.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			error_tolerance (double): The maximum root mean square residual between a particle's polyline and another particle's position coordinates allowing merging.
+			search_size (double): The maximum distance in pixels between the end of a trajectory and the beginning of the trajectory merged with it.
+			max_gap (int): The maximum amount of frames between the end of a trajectory and the beginning of the trajectory merged with it.
+			fragments (integer list): The IDs of the particles that can be merged, such as those generated by split. Leave blank to allow every particle.
+			polylines (polyline_cache): The cache of polylines to fit the particles with. Leave blank to fit every particle that can be merged.
+			origins (integer list): The ID of the particle each of the fragments was split from, so that only fragments of the same particle are
+				merged, as merge does. Leave blank to also merge fragments of different particles, which can join two particles into one.
+
+		Returns:
+			t (DataFrame): The DataFrame of trajectory information with the particle IDs of merged trajectories replaced by the ID of the first trajectory.
+	"""
+	ordered = data_frame.sort_values(["particle", "frame"], kind = "mergesort")
+	ids = ordered["particle"].to_numpy()
+	x = ordered["x"].to_numpy(dtype = float)
+	y = ordered["y"].to_numpy(dtype = float)
+	frame = ordered["frame"].to_numpy()
+
+	start = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1]))) if len(ids) > 0 else np.zeros(0, dtype = int)
+	length = np.diff(np.append(start, len(ids)))
+	end = start + length - 1
+	IDs = ids[start]
+
+	candidate = np.flatnonzero(np.isin(IDs, fragments) if fragments is not None else np.ones(len(IDs), dtype = bool))
+	coefficients = np.zeros((len(IDs), 3))
+
+	if len(candidate) > 0:
+		fitted = ordered[np.isin(ids, IDs[candidate])]
+		polyline_data = polylines.fit(fitted)[0] if polylines is not None else fit_polylines(fitted)[0]
+		coefficients[candidate] = polyline_data.loc[IDs[candidate], ["quadratic", "linear", "constant"]].to_numpy()
+
+	#Candidate pairs are the ends of trajectories near the beginnings of others that begin shortly after.
+	if len(candidate) > 1:
+		ends = cKDTree(np.column_stack((x[end[candidate]], y[end[candidate]])))
+		starts = cKDTree(np.column_stack((x[start[candidate]], y[start[candidate]])))
+		pairs = ends.sparse_distance_matrix(starts, search_size, output_type = "ndarray")
+		a = candidate[pairs["i"]]
+		b = candidate[pairs["j"]]
+	else:
+		a = b = np.zeros(0, dtype = int)
+
+	gap = frame[start[b]] - frame[end[a]]
+	kept = (gap > 0) & (gap <= max_gap)
+
+	if origins is not None:
+		fragments = np.asarray(fragments)
+		order = np.argsort(fragments, kind = "mergesort")
+		origin = np.full(len(IDs), -1, dtype = np.int64)
+		origin[candidate] = np.asarray(origins, dtype = np.int64)[order][np.searchsorted(fragments[order], IDs[candidate])]
+		kept &= origin[a] == origin[b]
+
+	a = a[kept]
+	b = b[kept]
+
+	#The residuals of every point of every later trajectory against the polyline of the earlier trajectory of its pair.
+	point_pair = np.repeat(np.arange(len(b)), length[b])
+	rows = start[b][point_pair] + np.arange(len(point_pair)) - np.repeat(np.cumsum(length[b]) - length[b], length[b])
+	c = coefficients[a][point_pair]
+	residual = (c[:, 0] * x[rows] + c[:, 1]) * x[rows] + c[:, 2] - y[rows]
+	rms = np.sqrt(np.bincount(point_pair, residual ** 2, len(b)) / np.maximum(length[b], 1))
+
+	parent = np.arange(len(IDs))
+	linked_before = np.zeros(len(IDs), dtype = bool)
+	linked_after = np.zeros(len(IDs), dtype = bool)
+
+	for k in np.argsort(rms, kind = "mergesort"):
+		if rms[k] >= error_tolerance:
+			break
+
+		if not linked_after[a[k]] and not linked_before[b[k]]:
+			linked_after[a[k]] = True
+			linked_before[b[k]] = True
+			parent[find_root(parent, b[k])] = find_root(parent, a[k])
+
+	count("fragments merged", np.count_nonzero(linked_before))
+
+	root = np.array([find_root(parent, i) for i in range(len(IDs))], dtype = int)
+
+	t = data_frame.copy()
+	t["particle"] = IDs[root][np.searchsorted(IDs, data_frame["particle"].to_numpy())] if len(IDs) > 0 else t["particle"]
+
+	return t
+
+@instrumented
 def fixed_filter_stubs(data_frame, i):
 	"""
 		The function that fixes Trackpy's filter_stubs function by restoring the indices of the data_frame.
@@ -378,19 +2116,50 @@ def fixed_filter_stubs(data_frame, i):
 
 	return t
 
-def postfiltering(data_frame, particles, stillness, tolerance, angle, error_tolerance, filter_stub, x_restriction = 0, y_restriction = 0):
+def split_store(data_frame, stillness, tolerance, angle, filter_stub, x_restriction, y_restriction, window, order):
+	#Helper function that builds a particle_store of a DataFrame of trajectory information, removes its still and too irregular particles and
+	#splits the rest at their irregular motions, returning the store and the IDs of the fragments with the IDs of the particles they were split from.
+
+	velocity_data, acceleration_data, jerk_data, average_data = calc_derivatives(data_frame, angle, x_restriction, y_restriction, window, order)
+	store = particle_store(data_frame)
+
+	removed = (abs(average_data["y_vel"]) < stillness) | (average_data["irregular"] > tolerance)
+	irregular = velocity_data[velocity_data["irregular"]].groupby("particle")["index"].apply(list)
+	irregular = irregular[~removed[irregular.index].to_numpy()]
+
+	store.remove(average_data.index[removed])
+	fragments, origins = store.split(irregular.to_dict(), filter_stub)
+
+	count("particles removed", removed.sum())
+	count("irregular particles", len(irregular))
+	count("fragments created", len(fragments))
+
+	return store, fragments, origins
+
+@instrumented
+def postfiltering(data_frame, particles, stillness, tolerance, angle, error_tolerance, filter_stub, x_restriction = 0, y_restriction = 0, columnar = False,
+				window = None, order = 3, search_size = 50, max_gap = 30):
 	"""
 		The function that filters out particles based on its velocity, degree of irregularity, and how many frames it's in.
 
 		Parameters:
 			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
 			particles (Dictionary of particles): The Dictionary containing all the particles extracted from the trajectory DataFrame with the format {keys = ID: values: particle}.
+				Leave as None when columnar, which doesn't use them.
 			stillness (double): The minimum speed of a particle in pixels before it is considered a still object being misdetected by Trackpy.
 			tolerance (int): The maximum amount of irregularities a particle can have before it is considered too irregular to evaluate.
 			error_tolerance (double): The maximum sum of residuals between a particle's polyline and another particle's position coordinates allowing merging.
 			filter_stub (int): The minimum amount of frames the recoverable trajectories must persist for.
 			x_restriction (double): The tuple describing the restriction of x motion, all motion in the sign of x_restriction is considered irregular.
 			y_restriction (double): The tuple describing the restriction of y motion, all motion in the sign of x_restriction is considered irregular.
+			columnar (boolean): Whether to find the particles' averages and irregular motions with calc_derivatives instead of analyzing each particle,
+				and to split and merge irregular trajectories with particle_store and merge_fragments, so that no particles need to be extracted.
+			window (int): The window of the polynomial fits calc_derivatives smooths the velocities with before irregular motions are found, when
+				columnar. Leave blank to use finite differences.
+			order (int): The degree of the polynomial fits.
+			search_size (double): The maximum distance in pixels between the end of a fragment and the beginning of the fragment of the same
+				particle merged with it, when columnar.
+			max_gap (int): The maximum amount of frames between the end of a fragment and the beginning of the fragment merged with it, when columnar.
 
 		Returns:
 			data_frame (DataFrame): The DataFrame of trajectory information filtered by the function.
@@ -399,71 +2168,400 @@ def postfiltering(data_frame, particles, stillness, tolerance, angle, error_tole
 	if tolerance == None:
 		tolerance = math.inf
 
+	if columnar:
+		store, fragments, origins = split_store(data_frame, stillness, tolerance, angle, filter_stub, x_restriction, y_restriction, window, order)
+		t = merge_fragments(store.to_frame(data_frame), error_tolerance, search_size, max_gap, fragments, origins = origins)
+		count("rows dropped", len(data_frame) - len(t))
+
+		return t
+
 	for p in particles.copy().values():
 		p.analyze(angle, x_restriction, y_restriction)
 
 		if (abs(p.average[0][1]) < stillness and abs(p.average[0][1] < stillness)) or len(p.irregular) > tolerance:
 			particles.pop(p.ID)
+			count("particles removed")
 
 			for i in p.index:
 				particle.used_index.remove(i)
 
+	count("irregular particles", sum(len(p.irregular) > 0 for p in particles.values()))
 	unfilter_jumps(data_frame, particles, filter_stub, error_tolerance, angle, x_restriction, y_restriction)
+	t = data_frame.loc[particle.used_index]
+	count("rows dropped", len(data_frame) - len(t))
 
-	return data_frame.loc[particle.used_index]
+	return t
 
-def export(data_frame, particles = None):
+def filter_trajectories(data_frame, stillness, tolerance, angle, filter_stub, x_restriction = 0, y_restriction = 0, error_tolerance = None,
+						search_size = 50, max_gap = 30, window = None, order = 3):
 	"""
-		The function that exports all information to an excel sheet in the directory folder named "output.xlsx"
+		The function that filters out particles based on its velocity, degree of irregularity, and how many frames it's in, splitting irregular
+		particles without creating any particles. Split trajectories are only merged back together by merge_fragments if error_tolerance is given,
+		and only with fragments of the same particle.
 
 		Parameters:
 			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
-			particles (Dictionary of particles): The Dictionary containing all the particles extracted from the input DataFrame with the format {keys = ID: values: particle}.
+			stillness (double): The minimum speed of a particle in pixels before it is considered a still object being misdetected by Trackpy.
+			tolerance (int): The maximum amount of irregularities a particle can have before it is considered too irregular to evaluate.
+			angle (double): The maximum angle in radians a particle can move between positions before it's considered an irregular motion.
+			filter_stub (int): The minimum amount of frames the trajectories must persist for.
+			x_restriction (double): The tuple describing the restriction of x motion, all motion in the sign of x_restriction is considered irregular.
+			y_restriction (double): The tuple describing the restriction of y motion, all motion in the sign of x_restriction is considered irregular.
+			error_tolerance (double): The maximum root mean square residual between a particle's polyline and another particle's position coordinates allowing merging.
+			search_size (double): The maximum distance in pixels between the end of a trajectory and the beginning of the trajectory merged with it.
+			max_gap (int): The maximum amount of frames between the end of a trajectory and the beginning of the trajectory merged with it.
+			window (int): The window of the polynomial fits calc_derivatives smooths the velocities with before irregular motions are found.
+				Leave blank to use finite differences.
+			order (int): The degree of the polynomial fits.
+
+		Returns:
+			t (DataFrame): The DataFrame of trajectory information filtered by the function.
+	"""
+	if tolerance == None:
+		tolerance = math.inf
+
+	t = data_frame[data_frame.groupby("particle")["frame"].transform("size") >= filter_stub]
+	store, fragments, origins = split_store(t, stillness, tolerance, angle, filter_stub, x_restriction, y_restriction, window, order)
+
+	if error_tolerance is not None:
+		return merge_fragments(store.to_frame(t), error_tolerance, search_size, max_gap, fragments, origins = origins)
+
+	return store.to_frame(t)
+
+class filter_session:
+	"""
+		This is a class keeping the statistics of every particle that filter_trajectories calculates, the average velocities, the angles between
+		consecutive velocities and the amount of rows, so that new thresholds are answered without calculating them again. The DataFrame isn't
+		changed and the particles aren't used, so no particles need to be extracted before each retry.
+	"""
+
+	def __init__(self, data_frame, x_restriction = 0, y_restriction = 0, search_size = 50, max_gap = 30):
+		"""
+		The constructor of the filter_session class.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			x_restriction (double): The tuple describing the restriction of x motion, all motion in the sign of x_restriction is considered irregular.
+			y_restriction (double): The tuple describing the restriction of y motion, all motion in the sign of x_restriction is considered irregular.
+			search_size (double): The maximum distance in pixels between the end of a trajectory and the beginning of the trajectory merged with it.
+			max_gap (int): The maximum amount of frames between the end of a trajectory and the beginning of the trajectory merged with it.
+		"""
+		ordered = data_frame.sort_values(["particle", "frame"], kind = "mergesort")
+		ids = ordered["particle"].to_numpy()
+		rows = np.arange(len(ids))
+
+		self.data_frame = data_frame
+		"""The DataFrame of trajectory information being filtered."""
+		self.index = ordered.index.to_numpy()
+		"""The integer array of DataFrame indices of each row, ordered by particle and frame."""
+		self.ids = ids
+		"""The integer array of particle IDs of each row."""
+		self.particle_ids = np.unique(ids)
+		"""The integer array of every particle ID."""
+		self.codes = np.searchsorted(self.particle_ids, ids)
+		"""The integer array of the position in particle_ids of each row's particle."""
+		self.count = np.bincount(self.codes, minlength = len(self.particle_ids))
+		"""The integer array of the amount of rows of each particle."""
+		self.first = np.concatenate(([True], ids[1:] != ids[:-1])) if len(ids) > 0 else np.zeros(0, dtype = bool)
+		"""The boolean array of whether each row is the first of its particle."""
+
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			vel, vel_err, vel_t, vel_ids, vel_row = calc_difference(ordered[["x", "y"]].to_numpy(dtype = float), ordered["ep"].to_numpy(dtype = float)[:, None] / 2,
+																ordered["frame"].to_numpy(dtype = float), ids, rows)
+
+			previous = np.roll(vel, 1, axis = 0)
+			self.cos = (vel[:, 0] * previous[:, 0] + vel[:, 1] * previous[:, 1]) / (np.sqrt(vel[:, 0] ** 2 + vel[:, 1] ** 2) * np.sqrt(previous[:, 0] ** 2 + previous[:, 1] ** 2))
+			"""The double array of the cosine of the angle between each velocity and the one before it."""
+
+			vel_sum, vel_count = group_sum(vel, vel_ids, self.particle_ids)
+			self.speed = np.abs(vel_sum[:, 1] / vel_count)
+			"""The double array of the magnitude of each particle's average y velocity, compared with stillness."""
+
+		self.follows = np.concatenate(([False], vel_ids[1:] == vel_ids[:-1]))
+		"""The boolean array of whether each velocity follows another of the same particle."""
+		self.restricted = (vel[:, 0] * x_restriction > 0) | (vel[:, 1] * y_restriction > 0)
+		"""The boolean array of whether each velocity is in the sign of a restriction."""
+		self.vel_codes = np.searchsorted(self.particle_ids, vel_ids)
+		"""The integer array of the position in particle_ids of each velocity's particle."""
+		self.vel_row = vel_row
+		"""The integer array of the row each velocity starts from."""
+		self.search_size = search_size
+		self.max_gap = max_gap
+		self.polylines = polyline_cache()
+		"""The cache of the polylines fitted by merge_fragments, reused between thresholds."""
+
+	def filter(self, stillness, tolerance, angle, filter_stub, error_tolerance = None):
+		"""
+		The method that filters the trajectories with a set of thresholds, giving the same DataFrame as filter_trajectories.
+
+		Parameters:
+			stillness (double): The minimum speed of a particle in pixels before it is considered a still object being misdetected by Trackpy.
+			tolerance (int): The maximum amount of irregularities a particle can have before it is considered too irregular to evaluate.
+			angle (double): The maximum angle in radians a particle can move between positions before it's considered an irregular motion.
+			filter_stub (int): The minimum amount of frames the trajectories must persist for.
+			error_tolerance (double): The maximum root mean square residual between a particle's polyline and another particle's position coordinates allowing merging.
+
+		Returns:
+			t (DataFrame): The DataFrame of trajectory information filtered by the thresholds.
+		"""
+		if tolerance == None:
+			tolerance = math.inf
+
+		irregular = self.follows & ((self.cos < math.cos(angle)) | self.restricted)
+		irregular_count = np.bincount(self.vel_codes[irregular], minlength = len(self.particle_ids))
+
+		present = self.count >= filter_stub
+		kept = present & ~((self.speed < stillness) | (irregular_count > tolerance))
+		split = kept & (irregular_count > 0)
+
+		#Each particle and each irregular motion begins a segment, and the segments of split particles take new IDs in order, as store.split gives them.
+		start = self.first.copy()
+		start[self.vel_row[irregular]] = True
+		segment = np.cumsum(start) - 1
+		segment_split = split[self.codes[start]]
+		segment_length = np.bincount(segment, minlength = len(segment_split))
+
+		base = self.particle_ids[present].max(initial = -1) + 1
+		segment_ID = base + np.cumsum(segment_split) - 1
+
+		split_row = segment_split[segment]
+		keep = kept[self.codes] & ~(split_row & (segment_length[segment] < filter_stub))
+		label = np.where(split_row, segment_ID[segment], self.ids)
+
+		order = np.argsort(self.index[keep], kind = "mergesort")
+		t = self.data_frame.loc[self.index[keep][order]].copy()
+		t["particle"] = label[keep][order]
+
+		if error_tolerance is not None:
+			fragments, first = np.unique(label[keep & split_row], return_index = True)
+			return merge_fragments(t, error_tolerance, self.search_size, self.max_gap, fragments, self.polylines, self.ids[keep & split_row][first])
+
+		return t
+
+	def sweep(self, stillness, tolerance, angle, filter_stub, error_tolerance = (None,)):
+		"""
+		The method that filters the trajectories with every combination of a grid of thresholds.
+
+		Parameters:
+			stillness (double list): The values of stillness to try.
+			tolerance (integer list): The values of tolerance to try.
+			angle (double list): The values of angle to try.
+			filter_stub (integer list): The values of filter_stub to try.
+			error_tolerance (double list): The values of error_tolerance to try, where None doesn't merge.
+
+		Returns:
+			results (Dictionary of DataFrames): The filtered DataFrame of each combination with the format {keys = (stillness, tolerance, angle, filter_stub, error_tolerance): values: DataFrame}.
+		"""
+		return dict({parameters: self.filter(*parameters) for parameters in itertools.product(stillness, tolerance, angle, filter_stub, error_tolerance)})
+
+def evaluate_stream(video_name, particle_size, particle_minmass, start_frame, length, noise, search_size, lb_search_size, step, particle_memory,
+					stillness, tolerance, angle, filter_stub, output_name = "output.csv", window = 100, x_restriction = 0, y_restriction = 0,
+					dtype = None, decode_grey = False, max_track_length = 1000):
+	"""
+		The function that runs feature detection, linking and filtering on a video one frame at a time, appending each trajectory to a csv file
+		once it has closed, so that memory use depends on the window and the amount of open trajectories rather than the length of the video.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated stored in the Recordings folder.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			start_frame (int): The frame in the video from which to begin evaluation.
+			length (int): The number of frames to evaluate.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			search_size (int): The radius of pixels the trajectory searching program will look for the particle.
+			lb_search_size (int): The lower bound of the search size.
+			step (double): The rate at which the search size decreases to the lb_search_size.
+			particle_memory (int): The number of frames that a particle cannot be found before it is pruned from memory.
+			stillness (double): The minimum speed of a particle in pixels before it is considered a still object being misdetected by Trackpy.
+			tolerance (int): The maximum amount of irregularities a particle can have before it is considered too irregular to evaluate.
+			angle (double): The maximum angle in radians a particle can move between positions before it's considered an irregular motion.
+			filter_stub (int): The minimum amount of frames the trajectories must persist for.
+			output_name (String): The name of the csv file the trajectories are appended to.
+			window (int): The number of frames linked between each search for closed trajectories.
+			x_restriction (double): The tuple describing the restriction of x motion, all motion in the sign of x_restriction is considered irregular.
+			y_restriction (double): The tuple describing the restriction of y motion, all motion in the sign of x_restriction is considered irregular.
+			dtype (numpy dtype): The dtype of the greyscale frames passed to process_video.
+			decode_grey (boolean): Whether PyAV decodes the video straight to 8-bit greyscale.
+			max_track_length (int): The most frames a trajectory stays open for before the rows it has are filtered and written as a trajectory
+				of their own, with the rest of it continuing as a new trajectory. Still grains are never absent, so without this they'd stay open
+				for the whole video. Trajectories longer than this are filtered in pieces, so they can differ from the output of
+				filter_trajectories. Leave blank to keep every trajectory open until it closes.
+
+		Returns:
+			count (int): The number of trajectories written to the csv file. The largest amount of rows held open at once is counted as
+				"peak open rows" in the active run_report.
 	"""
-	if particles == None:
-		raw_data = data_frame.copy()
-		raw_data.to_excel("output.xlsx", sheet_name = "raw_data")
+	video_frames = process_video(video_name, dtype, decode_grey)
+	features = locate_frames(video_frames, start_frame, start_frame + length, particle_size, particle_minmass, noise)
+
+	pred = tp.predict.NearestVelocityPredict()
+	linked = pred.link_df_iter(features, search_size, adaptive_stop = lb_search_size, adaptive_step = step, memory = particle_memory)
+
+	pending = []
+	open_rows = None
+	last_seen = dict()
+	first_seen = dict()
+	rows = 0
+	count = 0
+
+	for i, f in enumerate(linked):
+		#Every feature gets the index it would have in the DataFrame generated by evaluate_features.
+		f.index = range(rows, rows + len(f))
+		rows += len(f)
+		pending.append(f)
+		IDs = f["particle"].tolist()
+		last_seen.update(dict.fromkeys(IDs, i))
+
+		for ID in IDs:
+			first_seen.setdefault(ID, i)
+
+		if len(pending) < window:
+			continue
+
+		#A trajectory is closed once it has been absent for longer than Trackpy's memory, since it can no longer be linked.
+		closed = [ID for ID, seen in last_seen.items() if i - seen > particle_memory]
+
+		for ID in closed:
+			last_seen.pop(ID)
+			first_seen.pop(ID, None)
+
+		#Trajectories open for too long are written as they are, and the rows linked to them afterwards begin new ones.
+		if max_track_length is not None:
+			flushed = [ID for ID, seen in first_seen.items() if i - seen >= max_track_length]
+
+			for ID in flushed:
+				first_seen.pop(ID)
+
+			closed += flushed
+
+		t = pd.concat(([open_rows] if open_rows is not None else []) + pending)
+		peak("peak open rows", len(t))
+		done = t["particle"].isin(closed)
+		count = write_stream(filter_trajectories(t[done], stillness, tolerance, angle, filter_stub, x_restriction, y_restriction), output_name, count)
+
+		open_rows = t[~done]
+		pending = []
+
+	if open_rows is not None or len(pending) > 0:
+		t = pd.concat(([open_rows] if open_rows is not None else []) + pending)
+		peak("peak open rows", len(t))
+		count = write_stream(filter_trajectories(t, stillness, tolerance, angle, filter_stub, x_restriction, y_restriction), output_name, count)
+
+	return count
+
+def write_stream(data_frame, output_name, count):
+	#Helper function that renumbers closed trajectories in the order they closed and appends them to the csv file of evaluate_stream.
+
+	ID, data_frame["particle"] = np.unique(data_frame["particle"].to_numpy(), return_inverse = True)
+	data_frame["particle"] += count
+	data_frame.to_csv(output_name, mode = "a" if count > 0 else "w", header = count == 0)
+
+	return count + len(ID)
+
+export_extensions = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv", "hdf": ".h5", "excel": ".xlsx"}
+csv_extensions = {"gzip": ".gz", "bz2": ".bz2", "zip": ".zip", "xz": ".xz", "zstd": ".zst"}
+
+def write_table(data_frame, file_name, file_format, compression, chunk_size):
+	#Helper function that writes one table to a file of a columnar or text format, keeping the DataFrame index.
+
+	if file_format == "parquet":
+		data_frame.to_parquet(file_name, compression = compression or "snappy")
+
+	elif file_format == "feather":
+		data_frame.reset_index().to_feather(file_name, compression = compression or "lz4")
+
+	elif file_format == "csv":
+		data_frame.to_csv(file_name, chunksize = chunk_size, compression = compression)
 
 	else:
-		raw_data = data_frame.copy()
-		velocity_data = dict({"x_vel": [], "y_vel": [], "x_err": [], "y_err": [], "frame": [], "particle": []})
-		acceleration_data = dict({"x_accel": [], "y_accel": [], "x_err": [], "y_err": [], "frame": [], "particle": []})
-		jerk_data = dict({"x_jerk": [], "y_jerk": [], "x_err": [], "y_err": [], "frame": [], "particle": []})
-
-		for p in particles.values():
-			for i in range (0, len(p.pos_derivative[1])):
-				velocity_data["x_vel"].append(p.pos_derivative[1][i][0])
-				velocity_data["y_vel"].append(p.pos_derivative[1][i][1])
-				velocity_data["x_err"].append(p.pos_derivative[1][i][2][0])
-				velocity_data["y_err"].append(p.pos_derivative[1][i][2][1])
-				velocity_data["frame"].append(p.pos_derivative[1][i][3])
-				velocity_data["particle"].append(p.ID)
-
-				if i < len(p.pos_derivative[2]):
-					acceleration_data["x_accel"].append(p.pos_derivative[2][i][0])
-					acceleration_data["y_accel"].append(p.pos_derivative[2][i][1])
-					acceleration_data["x_err"].append(p.pos_derivative[2][i][2][0])
-					acceleration_data["y_err"].append(p.pos_derivative[2][i][2][1])
-					acceleration_data["frame"].append(p.pos_derivative[2][i][3])
-					acceleration_data["particle"].append(p.ID)
-
-				if i < len(p.pos_derivative[3]):
-					jerk_data["x_jerk"].append(p.pos_derivative[3][i][0])
-					jerk_data["y_jerk"].append(p.pos_derivative[3][i][1])
-					jerk_data["x_err"].append(p.pos_derivative[3][i][2][0])
-					jerk_data["y_err"].append(p.pos_derivative[3][i][2][1])
-					jerk_data["frame"].append(p.pos_derivative[3][i][3])
-					jerk_data["particle"].append(p.ID)
-
-		velocity_data = pd.DataFrame.from_dict(velocity_data)
-		acceleration_data = pd.DataFrame.from_dict(acceleration_data)
-		jerk_data = pd.DataFrame.from_dict(jerk_data)
-
-		with pd.ExcelWriter("output.xlsx") as writer:
-			raw_data.to_excel(writer, sheet_name = "raw data")
-			velocity_data.to_excel(writer, sheet_name = "velocity data")
-			acceleration_data.to_excel(writer, sheet_name = "acceleration data")
-			jerk_data.to_excel(writer, sheet_name = "jerk data")
+		raise ValueError("Unknown export format {}".format(file_format))
+
+@instrumented
+def export(data_frame, particles = None, derivatives = None, output_name = "output", file_format = "parquet", compression = None, partition = None,
+	partition_size = 1000, chunk_size = 100000):
+	"""
+		The function that exports the trajectory information and its derivatives of position, writing each table to a Parquet, Feather or csv file
+		in the folder output_name, to output_name.h5 with a key per table, or to output_name.xlsx with a sheet per table for small runs.
+
+		Parameters:
+			data_frame (DataFrame): The DataFrame of trajectory information generated by Trackpy.
+			particles (Dictionary of particles): The Dictionary containing all the particles extracted from the input DataFrame with the format {keys = ID: values: particle}.
+				If given, the derivatives of every particle of the DataFrame are exported, calculated from its particle column so that the fragments
+				postfiltering splits off are kept even when the Dictionary still has the IDs they were split from.
+			derivatives (tuple of DataFrames): The velocity, acceleration and jerk DataFrames generated by calc_derivatives, used in place of the particles.
+			output_name (String): The name of the output folder or file, without extension.
+			file_format (String): The format to write, either "parquet", "feather", "hdf", "csv" or "excel".
+			compression (String): The compression of the format, such as "snappy" or "zstd" for Parquet, "lz4" or "zstd" for Feather, "blosc" or "zlib"
+				for HDF5 and "gzip" for csv, or None for the format's default.
+			partition (String): Either "particle" or "frame" to split each table into files of partition_size consecutive particle IDs or frames, or
+				None to write each table whole.
+			partition_size (int): The amount of particle IDs or frames in each partition.
+			chunk_size (int): The amount of rows written to a csv file at a time.
+
+		Returns:
+			file_names (String list): The names of the files written.
+	"""
+	tables = dict({"raw_data": data_frame})
+
+	if derivatives is None and particles is not None:
+		#The particles' derivatives of position don't depend on the angle, so they are calculated from their rows at once.
+		derivatives = calc_derivatives(data_frame, math.pi)
+
+	if derivatives is not None:
+		tables["velocity_data"] = derivatives[0][["x_vel", "y_vel", "x_err", "y_err", "frame", "particle"]]
+		tables["acceleration_data"] = derivatives[1][["x_accel", "y_accel", "x_err", "y_err", "frame", "particle"]]
+		tables["jerk_data"] = derivatives[2][["x_jerk", "y_jerk", "x_err", "y_err", "frame", "particle"]]
+
+	file_names = []
+
+	if file_format == "excel":
+		if partition is not None:
+			raise ValueError("Excel output can't be partitioned")
+
+		if max(len(t) for t in tables.values()) >= 1048576:
+			raise ValueError("Excel sheets are limited to 1048576 rows, use another format")
+
+		file_names.append(output_name + export_extensions[file_format])
+
+		with pd.ExcelWriter(file_names[-1]) as writer:
+			for name, t in tables.items():
+				t.to_excel(writer, sheet_name = name.replace("_", " "))
+
+		return file_names
+
+	if file_format == "hdf":
+		file_names.append(output_name + export_extensions[file_format])
+
+		with pd.HDFStore(file_names[-1], mode = "w", complib = compression, complevel = 0 if compression is None else 9) as store:
+			for name, t in tables.items():
+				if partition is None:
+					store.put(name, t, format = "table")
+
+				else:
+					for key, part in t.groupby(t[partition].to_numpy() // partition_size):
+						store.put("{}/{}_{}".format(name, partition, int(key) * partition_size), part, format = "table")
+
+		return file_names
+
+	if file_format not in export_extensions:
+		raise ValueError("Unknown export format {}".format(file_format))
+
+	extension = export_extensions[file_format] + (csv_extensions.get(compression, "") if file_format == "csv" else "")
+	os.makedirs(output_name, exist_ok = True)
+
+	for name, t in tables.items():
+		if partition is None:
+			file_names.append(os.path.join(output_name, name + extension))
+			write_table(t, file_names[-1], file_format, compression, chunk_size)
+
+		else:
+			os.makedirs(os.path.join(output_name, name), exist_ok = True)
+
+			for key, part in t.groupby(t[partition].to_numpy() // partition_size):
+				file_names.append(os.path.join(output_name, name, "{}_{}{}".format(partition, int(key) * partition_size, extension)))
+				write_table(part, file_names[-1], file_format, compression, chunk_size)
+
+	return file_names
 
 def hist(data_frame, bins, column):
 	"""
@@ -0,0 +1,260 @@
+#Triangulation for Falling Sand
+
+import json
+
+import numpy as np
+import pandas as pd
+
+def load_camera(file_name):
+	"""
+		The function that loads a camera's calibration from a json file as a projection matrix.
+
+		Parameters:
+			file_name (String): The name of the json file, holding either "projection" (the 3 by 4 projection matrix), "dlt" (the 11 DLT coefficients)
+				or "intrinsics" (the 3 by 3 camera matrix) with "rotation" (the 3 by 3 rotation matrix) and "translation" (the 3 translation coordinates).
+
+		Returns:
+			P (NumpyArray): The 3 by 4 projection matrix mapping homogeneous real space positions to homogeneous pixel positions.
+	"""
+	with open(file_name) as file:
+		calibration = json.load(file)
+
+	if "projection" in calibration:
+		return np.array(calibration["projection"], dtype = float).reshape(3, 4)
+
+	if "dlt" in calibration:
+		return dlt_matrix(calibration["dlt"])
+
+	return projection_matrix(calibration["intrinsics"], calibration["rotation"], calibration["translation"])
+
+def dlt_matrix(coefficients):
+	"""
+		The function that converts the 11 DLT coefficients of a camera to its projection matrix.
+
+		Parameters:
+			coefficients (double list): The DLT coefficients L1 to L11, with u = (L1 X + L2 Y + L3 Z + L4) / (L9 X + L10 Y + L11 Z + 1) and v likewise with L5 to L8.
+
+		Returns:
+			P (NumpyArray): The 3 by 4 projection matrix.
+	"""
+	return np.append(np.asarray(coefficients, dtype = float), 1).reshape(3, 4)
+
+def projection_matrix(intrinsics, rotation, translation):
+	"""
+		The function that combines a camera's intrinsic and extrinsic calibration into its projection matrix.
+
+		Parameters:
+			intrinsics (NumpyArray): The 3 by 3 camera matrix.
+			rotation (NumpyArray): The 3 by 3 rotation matrix from real space to camera coordinates.
+			translation (NumpyArray): The 3 translation coordinates from real space to camera coordinates.
+
+		Returns:
+			P (NumpyArray): The 3 by 4 projection matrix.
+	"""
+	return np.asarray(intrinsics, dtype = float) @ np.column_stack((np.asarray(rotation, dtype = float), np.asarray(translation, dtype = float)))
+
+def project(P, points):
+	"""
+		The function that projects real space positions into a camera, used to make synthetic views of known trajectories.
+
+		Parameters:
+			P (NumpyArray): The 3 by 4 projection matrix of the camera.
+			points (NumpyArray): The N by 3 array of real space positions.
+
+		Returns:
+			pixels (NumpyArray): The N by 2 array of (x, y) pixel positions.
+	"""
+	homogeneous = np.column_stack((points, np.ones(len(points)))) @ P.T
+
+	return homogeneous[:, :2] / homogeneous[:, 2:]
+
+def fundamental_matrix(P1, P2):
+	"""
+		The function that calculates the fundamental matrix between two cameras, mapping a pixel in the first camera to its epipolar line in the second.
+
+		Parameters:
+			P1 (NumpyArray): The 3 by 4 projection matrix of the first camera.
+			P2 (NumpyArray): The 3 by 4 projection matrix of the second camera.
+
+		Returns:
+			F (NumpyArray): The 3 by 3 fundamental matrix.
+	"""
+	centre = np.linalg.svd(P1)[2][-1]
+	epipole = P2 @ centre
+	cross = np.array([[0, -epipole[2], epipole[1]], [epipole[2], 0, -epipole[0]], [-epipole[1], epipole[0], 0]])
+
+	return cross @ P2 @ np.linalg.pinv(P1)
+
+def synchronise(data_frame1, data_frame2, offset):
+	"""
+		The function that aligns the frames of two cameras and keeps only the frames seen by both.
+
+		Parameters:
+			data_frame1 (DataFrame): The DataFrame of feature or trajectory information of the first camera.
+			data_frame2 (DataFrame): The DataFrame of feature or trajectory information of the second camera.
+			offset (int): The frame of the second camera recorded at the same time as frame 0 of the first camera.
+
+		Returns:
+			t1 (DataFrame): The DataFrame of the first camera in the common frames.
+			t2 (DataFrame): The DataFrame of the second camera in the common frames, renumbered to the frames of the first camera.
+	"""
+	t2 = data_frame2.copy()
+	t2["frame"] = t2["frame"] - offset
+	common = np.intersect1d(data_frame1["frame"].unique(), t2["frame"].unique())
+
+	return data_frame1[data_frame1["frame"].isin(common)], t2[t2["frame"].isin(common)]
+
+def candidate_pairs(low, high):
+	#Helper function that returns every pair of a feature with the features in its range [low, high) of another camera's sorted features.
+
+	count = high - low
+	row1 = np.repeat(np.arange(len(low)), count)
+	row2 = np.repeat(low - np.cumsum(count) + count, count) + np.arange(len(row1))
+
+	return row1, row2
+
+def epipolar_keys(F, p1, p2, max_distance):
+	#Helper function that returns a key for each feature that orders the features of the second camera across the epipolar lines, the key
+	#of each first camera feature's epipolar line, the largest key difference between a line and a feature within max_distance of it and
+	#the period of the keys, if they wrap around.
+
+	epipole = np.linalg.svd(F)[0][:, -1]
+	line = p1 @ F.T
+
+	if abs(epipole[2]) < 1e-12 * np.hypot(epipole[0], epipole[1]):
+		#The epipolar lines are parallel, so features are ordered by their offset across the lines.
+		normal = np.array([-epipole[1], epipole[0]]) / np.hypot(epipole[0], epipole[1])
+		line_key = -line[:, 2] / (line[:, :2] @ normal)
+
+		return p2[:, :2] @ normal, line_key, max_distance, None
+
+	#The epipolar lines meet at the epipole, so features are ordered by their angle around it, which is within pi.
+	centre = epipole[:2] / epipole[2]
+	offset = p2[:, :2] - centre
+	radius = np.hypot(offset[:, 0], offset[:, 1]).min(initial = np.inf)
+	tolerance = np.arcsin(min(1, max_distance / radius)) if radius > 0 else np.pi / 2
+
+	return np.arctan2(offset[:, 1], offset[:, 0]) % np.pi, np.arctan2(line[:, 0], -line[:, 1]) % np.pi, tolerance, np.pi
+
+def match_views(data_frame1, data_frame2, F, max_distance):
+	"""
+		The function that matches the features of two synchronised cameras by pairing each feature with the features of the other camera in the
+		same frame that lie near its epipolar line, keeping each feature's closest match. Candidates are found by a binary search of the second
+		camera's features ordered by frame and position across the epipolar lines, so only nearby pairs are compared.
+
+		Parameters:
+			data_frame1 (DataFrame): The DataFrame of the first camera generated by synchronise.
+			data_frame2 (DataFrame): The DataFrame of the second camera generated by synchronise.
+			F (NumpyArray): The fundamental matrix from the first camera to the second.
+			max_distance (double): The maximum symmetric distance in pixels between a feature and the epipolar line of its match.
+
+		Returns:
+			matches (DataFrame): The DataFrame of the DataFrame indices of matching features in each camera, their frame and epipolar distance.
+	"""
+	frame1 = data_frame1["frame"].to_numpy()
+	frame2 = data_frame2["frame"].to_numpy()
+	p1 = np.column_stack((data_frame1[["x", "y"]].to_numpy(dtype = float), np.ones(len(frame1))))
+	p2 = np.column_stack((data_frame2[["x", "y"]].to_numpy(dtype = float), np.ones(len(frame2))))
+
+	#A match's one-sided distance is at most twice the symmetric distance, so candidates are searched for within twice max_distance.
+	key2, line_key, tolerance, period = epipolar_keys(F, p1, p2, 2 * max_distance)
+	frames = np.unique(np.concatenate((frame1, frame2)))
+	code1 = np.searchsorted(frames, frame1)
+	code2 = np.searchsorted(frames, frame2)
+
+	#Keys that wrap around are repeated a period away when they are near either end.
+	rows2 = np.arange(len(frame2))
+
+	if period is not None:
+		low_end, high_end = key2 < tolerance, key2 > period - tolerance
+		rows2 = np.concatenate((rows2, rows2[low_end], rows2[high_end]))
+		key2 = np.concatenate((key2, key2[low_end] + period, key2[high_end] - period))
+		code2 = code2[rows2]
+
+	span = 2 * (np.abs(np.concatenate((key2, line_key))).max(initial = 0) + tolerance) + 1
+	combined = code2 * span + key2
+	order = np.argsort(combined, kind = "stable")
+	combined, rows2 = combined[order], rows2[order]
+
+	low = np.searchsorted(combined, code1 * span + line_key - tolerance)
+	high = np.searchsorted(combined, code1 * span + line_key + tolerance, side = "right")
+	row1, row2 = candidate_pairs(low, high)
+	row2 = rows2[row2]
+
+	#The symmetric epipolar distance is the mean distance of each point from the epipolar line of the other.
+	line2 = p1[row1] @ F.T
+	line1 = p2[row2] @ F
+	algebraic = np.abs(np.einsum("ij,ij->i", p2[row2], line2))
+	distance = (algebraic / np.hypot(line2[:, 0], line2[:, 1]) + algebraic / np.hypot(line1[:, 0], line1[:, 1])) / 2
+
+	near = distance <= max_distance
+	matches = np.column_stack((row1[near], row2[near], distance[near]))
+	matches = matches[np.argsort(matches[:, 2], kind = "stable")]
+
+	#Each feature keeps its closest match, with features of the second camera going to the closest of the remaining features of the first camera.
+	matches = matches[np.sort(np.unique(matches[:, 0], return_index = True)[1])]
+	matches = matches[np.sort(np.unique(matches[:, 1], return_index = True)[1])]
+	matches = matches[np.argsort(matches[:, 0], kind = "stable")]
+	row1, row2 = matches[:, 0].astype(int), matches[:, 1].astype(int)
+
+	return pd.DataFrame({"frame": frame1[row1], "index1": data_frame1.index.to_numpy()[row1], "index2": data_frame2.index.to_numpy()[row2],
+		"distance": matches[:, 2]})
+
+def triangulate(P1, P2, pixels1, pixels2):
+	"""
+		The function that triangulates the real space positions of matching pixels with batched linear least squares.
+
+		Parameters:
+			P1 (NumpyArray): The 3 by 4 projection matrix of the first camera.
+			P2 (NumpyArray): The 3 by 4 projection matrix of the second camera.
+			pixels1 (NumpyArray): The N by 2 array of (x, y) pixel positions in the first camera.
+			pixels2 (NumpyArray): The N by 2 array of (x, y) pixel positions in the second camera.
+
+		Returns:
+			points (NumpyArray): The N by 3 array of real space positions.
+			error (NumpyArray): The N by 2 array of reprojection errors in pixels in each camera.
+	"""
+	A = np.stack((pixels1[:, :1] * P1[2] - P1[0], pixels1[:, 1:] * P1[2] - P1[1], pixels2[:, :1] * P2[2] - P2[0], pixels2[:, 1:] * P2[2] - P2[1]), axis = 1)
+
+	#Each point's 4 equations are solved for its 3 coordinates at once through their normal equations.
+	A /= np.linalg.norm(A[:, :, :3], axis = 2, keepdims = True)
+	normal = np.einsum("nki,nkj->nij", A[:, :, :3], A[:, :, :3])
+	points = np.linalg.solve(normal, -np.einsum("nki,nk->ni", A[:, :, :3], A[:, :, 3])[:, :, None])[:, :, 0]
+
+	error = np.column_stack((np.linalg.norm(project(P1, points) - pixels1, axis = 1), np.linalg.norm(project(P2, points) - pixels2, axis = 1)))
+
+	return points, error
+
+def triangulate_trajectories(data_frame1, data_frame2, P1, P2, offset = 0, max_distance = 2, consistent = True):
+	"""
+		The function that synchronises, matches and triangulates the features or trajectories of two cameras.
+
+		Parameters:
+			data_frame1 (DataFrame): The DataFrame of feature or trajectory information of the first camera.
+			data_frame2 (DataFrame): The DataFrame of feature or trajectory information of the second camera.
+			P1 (NumpyArray): The 3 by 4 projection matrix of the first camera.
+			P2 (NumpyArray): The 3 by 4 projection matrix of the second camera.
+			offset (int): The frame of the second camera recorded at the same time as frame 0 of the first camera.
+			max_distance (double): The maximum symmetric distance in pixels between a feature and the epipolar line of its match.
+			consistent (boolean): Whether to keep only the matches between each particle of the first camera and the particle of the second camera it
+				matches most often, when both DataFrames have particle IDs.
+
+		Returns:
+			t (DataFrame): The DataFrame of real space positions (X, Y, Z), reprojection errors in each camera (err1, err2), frame and the
+				DataFrame indices and particle IDs of the matching features.
+	"""
+	t1, t2 = synchronise(data_frame1, data_frame2, offset)
+	matches = match_views(t1, t2, fundamental_matrix(P1, P2), max_distance)
+
+	if consistent and "particle" in t1 and "particle" in t2:
+		matches["particle1"] = t1.loc[matches["index1"], "particle"].to_numpy()
+		matches["particle2"] = t2.loc[matches["index2"], "particle"].to_numpy()
+		votes = matches.groupby(["particle1", "particle2"]).size().rename("votes").reset_index()
+		best = votes.sort_values("votes", ascending = False, kind = "mergesort").drop_duplicates("particle1").drop_duplicates("particle2")
+		matches = matches.merge(best[["particle1", "particle2"]], on = ["particle1", "particle2"])
+
+	points, error = triangulate(P1, P2, t1.loc[matches["index1"], ["x", "y"]].to_numpy(dtype = float), t2.loc[matches["index2"], ["x", "y"]].to_numpy(dtype = float))
+
+	t = pd.DataFrame({"X": points[:, 0], "Y": points[:, 1], "Z": points[:, 2], "err1": error[:, 0], "err2": error[:, 1]})
+
+	return pd.concat((t, matches.drop(columns = "distance")), axis = 1)
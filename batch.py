@@ -0,0 +1,262 @@
+#Batch runner for Falling Sand
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import math
+import os
+import time
+import traceback
+
+import trackpy as tp
+
+import Rendering as rd
+import SandTracking as st
+
+defaults = dict({"particle_size": 7, "particle_minmass": 500, "start_frame": 0, "length": None, "noise": 4, "processes": 1, "search_size": 50,
+				"lb_search_size": 10, "step": 0.99, "particle_memory": 3, "predictor": "velocity", "stub_length": 10, "stillness": 5000,
+				"tolerance": math.inf, "angle": 15, "error_tolerance": 10000, "filter_stub": 10, "x_restriction": 0, "y_restriction": -1,
+				"window": None, "order": 3, "file_format": "parquet", "compression": None, "partition": None, "partition_size": 1000})
+"""The parameters of the pipeline run by run.py, used for any parameter missing from a parameter file. The angle is in degrees, a length of
+None evaluates every frame from the start frame to the end of the video and a window smooths the derivatives with polynomial fits."""
+
+def load_parameters(file_name):
+	"""
+		The function that reads the parameters of the pipeline from a JSON or YAML file, filling in the rest from the defaults.
+
+		Parameters:
+			file_name (String): The name of the .json, .yaml or .yml parameter file. It may also list the recordings to process under "recordings".
+
+		Returns:
+			parameters (Dictionary): The parameters of the pipeline.
+			recordings (list): The names or glob patterns of the recordings listed in the file.
+	"""
+	with open(file_name) as file:
+		if file_name.endswith((".yaml", ".yml")):
+			try:
+				import yaml
+			except ImportError:
+				raise ImportError("Reading YAML parameter files requires PyYAML; use a JSON parameter file instead")
+
+			loaded = yaml.safe_load(file) or {}
+		else:
+			loaded = json.load(file)
+
+	recordings = loaded.pop("recordings", [])
+	unknown = set(loaded) - set(defaults)
+
+	if len(unknown) > 0:
+		raise ValueError("Unknown parameters in {}: {}".format(file_name, ", ".join(sorted(unknown))))
+
+	parameters = dict(defaults, **loaded)
+
+	if parameters["tolerance"] is None:
+		parameters["tolerance"] = math.inf
+
+	return parameters, [recordings] if isinstance(recordings, str) else list(recordings)
+
+def find_recordings(patterns):
+	"""
+		The function that expands a list of video names and glob patterns into the sorted list of videos they match.
+
+		Parameters:
+			patterns (list): The names or glob patterns of the recordings.
+
+		Returns:
+			recordings (list): The names of the recordings, each listed once.
+	"""
+	recordings = []
+
+	for pattern in patterns:
+		matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+		for name in matches:
+			if not os.path.isfile(name):
+				raise FileNotFoundError("No recording named " + name)
+
+			if name not in recordings:
+				recordings.append(name)
+
+	return recordings
+
+def job_directories(recordings, output_root):
+	#Helper function that returns the output directory of each recording, named after the video, with a hash of its path for videos sharing a name.
+
+	stems = [os.path.splitext(os.path.basename(name))[0] for name in recordings]
+
+	return [os.path.join(output_root, stem if stems.count(stem) == 1 else stem + "_" + hashlib.sha256(os.path.abspath(name).encode()).hexdigest()[:8])
+			for stem, name in zip(stems, recordings)]
+
+def job_key(video_name, parameters):
+	#Helper function that returns a hash identifying the video and the parameters of a job, so that finished jobs rerun when either changes.
+
+	stat = os.stat(video_name)
+	identity = dict(video = os.path.abspath(video_name), size = stat.st_size, modified = stat.st_mtime_ns, parameters = parameters)
+
+	return hashlib.sha256(json.dumps(identity, sort_keys = True, default = str).encode()).hexdigest()
+
+def finished(directory, key):
+	#Helper function that returns the summary of a finished job from its done.json file, or None if it hasn't finished with the same key.
+
+	try:
+		with open(os.path.join(directory, "done.json")) as file:
+			summary = json.load(file)
+	except (OSError, ValueError):
+		return None
+
+	return summary if summary.get("key") == key else None
+
+def run_job(job):
+	"""
+		The function that runs the whole pipeline of run.py on one recording, writing the export, the run report and optionally a plot of the
+		trajectories to the job's directory, followed by the done.json file marking it finished.
+
+		Parameters:
+			job (tuple): The name of the video, the output directory, the parameters, the key of the job and whether to plot the trajectories and
+				the histograms of their derivatives.
+
+		Returns:
+			summary (Dictionary): The video, directory, status, counts of rows and wall time of the job, and the error if it failed.
+	"""
+	video_name, directory, parameters, key, plot = job
+	p = parameters
+	summary = dict({"video": video_name, "directory": directory, "key": key})
+	begin = time.perf_counter()
+	os.makedirs(directory, exist_ok = True)
+	tp.quiet()
+
+	#A rerun clears the marker and error of the last run first, so that it isn't taken as finished if it fails.
+	for name in ("done.json", "error.txt"):
+		if os.path.exists(os.path.join(directory, name)):
+			os.remove(os.path.join(directory, name))
+
+	try:
+		angle = math.pi * p["angle"] / 180
+		length = p["length"] if p["length"] is not None else len(st.process_video(video_name)) - p["start_frame"]
+
+		with st.run_report() as report:
+			f = st.evaluate_features(video_name, p["particle_size"], p["particle_minmass"], p["start_frame"], length, p["noise"],
+									processes = p["processes"])
+			t = st.evaluate_trajectories(f, p["search_size"], p["lb_search_size"], p["step"], p["particle_memory"], predictor = p["predictor"])
+			t = st.fixed_filter_stubs(t, p["stub_length"])
+			linked = len(t)
+
+			t = st.postfiltering(t, None, p["stillness"], p["tolerance"], angle, p["error_tolerance"], p["filter_stub"],
+								x_restriction = p["x_restriction"], y_restriction = p["y_restriction"], columnar = True, window = p["window"],
+								order = p["order"])
+
+			derivatives = st.calc_derivatives(t, angle, x_restriction = p["x_restriction"], y_restriction = p["y_restriction"], window = p["window"],
+											order = p["order"])[:3]
+			st.export(t, derivatives = derivatives, output_name = os.path.join(directory, "output"), file_format = p["file_format"],
+					compression = p["compression"], partition = p["partition"], partition_size = p["partition_size"])
+
+		report.write(os.path.join(directory, "report.json"))
+
+		if plot:
+			rd.plot_trajectories(t, os.path.join(directory, "trajectories.png"))
+			rd.derivative_histograms(t, os.path.join(directory, "histograms"), derivatives = derivatives)
+
+		summary.update({"status": "done", "frames": int(length), "features": len(f), "linked": linked, "filtered": len(t),
+						"particles": int(t["particle"].nunique()) if len(t) > 0 else 0})
+	except Exception as error:
+		summary.update({"status": "failed", "error": "{}: {}".format(type(error).__name__, error)})
+
+		with open(os.path.join(directory, "error.txt"), "w") as file:
+			file.write(traceback.format_exc())
+
+	summary["wall_time"] = time.perf_counter() - begin
+
+	if summary["status"] == "done":
+		#The marker is renamed into place so that a job killed while writing it is never taken as finished.
+		with open(os.path.join(directory, "done.json.tmp"), "w") as file:
+			json.dump(summary, file, indent = 2)
+
+		os.replace(os.path.join(directory, "done.json.tmp"), os.path.join(directory, "done.json"))
+
+	return summary
+
+def run_batch(recordings, parameters, output_root = "Output", processes = 1, plot = False, resume = True, summary_name = "summary.json"):
+	"""
+		The function that runs the pipeline on each recording in a pool of worker processes, skipping the recordings already finished with the
+		same parameters, and writes a summary of every job.
+
+		Parameters:
+			recordings (list): The names of the videos to process.
+			parameters (Dictionary): The parameters of the pipeline, such as those read by load_parameters.
+			output_root (String): The directory holding the output directory of each recording.
+			processes (int): The number of recordings processed at once. Each recording still evaluates its features with the processes given
+				in the parameters, and Trackpy's batch locates with a pool of its own when that's 1, so the machine is shared between both.
+			plot (boolean): Whether to save a plot of the trajectories and histograms of their derivatives of each recording to its output directory.
+			resume (boolean): Whether to skip recordings whose output directory holds a done.json file written with the same video and parameters.
+			summary_name (String): The name of the summary file written to output_root.
+
+		Returns:
+			summaries (list): The summary of each job, in the order of the recordings.
+	"""
+	begin = time.perf_counter()
+	summaries = dict()
+	jobs = []
+
+	for video_name, directory in zip(recordings, job_directories(recordings, output_root)):
+		key = job_key(video_name, parameters)
+		summary = finished(directory, key) if resume else None
+
+		if summary is not None:
+			summaries[video_name] = dict(summary, status = "skipped")
+		else:
+			jobs.append((video_name, directory, parameters, key, plot))
+
+	print("{} recordings, {} already finished, {} to run using {} process(es)".format(len(recordings), len(summaries), len(jobs), processes))
+
+	if processes > 1 and len(jobs) > 1:
+		#The workers of an executor aren't daemonic, unlike those of a Pool, so each job can start the pools its stages use.
+		with concurrent.futures.ProcessPoolExecutor(min(processes, len(jobs))) as executor:
+			for future in concurrent.futures.as_completed([executor.submit(run_job, job) for job in jobs]):
+				summary = future.result()
+				summaries[summary["video"]] = summary
+				print("{}: {} in {:.1f} seconds".format(summary["video"], summary["status"], summary["wall_time"]))
+	else:
+		for job in jobs:
+			summary = run_job(job)
+			summaries[summary["video"]] = summary
+			print("{}: {} in {:.1f} seconds".format(summary["video"], summary["status"], summary["wall_time"]))
+
+	summaries = [summaries[video_name] for video_name in recordings]
+	elapsed = time.perf_counter() - begin
+	ran = [s for s in summaries if s["status"] == "done"]
+	counts = {status: sum(s["status"] == status for s in summaries) for status in ("done", "skipped", "failed")}
+	frames = sum(s["frames"] for s in ran)
+
+	os.makedirs(output_root, exist_ok = True)
+
+	with open(os.path.join(output_root, summary_name), "w") as file:
+		json.dump(dict({"parameters": parameters, "wall_time": elapsed, "frames": frames, "frames_per_second": frames / elapsed if elapsed > 0 else None,
+						"counts": counts, "jobs": summaries}), file, indent = 2, default = str)
+
+	print("Finished {done}, skipped {skipped}, failed {failed}".format(**counts) + " ({} frames in {:.1f} seconds)".format(frames, elapsed))
+
+	for s in summaries:
+		if s["status"] == "failed":
+			print("Failed {}: {} (see {})".format(s["video"], s["error"], os.path.join(s["directory"], "error.txt")))
+
+	return summaries
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Run the SandTracking pipeline on many recordings without any prompts.")
+	parser.add_argument("parameters", help = "a JSON or YAML file of pipeline parameters, which may list the recordings under \"recordings\"")
+	parser.add_argument("recordings", nargs = "*", help = "the videos or glob patterns to process, in place of those in the parameter file")
+	parser.add_argument("--output", default = "Output", help = "the directory holding an output directory for each recording")
+	parser.add_argument("--processes", type = int, default = 1, help = "the number of recordings processed at once")
+	parser.add_argument("--plot", action = "store_true", help = "save a plot of the trajectories and histograms of their derivatives of each recording")
+	parser.add_argument("--rerun", action = "store_true", help = "rerun recordings that have already finished")
+	parser.add_argument("--summary", default = "summary.json")
+	args = parser.parse_args()
+
+	parameters, listed = load_parameters(args.parameters)
+	recordings = find_recordings(args.recordings if len(args.recordings) > 0 else listed)
+
+	summaries = run_batch(recordings, parameters, args.output, args.processes, args.plot, not args.rerun, args.summary)
+
+	raise SystemExit(1 if any(s["status"] == "failed" for s in summaries) else 0)
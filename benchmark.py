@@ -0,0 +1,504 @@
+#Benchmarks for Falling Sand
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import av
+import numpy as np
+import pandas as pd
+import pims
+import pyarrow as pa
+import pyarrow.parquet as pq
+import trackpy as tp
+from scipy.spatial import cKDTree
+
+import SandTracking as st
+
+def legacy_grey(frame):
+	#Helper function reproducing the greyscale conversion used before grey_converter, including its swapped green and blue weights.
+
+	red = frame[:, :, 0]
+	blue = frame[:, :, 1]
+	green = frame[:, :, 2]
+
+	return red * 0.2125 + green * 0.7154 + blue * 0.0721
+
+def time_frames(video_frames, frames):
+	#Helper function that returns the seconds taken to produce a number of frames from a list of frames.
+
+	begin = time.perf_counter()
+
+	for i in range(frames):
+		video_frames[i]
+
+	return time.perf_counter() - begin
+
+def compare_features(reference, features, tolerance):
+	#Helper function that returns the fraction of reference features with a feature within tolerance pixels in the same frame, and the largest such distance.
+
+	matched = 0
+	largest = 0
+
+	for frame, r in reference.groupby("frame"):
+		f = features[features["frame"] == frame]
+
+		if len(f) == 0:
+			continue
+
+		distance = cKDTree(f[["x", "y"]].to_numpy()).query(r[["x", "y"]].to_numpy())[0]
+		matched += np.count_nonzero(distance <= tolerance)
+		largest = max(largest, distance[distance <= tolerance].max(initial = 0))
+
+	return matched / max(len(reference), 1), largest
+
+def benchmark_grey(video_name, particle_size, particle_minmass, frames, noise, tolerance = 0.5):
+	"""
+		The function that times each greyscale conversion path against the float64 conversion and checks that Trackpy's detections are unchanged.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			frames (int): The number of frames to evaluate.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			tolerance (double): The maximum distance in pixels between matching features.
+	"""
+	rgb = pims.PyAVReaderTimed(video_name)
+	frames = min(frames, len(rgb))
+	decoded = [rgb[i] for i in range(frames)]
+	converter = st.grey_converter(np.float32)
+
+	begin = time.perf_counter()
+	for frame in decoded:
+		legacy_grey(frame)
+	legacy = time.perf_counter() - begin
+
+	begin = time.perf_counter()
+	for frame in decoded:
+		converter.convert(frame)
+	fast = time.perf_counter() - begin
+
+	print("Conversion only: float64 {:.2f} ms per frame, grey_converter float32 {:.2f} ms per frame".format(legacy / frames * 1000, fast / frames * 1000))
+
+	paths = [("to_grey float64", dict()), ("grey_converter float32", dict(dtype = np.float32)), ("grey_converter uint8", dict(dtype = np.uint8)),
+			("PyAV grey decode", dict(decode_grey = True))]
+	reference = None
+
+	for name, options in paths:
+		elapsed = time_frames(st.process_video(video_name, **options), frames)
+		features = tp.batch(st.process_video(video_name, **options)[:frames], particle_size, minmass = particle_minmass, noise_size = noise)
+
+		if reference is None:
+			reference = features
+
+		matched, largest = compare_features(reference, features, tolerance)
+		print("{}: {:.1f} frames per second decoded, {} features, {:.1%} matched within {} pixels (largest shift {:.3f})".format(
+			name, frames / elapsed, len(features), matched, tolerance, largest))
+
+def benchmark_background(video_name, particle_size, particle_minmass, start_frame, length, noise, background, truth = None, tolerance = 1):
+	"""
+		The function that times feature detection with and without a background model and counts the features the model drops.
+
+		Parameters:
+			video_name (String): The name of the video to be evaluated.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			start_frame (int): The frame in the video from which to begin evaluation.
+			length (int): The number of frames to evaluate.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			background (st.background_subtractor): The background model to compare against whole frames.
+			truth (DataFrame): The DataFrame of true positions generated by generate_video, to score both sets of features against. Leave blank to skip scoring.
+			tolerance (double): The maximum distance in pixels between a feature and the true position it's matched with.
+
+		Returns:
+			result (Dictionary): The features found, the features dropped, the seconds taken and the accuracy of each path.
+	"""
+	begin = time.perf_counter()
+	plain = st.evaluate_features(video_name, particle_size, particle_minmass, start_frame, length, noise)
+	plain_time = time.perf_counter() - begin
+
+	begin = time.perf_counter()
+	masked = st.evaluate_features(video_name, particle_size, particle_minmass, start_frame, length, noise, background = background)
+	masked_time = time.perf_counter() - begin
+
+	result = dict({"features": len(plain), "background features": len(masked), "dropped": len(plain) - len(masked), "time": plain_time,
+				"background time": masked_time, "speedup": plain_time / masked_time})
+
+	print("Whole frames: {} features in {:.2f} seconds, background subtracted: {} features in {:.2f} seconds ({:.2f}x faster, {} features dropped)".format(
+		len(plain), plain_time, len(masked), masked_time, result["speedup"], result["dropped"]))
+
+	if truth is not None:
+		truth = truth[(truth["frame"] >= start_frame) & (truth["frame"] < start_frame + length)]
+		result["accuracy"] = tracking_accuracy(truth, plain, tolerance)
+		result["background accuracy"] = tracking_accuracy(truth, masked, tolerance)
+
+		print("Whole frames: precision {:.3f}, recall {:.3f}; background subtracted: precision {:.3f}, recall {:.3f}".format(
+			result["accuracy"]["precision"], result["accuracy"]["recall"], result["background accuracy"]["precision"],
+			result["background accuracy"]["recall"]))
+
+	return result
+
+tiers = dict({"1k": 1000, "10k": 10000, "100k": 100000})
+"""The amount of frames of the synthetic video of each scale tier."""
+
+densities = dict({"sparse": 10, "medium": 100, "dense": 1000, "packed": 10000})
+"""The amount of particles in view of the synthetic video of each density. Every density has frames of the same size, so the denser ones
+test crowded linking rather than just larger frames. The longest and densest videos are generated in chunks of frames, but the pipeline
+benchmarked still holds every feature of them in memory."""
+
+def generate_video(video_name, frames = 1000, particles = 10, width = 320, height = 240, sigma = 1.5, brightness = 200, background = 10, noise = 2,
+				occluders = 0, occluder_width = 10, stills = 0, gravity = 0.01, seed = 0, fps = 1000, truth_name = None, chunk_size = 1000):
+	"""
+		The function that writes a lossless greyscale video of particles falling along parabolic trajectories and returns their true positions.
+		The true positions and frames are generated and encoded a chunk of frames at a time, so long videos don't need every position in memory.
+
+		Parameters:
+			video_name (String): The name of the video to write.
+			frames (int): The number of frames.
+			particles (int): The average amount of particles in view in each frame.
+			width (int): The width of the frames in pixels.
+			height (int): The height of the frames in pixels.
+			sigma (double): The standard deviation in pixels of the Gaussian spot of each particle.
+			brightness (double): The peak brightness of each particle.
+			background (double): The brightness of the background.
+			noise (double): The standard deviation of the Gaussian noise added to each pixel.
+			occluders (int): The amount of vertical bars in front of the particles that hide them.
+			occluder_width (int): The width of each bar in pixels.
+			stills (int): The amount of still specks, like dust on the lens, which aren't particles and aren't in the true positions.
+			gravity (double): The downward acceleration of the particles in pixels per frame squared.
+			seed (int): The seed of the random generator.
+			fps (int): The frame rate stored in the video.
+			truth_name (String): The name of the Parquet file each chunk of true positions is appended to. Leave blank to return them instead.
+			chunk_size (int): The number of frames generated at a time.
+
+		Returns:
+			truth (DataFrame): The DataFrame of the true position (x, y), frame, particle and whether the particle is visible, for every frame a
+				particle is in view, or None if it's written to truth_name.
+	"""
+	rng = np.random.default_rng(seed)
+
+	#Particles enter at the top and leave at the bottom, so the amount spawned is set by how long they take to fall through the frame.
+	vy = rng.uniform(0.5, 1.5, 1024)
+	lifetime = np.mean((np.sqrt(vy ** 2 + 2 * gravity * (height + 2 * sigma)) - vy) / gravity)
+	count = max(1, int(round(particles * (frames + lifetime) / lifetime)))
+
+	x0 = rng.uniform(0, width, count)
+	vx = rng.normal(0, 0.3, count)
+	vy = rng.uniform(0.5, 1.5, count)
+	y0 = np.full(count, -2 * sigma)
+	life = np.ceil((np.sqrt(vy ** 2 + 2 * gravity * (height + 4 * sigma)) - vy) / gravity).astype(int)
+	t0 = rng.integers(-life.max(), frames, count)
+
+	first = np.maximum(t0, 0)
+	last = np.minimum(t0 + life, frames)
+
+	bars = rng.uniform(0, width - occluder_width, occluders)
+	specks = np.column_stack([rng.uniform(0, width, stills), rng.uniform(0, height, stills)])
+	radius = int(math.ceil(3 * sigma))
+	oy, ox = np.mgrid[-radius: radius + 1, -radius: radius + 1]
+
+	container = av.open(video_name, "w")
+	stream = container.add_stream("ffv1", rate = fps)
+	stream.width = width
+	stream.height = height
+	stream.pix_fmt = "gray"
+
+	chunks = []
+	writer = None
+	rows = 0
+
+	for begin in range(0, frames, chunk_size):
+		end = min(begin + chunk_size, frames)
+
+		#The rows of the chunk are every frame of every particle in view during it.
+		length = np.maximum(np.minimum(last, end) - np.maximum(first, begin), 0)
+		ID = np.repeat(np.arange(count), length)
+		frame = np.repeat(np.maximum(first, begin), length) + np.arange(len(ID)) - np.repeat(np.cumsum(length) - length, length)
+		t = frame - t0[ID]
+
+		truth = pd.DataFrame({"x": x0[ID] + vx[ID] * t, "y": y0[ID] + vy[ID] * t + gravity * t ** 2 / 2, "frame": frame, "particle": ID})
+		truth = truth[(truth["x"] > -sigma) & (truth["x"] < width + sigma)]
+		truth = truth.sort_values(["frame", "particle"], kind = "mergesort")
+		truth.index = pd.RangeIndex(rows, rows + len(truth))
+		rows += len(truth)
+
+		visible = np.ones(len(truth), dtype = bool)
+
+		for b in bars:
+			visible &= (truth["x"].to_numpy() < b) | (truth["x"].to_numpy() > b + occluder_width)
+
+		truth["visible"] = visible
+
+		bounds = np.searchsorted(truth["frame"].to_numpy(), np.arange(begin, end + 1))
+		x = truth["x"].to_numpy()
+		y = truth["y"].to_numpy()
+
+		for f in range(end - begin):
+			fx = np.concatenate([x[bounds[f]: bounds[f + 1]], specks[:, 0]])[:, None, None]
+			fy = np.concatenate([y[bounds[f]: bounds[f + 1]], specks[:, 1]])[:, None, None]
+			ix = np.floor(fx).astype(int) + ox
+			iy = np.floor(fy).astype(int) + oy
+			weight = brightness * np.exp(-((ix - fx) ** 2 + (iy - fy) ** 2) / (2 * sigma ** 2))
+			inside = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+
+			image = np.bincount((iy * width + ix)[inside], weight[inside], width * height).reshape(height, width) + background
+			image += rng.normal(0, noise, image.shape)
+
+			for b in bars:
+				image[:, int(b): int(b + occluder_width) + 1] = background
+
+			for packet in stream.encode(av.VideoFrame.from_ndarray(np.clip(image, 0, 255).astype(np.uint8), format = "gray")):
+				container.mux(packet)
+
+		if truth_name is None:
+			chunks.append(truth)
+		else:
+			table = pa.Table.from_pandas(truth)
+
+			if writer is None:
+				writer = pq.ParquetWriter(truth_name, table.schema)
+
+			writer.write_table(table)
+
+	for packet in stream.encode():
+		container.mux(packet)
+
+	container.close()
+
+	if writer is not None:
+		writer.close()
+
+	return pd.concat(chunks) if truth_name is None else None
+
+def label_truth(truth, data_frame, tolerance):
+	#Helper function that returns the true particle of each row of a DataFrame of features, the closest visible one within tolerance pixels in the same frame, or -1.
+
+	visible = truth[truth["visible"]]
+	separation = 4 * tolerance
+
+	#Frames are spread further apart than tolerance so a single KDTree only matches features within their own frame.
+	tree = cKDTree(np.column_stack((visible["x"], visible["y"], visible["frame"] * separation)))
+	distance, nearest = tree.query(np.column_stack((data_frame["x"], data_frame["y"], data_frame["frame"] * separation)), distance_upper_bound = tolerance)
+	found = np.isfinite(distance)
+
+	labels = np.full(len(data_frame), -1)
+	labels[found] = visible["particle"].to_numpy()[nearest[found]]
+
+	return labels
+
+def tracking_accuracy(truth, data_frame, tolerance = 1):
+	"""
+		The function that scores features or trajectories against the true positions of a synthetic video.
+
+		Parameters:
+			truth (DataFrame): The DataFrame of true positions generated by generate_video.
+			data_frame (DataFrame): The DataFrame of features or trajectory information generated by Trackpy.
+			tolerance (double): The maximum distance in pixels between a feature and the true position it's matched with.
+
+		Returns:
+			accuracy (Dictionary): The fraction of features matching a true position (precision), of visible true positions matched (recall) and, for
+				trajectories, the fraction of points in the true particle most common in their trajectory (purity) and in the trajectory most common
+				for their true particle (completeness).
+	"""
+	labels = label_truth(truth, data_frame, tolerance)
+	matched = labels >= 0
+	visible = int(truth["visible"].sum())
+
+	accuracy = dict({"precision": float(matched.mean()) if len(labels) > 0 else 0.0,
+					"recall": len(np.unique(np.column_stack((labels, data_frame["frame"]))[matched], axis = 0)) / max(visible, 1)})
+
+	if "particle" in data_frame:
+		pairs = pd.DataFrame({"track": data_frame["particle"].to_numpy()[matched], "truth": labels[matched]})
+		counts = pairs.groupby(["track", "truth"]).size()
+		accuracy["purity"] = float(counts.groupby(level = "track").max().sum() / max(len(data_frame), 1))
+		accuracy["completeness"] = float(counts.groupby(level = "truth").max().sum() / max(visible, 1))
+
+	return accuracy
+
+def run_stage(report, name, function, *args, **kwargs):
+	#Helper function that runs a public function of SandTracking as a stage of a run_report under a given name, returning its result.
+
+	function = getattr(function, "__wrapped__", function)
+	result = report.run(function, args, kwargs)
+	report.stages[-1]["stage"] = name
+
+	return result
+
+def benchmark_tier(video_name, truth, particle_size = 7, particle_minmass = 500, noise = 1, tolerance = 1, output_name = None):
+	"""
+		The function that times the public functions of SandTracking on a synthetic video and scores the tracking against its true positions.
+
+		Parameters:
+			video_name (String): The name of the synthetic video.
+			truth (DataFrame): The DataFrame of true positions generated by generate_video, of every frame or of the first frames, in which case
+				only those frames are scored.
+			particle_size (int): The odd-number size of the feature to be detected by Trackpy.
+			particle_minmass (double): The minimum feature brightness to filter using Trackpy's filtering functions.
+			noise (double): The width of the Gaussian blurring kernel used by Trackpy, in pixels.
+			tolerance (double): The maximum distance in pixels between a feature and the true position it's matched with.
+			output_name (String): The name of the folder the export is written to, or None for a temporary folder.
+
+		Returns:
+			result (Dictionary): The stages recorded by the run_report, keyed by name, and the accuracy of the features, trajectories and filtered trajectories.
+	"""
+	frames = len(st.process_video(video_name))
+	scored = int(truth["frame"].max()) + 1
+	angle = math.pi * 15 / 180
+	folder = tempfile.mkdtemp() if output_name is None else output_name
+
+	with st.run_report() as report:
+		f = run_stage(report, "evaluate_features", st.evaluate_features, video_name, particle_size, particle_minmass, 0, frames, noise)
+		t = run_stage(report, "evaluate_trajectories", st.evaluate_trajectories, f, 10, 2, 0.9, 3)
+		t = run_stage(report, "fixed_filter_stubs", st.fixed_filter_stubs, t, 10)
+		linked = t.copy()
+
+		run_stage(report, "calc_derivatives", st.calc_derivatives, t, angle, y_restriction = -1)
+		run_stage(report, "fit_polylines", st.fit_polylines, t)
+		run_stage(report, "merge_fragments", st.merge_fragments, t, 1)
+		run_stage(report, "filter_trajectories", st.filter_trajectories, t, 100, math.inf, angle, 10, y_restriction = -1, error_tolerance = 1)
+		filtered = run_stage(report, "postfiltering", st.postfiltering, t, None, 100, math.inf, angle, 1, 10, y_restriction = -1, columnar = True)
+		run_stage(report, "export", st.export, filtered, output_name = os.path.join(folder, "output"))
+
+	if output_name is None:
+		shutil.rmtree(folder, ignore_errors = True)
+
+	accuracy = {name: tracking_accuracy(truth, data_frame[data_frame["frame"] < scored], tolerance) for name, data_frame in
+				(("features", f), ("trajectories", linked), ("filtered", filtered))}
+
+	return dict({"stages": {record["stage"]: record for record in report.stages}, "accuracy": accuracy})
+
+def compare_baseline(results, baseline, slowdown = 0.25, accuracy_drop = 0.01, minimum_time = 0.05):
+	"""
+		The function that lists the stages that became slower and the scores that became worse than a stored baseline.
+
+		Parameters:
+			results (Dictionary): The results of benchmark_suite.
+			baseline (Dictionary): The results of an earlier run of benchmark_suite.
+			slowdown (double): The fraction a stage's wall time can grow by before it's flagged.
+			accuracy_drop (double): The amount a score can fall by before it's flagged.
+			minimum_time (double): The wall time in seconds below which stages aren't compared, since their timings are mostly noise.
+
+		Returns:
+			regressions (String list): The descriptions of the regressions found.
+	"""
+	regressions = []
+
+	for tier, result in results.items():
+		if tier not in baseline:
+			continue
+
+		for name, record in result["stages"].items():
+			before = baseline[tier]["stages"].get(name)
+
+			if before is not None and before["wall_time"] >= minimum_time and record["wall_time"] > before["wall_time"] * (1 + slowdown):
+				regressions.append("{} {}: {:.3f} s, baseline {:.3f} s".format(tier, name, record["wall_time"], before["wall_time"]))
+
+		for name, scores in result["accuracy"].items():
+			for score, value in scores.items():
+				before = baseline[tier]["accuracy"].get(name, dict()).get(score)
+
+				if before is not None and value < before - accuracy_drop:
+					regressions.append("{} {} {}: {:.4f}, baseline {:.4f}".format(tier, name, score, value, before))
+
+	return regressions
+
+def benchmark_suite(tier_names = ("1k",), directory = "Benchmarks", baseline_name = None, output_name = "benchmark.json", width = 640, height = 480, seed = 0,
+					scored_frames = 1000, density_names = ("sparse",)):
+	"""
+		The function that benchmarks every chosen scale tier at every chosen density on its synthetic video, generating the videos that aren't in
+		the directory yet, and writes the results to a json file, printing any regressions against a baseline.
+
+		Parameters:
+			tier_names (String list): The names of the tiers in tiers to run.
+			directory (String): The folder the synthetic videos and their true positions are kept in.
+			baseline_name (String): The name of the json file of an earlier run to compare against, or None to skip the comparison.
+			output_name (String): The name of the json file to write the results to.
+			width (int): The width of the frames of every video in pixels.
+			height (int): The height of the frames of every video in pixels.
+			seed (int): The seed of the random generator of the videos.
+			scored_frames (int): The number of frames at the start of each video whose true positions are read to score the tracking.
+			density_names (String list): The names of the densities in densities to run each tier at.
+
+		Returns:
+			results (Dictionary): The results of benchmark_tier for each tier and density, keyed by their names joined by an underscore.
+	"""
+	os.makedirs(directory, exist_ok = True)
+	results = dict()
+
+	for name in ["{}_{}".format(tier, density) for tier in tier_names for density in density_names]:
+		frames, particles = tiers[name.split("_")[0]], densities[name.split("_")[1]]
+		video_name = os.path.join(directory, "falling_{}_{}_{}x{}_{}.avi".format(frames, particles, width, height, seed))
+		truth_name = os.path.splitext(video_name)[0] + ".parquet"
+
+		if not (os.path.exists(video_name) and os.path.exists(truth_name)):
+			generate_video(video_name, frames, particles, width, height, seed = seed, truth_name = truth_name + ".tmp")
+			os.replace(truth_name + ".tmp", truth_name)
+
+		truth = pd.read_parquet(truth_name, filters = [("frame", "<", scored_frames)])
+		results[name] = benchmark_tier(video_name, truth)
+
+		for stage, record in results[name]["stages"].items():
+			print("{} {}: {:.3f} s wall, {:.3f} s CPU, peak RSS {:.0f} MB".format(name, stage, record["wall_time"], record["cpu_time"],
+				record["peak_rss_mb"] or 0))
+
+		print("{} accuracy: {}".format(name, results[name]["accuracy"]))
+
+	with open(output_name, "w") as file:
+		json.dump(results, file, indent = 4)
+
+	if baseline_name is not None:
+		with open(baseline_name) as file:
+			regressions = compare_baseline(results, json.load(file))
+
+		for regression in regressions:
+			print("Regression: " + regression)
+
+		if len(regressions) == 0:
+			print("No regressions against " + baseline_name)
+
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Benchmark SandTracking.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+
+	grey = commands.add_parser("grey", help = "benchmark the greyscale conversion paths on a video")
+	grey.add_argument("video_name")
+	grey.add_argument("--size", type = int, default = 7)
+	grey.add_argument("--minmass", type = float, default = 100)
+	grey.add_argument("--frames", type = int, default = 100)
+	grey.add_argument("--noise", type = float, default = 1)
+
+	background = commands.add_parser("background", help = "benchmark feature detection with background subtraction and motion masking on a video")
+	background.add_argument("video_name")
+	background.add_argument("--size", type = int, default = 7)
+	background.add_argument("--minmass", type = float, default = 100)
+	background.add_argument("--frames", type = int, default = 100)
+	background.add_argument("--noise", type = float, default = 1)
+	background.add_argument("--method", default = "median", choices = ["median", "exponential"])
+	background.add_argument("--tile", type = int, default = None)
+	background.add_argument("--truth", default = None, help = "a Parquet file of the true positions of a synthetic video")
+
+	suite = commands.add_parser("suite", help = "benchmark the pipeline on synthetic videos of each scale tier and density")
+	suite.add_argument("--tiers", nargs = "+", default = ["1k"], choices = list(tiers.keys()))
+	suite.add_argument("--densities", nargs = "+", default = ["sparse"], choices = list(densities.keys()))
+	suite.add_argument("--directory", default = "Benchmarks")
+	suite.add_argument("--baseline", default = None)
+	suite.add_argument("--output", default = "benchmark.json")
+	args = parser.parse_args()
+
+	tp.quiet()
+
+	if args.command == "grey":
+		benchmark_grey(args.video_name, args.size, args.minmass, args.frames, args.noise)
+	elif args.command == "background":
+		truth = None if args.truth is None else pd.read_parquet(args.truth)
+		benchmark_background(args.video_name, args.size, args.minmass, 0, args.frames, args.noise,
+							st.background_subtractor(args.method, tile_size = args.tile), truth)
+	else:
+		benchmark_suite(args.tiers, args.directory, args.baseline, args.output, density_names = args.densities)
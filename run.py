@@ -1,4 +1,5 @@
 import SandTracking as st
+import Rendering as rd
 import math
 
 ##Execution##
@@ -19,16 +20,16 @@ startFrame = int(input())
 print("Enter the number of frames to evaluate")
 frameLength = int(input())
 
-t = st.evaluate_features(videoName, particleSize, particleTolerance, startFrame, frameLength, 4)
-t = st.evaluate_trajectories(t, 50, 10, 0.99, 3)
-t = st.fixed_filter_stubs(t, 10)
-
-particles = st.extract_particles(t)
-
-t = st.postfiltering(t, particles, 5000, math.inf, math.pi * 15 / 180, 10000, 10, y_restriction = -1)
-
-st.traj_plot(t)
-st.export(t, particles)
+with st.run_report() as report:
+	t = st.evaluate_features(videoName, particleSize, particleTolerance, startFrame, frameLength, 4)
+	t = st.evaluate_trajectories(t, 50, 10, 0.99, 3)
+	t = st.fixed_filter_stubs(t, 10)
+	t = st.postfiltering(t, None, 5000, math.inf, math.pi * 15 / 180, 10000, 10, y_restriction = -1, columnar = True)
 
+	derivatives = st.calc_derivatives(t, math.pi * 15 / 180, y_restriction = -1)[:3]
+	st.export(t, derivatives = derivatives)
 
+report.write("report.json")
 
+rd.plot_trajectories(t, "trajectories.png")
+rd.derivative_histograms(t, "histograms", derivatives = derivatives)
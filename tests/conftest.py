@@ -0,0 +1,35 @@
+#Shared fixtures for the Falling Sand tests
+
+import os
+import sys
+
+import pytest
+import trackpy as tp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark as bm
+import SandTracking as st
+
+tp.quiet()
+
+@pytest.fixture(scope = "session")
+def synthetic(tmp_path_factory):
+	#Fixture writing a short synthetic video of falling particles and a few still specks, returning its name and true positions.
+
+	video_name = str(tmp_path_factory.mktemp("video") / "falling.avi")
+	truth = bm.generate_video(video_name, frames = 120, particles = 8, width = 160, height = 120, stills = 3, seed = 3)
+
+	return video_name, truth
+
+@pytest.fixture(scope = "session")
+def features(synthetic):
+	#Fixture locating the features of every frame of the synthetic video.
+
+	return st.evaluate_features(synthetic[0], 7, 300, 0, 120, 1)
+
+@pytest.fixture(scope = "session")
+def trajectories(features):
+	#Fixture linking the features of the synthetic video and dropping the stubs, as run.py does.
+
+	return st.fixed_filter_stubs(st.evaluate_trajectories(features, 10, 2, 0.9, 3), 10)
@@ -0,0 +1,84 @@
+import json
+import math
+import os
+import shutil
+
+import pytest
+
+import batch
+
+#Parameters suited to the short synthetic video, whose particles are small and faint and fall a few pixels a frame.
+synthetic_parameters = dict({"particle_minmass": 300, "noise": 1, "length": 60, "search_size": 10, "lb_search_size": 2, "step": 0.9,
+							"stillness": 100, "error_tolerance": 1})
+
+def test_load_parameters_fills_in_defaults(tmp_path):
+	file_name = str(tmp_path / "parameters.json")
+
+	with open(file_name, "w") as file:
+		json.dump({"particle_size": 9, "tolerance": None, "recordings": "Recordings/*.avi"}, file)
+
+	parameters, recordings = batch.load_parameters(file_name)
+
+	assert parameters == dict(batch.defaults, particle_size = 9, tolerance = math.inf)
+	assert recordings == ["Recordings/*.avi"]
+
+	with open(file_name, "w") as file:
+		json.dump({"particle_sise": 9}, file)
+
+	with pytest.raises(ValueError, match = "particle_sise"):
+		batch.load_parameters(file_name)
+
+def test_load_parameters_reads_yaml(tmp_path):
+	pytest.importorskip("yaml")
+	file_name = str(tmp_path / "parameters.yaml")
+
+	with open(file_name, "w") as file:
+		file.write("angle: 20\nrecordings:\n  - a.avi\n  - b.avi\n")
+
+	parameters, recordings = batch.load_parameters(file_name)
+
+	assert parameters["angle"] == 20 and recordings == ["a.avi", "b.avi"]
+
+def test_job_key_follows_video_and_parameters(synthetic, tmp_path):
+	video_name = str(tmp_path / "falling.avi")
+	shutil.copy(synthetic[0], video_name)
+	key = batch.job_key(video_name, batch.defaults)
+
+	assert batch.job_key(video_name, dict(batch.defaults)) == key
+	assert batch.job_key(video_name, dict(batch.defaults, angle = 20)) != key
+
+	os.utime(video_name, ns = (0, 0))
+	assert batch.job_key(video_name, batch.defaults) != key
+
+def test_run_batch_resumes_and_summarises(synthetic, tmp_path):
+	video_name = str(tmp_path / "falling.avi")
+	broken_name = str(tmp_path / "broken.avi")
+	shutil.copy(synthetic[0], video_name)
+
+	with open(broken_name, "w") as file:
+		file.write("not a video")
+
+	output_root = str(tmp_path / "Output")
+	parameters = dict(batch.defaults, **synthetic_parameters)
+	first = batch.run_batch([video_name, broken_name], parameters, output_root)
+
+	assert [s["status"] for s in first] == ["done", "failed"]
+	assert first[0]["frames"] == 60 and 0 < first[0]["filtered"] <= first[0]["linked"]
+	assert os.path.exists(os.path.join(first[0]["directory"], "output", "raw_data.parquet"))
+	assert os.path.exists(os.path.join(first[1]["directory"], "error.txt"))
+	assert batch.finished(first[0]["directory"], first[0]["key"]) is not None
+	assert batch.finished(first[1]["directory"], first[1]["key"]) is None
+
+	with open(os.path.join(output_root, "summary.json")) as file:
+		summary = json.load(file)
+
+	assert summary["counts"] == {"done": 1, "skipped": 0, "failed": 1}
+	assert summary["frames"] == 60 and [job["video"] for job in summary["jobs"]] == [video_name, broken_name]
+
+	#Finished jobs are skipped until their parameters change, while failed jobs are retried.
+	second = batch.run_batch([video_name, broken_name], parameters, output_root)
+	assert [s["status"] for s in second] == ["skipped", "failed"]
+
+	third = batch.run_batch([video_name], dict(parameters, filter_stub = 5), output_root)
+	assert [s["status"] for s in third] == ["done"]
+	assert batch.finished(third[0]["directory"], first[0]["key"]) is None
@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import signal
+
+import SandTracking as st
+
+angle = math.pi * 15 / 180
+
+def table(derivatives, columns):
+	#Helper function that turns a list of (X, Y, Error, Frame) tuples of a particle into rows of X, Y, the two errors and the frame.
+
+	return np.array([(d[0], d[1], d[2][0], d[2][1], d[3]) for d in derivatives], dtype = float).reshape(-1, len(columns))
+
+@pytest.mark.parametrize("x_restriction, y_restriction", [(0, 0), (0, -1)])
+def test_calc_derivatives_matches_analyze(trajectories, x_restriction, y_restriction):
+	t = trajectories.copy()
+	particles = st.extract_particles(t)
+
+	for p in particles.values():
+		p.analyze(angle, x_restriction, y_restriction)
+
+	velocity_data, acceleration_data, jerk_data, average_data = st.calc_derivatives(t, angle, x_restriction, y_restriction)
+
+	assert len(particles) > 10
+	assert sorted(average_data.index) == sorted(particles)
+
+	for p in particles.values():
+		for k, (data, columns) in enumerate([(velocity_data, ["x_vel", "y_vel", "x_err", "y_err", "frame"]),
+											(acceleration_data, ["x_accel", "y_accel", "x_err", "y_err", "frame"]),
+											(jerk_data, ["x_jerk", "y_jerk", "x_err", "y_err", "frame"])], 1):
+			expected = table(p.pos_derivative[k], columns)
+			got = data.loc[data["particle"] == p.ID, columns].to_numpy(dtype = float)
+
+			np.testing.assert_allclose(got, expected, rtol = 1e-9, atol = 1e-9)
+
+		velocity = velocity_data[velocity_data["particle"] == p.ID]
+
+		assert sorted(velocity.loc[velocity["irregular"], "index"]) == sorted(p.irregular)
+
+		average = average_data.loc[p.ID]
+		np.testing.assert_allclose([average["x_vel"], average["y_vel"], average["x_accel"], average["y_accel"], average["x_jerk"], average["y_jerk"]],
+								[*p.average[0], *p.average[1], *p.average[2]], rtol = 1e-9, atol = 1e-9)
+		assert average["irregular"] == len(p.irregular)
+
+@pytest.mark.parametrize("stillness, tolerance, angle, filter_stub", [(100, math.inf, angle, 10), (50, 3, angle / 2, 5), (0, 0, angle, 10),
+																	(100, math.inf, angle * 0.3, 3)])
+@pytest.mark.parametrize("error_tolerance", [None, 1])
+def test_filter_session_matches_filter_trajectories(trajectories, stillness, tolerance, angle, filter_stub, error_tolerance):
+	session = st.filter_session(trajectories, y_restriction = -1)
+
+	expected = st.filter_trajectories(trajectories, stillness, tolerance, angle, filter_stub, y_restriction = -1, error_tolerance = error_tolerance)
+	got = session.filter(stillness, tolerance, angle, filter_stub, error_tolerance)
+
+	assert got.index.equals(expected.index)
+	np.testing.assert_array_equal(got["particle"].to_numpy(), expected["particle"].to_numpy())
+
+def test_filter_session_reuses_polylines(trajectories):
+	session = st.filter_session(trajectories, y_restriction = -1)
+	first = session.filter(100, math.inf, angle * 0.3, 3, 1)
+	second = session.filter(100, math.inf, angle * 0.3, 3, 1)
+
+	assert session.polylines.fitted == 0
+	assert first.equals(second)
+
+def path(frames, x, y, ID = 0, ep = 0.2):
+	#Helper function that returns the rows of a particle at the given frames and positions.
+
+	return pd.DataFrame({"x": x, "y": y, "frame": frames, "particle": ID, "ep": ep})
+
+def test_window_matches_savgol_filter():
+	frames = np.arange(40)
+	rng = np.random.default_rng(0)
+	data_frame = path(frames, np.cumsum(rng.normal(1, 0.3, 40)), 0.02 * frames ** 2 + rng.normal(0, 0.3, 40))
+
+	velocity_data, acceleration_data = st.calc_derivatives(data_frame, angle, window = 7, order = 3)[:2]
+
+	#Savitzky-Golay filters in interp mode fit the first and last windows of the path at its ends, as the windows are shifted to stay within it.
+	for data, columns, k in ((velocity_data, ("x_vel", "y_vel"), 1), (acceleration_data, ("x_accel", "y_accel"), 2)):
+		for column, values in zip(columns, (data_frame["x"], data_frame["y"])):
+			expected = signal.savgol_filter(values.to_numpy(), 7, 3, deriv = k, delta = 1 / st.frames_per_second, mode = "interp")
+			np.testing.assert_allclose(data[column].to_numpy(), expected, rtol = 1e-6)
+
+def test_window_recovers_cubic():
+	#The frames have gaps, so the fits are of unevenly spaced rows.
+	frames = np.array([0, 1, 2, 4, 5, 6, 9, 10, 11, 12, 15, 16, 17, 18, 20], dtype = float)
+	t = frames / st.frames_per_second
+	data_frame = path(frames, 3 + 2 * t - 50 * t ** 2 + 4000 * t ** 3, 1 - t + 20 * t ** 2 - 1000 * t ** 3)
+
+	velocity_data, acceleration_data, jerk_data, average_data = st.calc_derivatives(data_frame, angle, window = 5, order = 3)
+
+	np.testing.assert_allclose(velocity_data["x_vel"], 2 - 100 * t + 12000 * t ** 2, rtol = 1e-6)
+	np.testing.assert_allclose(acceleration_data["y_accel"], 40 - 6000 * t, rtol = 1e-6)
+	np.testing.assert_allclose(jerk_data[["x_jerk", "y_jerk"]].to_numpy(), np.tile([24000, -6000], (len(t), 1)), rtol = 1e-6)
+
+	#The averages of fitted derivatives are plain means.
+	np.testing.assert_allclose(average_data.loc[0, ["x_accel", "x_jerk"]].to_numpy(dtype = float), [np.mean(-100 + 24000 * t), 24000], rtol = 1e-6)
+
+def test_window_errors_match_monte_carlo():
+	frames = np.arange(30)
+	data_frame = path(frames, frames * 2.0, frames * 3.0, ep = np.linspace(0.1, 0.5, 30))
+	velocity_data, acceleration_data = st.calc_derivatives(data_frame, angle, window = 9, order = 2)[:2]
+
+	#Each position is redrawn 2000 times with the standard deviation of its error, half its ep, each draw being a particle of its own.
+	draws = pd.concat([data_frame.assign(particle = i) for i in range(2000)], ignore_index = True)
+	draws["x"] += np.random.default_rng(1).normal(0, draws["ep"] / 2)
+	noisy_velocity, noisy_acceleration = st.calc_derivatives(draws, angle, window = 9, order = 2)[:2]
+
+	for data, noisy, column in ((velocity_data, noisy_velocity, "x_vel"), (acceleration_data, noisy_acceleration, "x_accel")):
+		spread = noisy[column].to_numpy().reshape(2000, -1).std(axis = 0)
+		np.testing.assert_allclose(data["x_err"], spread, rtol = 0.1)
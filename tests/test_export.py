@@ -0,0 +1,71 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import SandTracking as st
+
+angle = math.pi * 15 / 180
+
+def test_export_keeps_columnar_fragments(trajectories, tmp_path):
+	particles = st.extract_particles(trajectories)
+	t = st.postfiltering(trajectories.copy(), particles, 100, math.inf, angle * 0.3, 1, 3, y_restriction = -1, columnar = True)
+
+	#The columnar path splits trajectories without touching the particles, so some of the IDs exported are only in the DataFrame.
+	assert not set(t["particle"]) <= set(particles)
+
+	file_names = st.export(t, particles, output_name = str(tmp_path / "output"))
+	velocity = pd.read_parquet([name for name in file_names if name.endswith("velocity_data.parquet")][0])
+
+	assert set(velocity["particle"]) == set(t.groupby("particle").filter(lambda p: len(p) > 1)["particle"])
+	np.testing.assert_allclose(velocity[["x_vel", "y_vel"]].to_numpy(), st.calc_derivatives(t, math.pi)[0][["x_vel", "y_vel"]].to_numpy())
+
+def read_table(file_name, file_format):
+	#Helper function that reads back one table written by export, restoring the index the way write_table stores it.
+
+	if file_format == "parquet":
+		return pd.read_parquet(file_name)
+	elif file_format == "feather":
+		t = pd.read_feather(file_name)
+		return t.set_index(t.columns[0]).rename_axis(None if t.columns[0] == "index" else t.columns[0])
+	else:
+		return pd.read_csv(file_name, index_col = 0)
+
+@pytest.mark.parametrize("file_format, compression", [("parquet", None), ("feather", "zstd"), ("csv", None), ("csv", "gzip")])
+@pytest.mark.parametrize("partition", [None, "frame", "particle"])
+def test_export_round_trips(trajectories, tmp_path, file_format, compression, partition):
+	derivatives = st.calc_derivatives(trajectories, angle)[:3]
+	file_names = st.export(trajectories, derivatives = derivatives, output_name = str(tmp_path / "output"), file_format = file_format,
+						compression = compression, partition = partition, partition_size = 25)
+
+	for name, expected in [("raw_data", trajectories), ("velocity_data", derivatives[0][["x_vel", "y_vel", "x_err", "y_err", "frame", "particle"]])]:
+		written = [f for f in file_names if os.path.basename(os.path.dirname(f) if partition is not None else f).startswith(name)]
+
+		if partition is None:
+			assert len(written) == 1
+		else:
+			#Each file holds the rows of partition_size consecutive frames or particle IDs, named after the first of them; velocities sit between frames.
+			assert len(written) == len(np.unique(expected[partition].to_numpy() // 25))
+
+			for f in written:
+				part = read_table(f, file_format)
+				start = int(os.path.basename(f).split("_")[1].split(".")[0])
+				assert ((part[partition] >= start) & (part[partition] < start + 25)).all()
+
+		t = pd.concat([read_table(f, file_format) for f in written])
+		pd.testing.assert_frame_equal(t.sort_values(["particle", "frame"]), expected.sort_values(["particle", "frame"]), check_dtype = False,
+									check_index_type = False, check_names = False)
+
+@pytest.mark.parametrize("file_format, module", [("hdf", "tables"), ("excel", "openpyxl")])
+def test_export_round_trips_single_file_formats(trajectories, tmp_path, file_format, module):
+	pytest.importorskip(module)
+	file_names = st.export(trajectories, output_name = str(tmp_path / "output"), file_format = file_format)
+
+	if file_format == "hdf":
+		t = pd.read_hdf(file_names[0], "raw_data")
+	else:
+		t = pd.read_excel(file_names[0], sheet_name = "raw data", index_col = 0)
+
+	pd.testing.assert_frame_equal(t, trajectories, check_dtype = False, check_index_type = False, check_names = False)
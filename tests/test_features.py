@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import SandTracking as st
+
+def test_frames_evaluated_are_reported(synthetic):
+	with st.run_report() as report:
+		f = st.evaluate_features(synthetic[0], 7, 300, 5, 40, 1, stride = 4)
+
+	assert report.counters["frames evaluated"] == 10
+	assert [stage["stage"] for stage in report.stages] == ["evaluate_features"]
+	np.testing.assert_array_equal(np.unique(f["frame"]) % 4, 0)
+
+def test_grey_converter_frames_are_not_overwritten(synthetic):
+	reference = st.process_video(synthetic[0])
+	converted = st.process_video(synthetic[0], np.float32)
+	rounded = st.process_video(synthetic[0], np.uint8)
+
+	frames = [converted[i] for i in (10, 60, 110)]
+	whole = [rounded[i] for i in (10, 60, 110)]
+
+	for frame, grey, i in zip(frames, whole, (10, 60, 110)):
+		assert frame.dtype == np.float32 and grey.dtype == np.uint8
+		np.testing.assert_allclose(frame, reference[i], atol = 1e-3)
+		np.testing.assert_array_equal(grey, np.rint(reference[i]).astype(np.uint8))
+
+def test_cache_keeps_chunk_sizes_apart(synthetic, tmp_path):
+	directory = str(tmp_path / "cache")
+	reference = st.evaluate_features(synthetic[0], 7, 300, 0, 100, 1)
+
+	first = st.evaluate_features(synthetic[0], 7, 300, 0, 100, 1, cache = st.feature_cache(directory, chunk_size = 100))
+	second = st.evaluate_features(synthetic[0], 7, 300, 0, 100, 1, cache = st.feature_cache(directory, chunk_size = 50))
+	again = st.evaluate_features(synthetic[0], 7, 300, 0, 100, 1, cache = st.feature_cache(directory, chunk_size = 100))
+
+	for f in (first, second, again):
+		assert len(f) == len(reference)
+		np.testing.assert_allclose(f[["x", "y", "frame"]].to_numpy(dtype = float), reference[["x", "y", "frame"]].to_numpy(dtype = float))
+
+def test_cache_eviction_removes_empty_keys(synthetic, tmp_path):
+	cache = st.feature_cache(str(tmp_path / "cache"), chunk_size = 50)
+	st.evaluate_features(synthetic[0], 7, 300, 0, 100, 1, cache = cache)
+	st.evaluate_features(synthetic[0], 7, 500, 0, 100, 1, cache = cache)
+
+	assert len(os.listdir(cache.directory)) == 2
+
+	cache.max_size = 0
+	cache.evict()
+
+	assert os.listdir(cache.directory) == []
+
+def test_transcode_rebuilds_for_other_settings(synthetic, tmp_path):
+	store_name = str(tmp_path / "falling.npy")
+
+	st.transcode(synthetic[0], store_name, dtype = np.float32)
+	assert st.frame_store(store_name).pixel_type == np.float32
+
+	st.transcode(synthetic[0], store_name, dtype = np.uint8)
+	assert st.frame_store(store_name).pixel_type == np.uint8
+	modified = os.stat(store_name).st_mtime_ns
+
+	st.transcode(synthetic[0], store_name, dtype = np.uint8)
+	assert os.stat(store_name).st_mtime_ns == modified
+
+	st.transcode(synthetic[0], store_name, dtype = np.uint8, decode_grey = True)
+	assert os.stat(store_name).st_mtime_ns != modified
+	np.testing.assert_array_equal(st.process_video(store_name)[30], st.process_video(synthetic[0], decode_grey = True)[30])
+
+def test_background_fit_on_float32_frames(synthetic):
+	converted = st.background_subtractor().fit(st.process_video(synthetic[0], np.float32))
+	reference = st.background_subtractor().fit(st.process_video(synthetic[0]))
+
+	assert converted.background.dtype == np.float32
+	np.testing.assert_allclose(converted.background, reference.background, atol = 1e-3)
+	assert converted.noise == pytest.approx(reference.noise, abs = 1e-3)
+
+def test_background_results_do_not_depend_on_processes(synthetic):
+	background = st.background_subtractor(tile_size = 32)
+	serial = st.evaluate_features(synthetic[0], 7, 300, 0, 120, 1, chunk_size = 50, background = background)
+	parallel = st.evaluate_features(synthetic[0], 7, 300, 0, 120, 1, processes = 2, chunk_size = 50, background = background)
+
+	assert len(serial) > 0
+	pd.testing.assert_frame_equal(serial, parallel)
+
+def test_grey_reader_ends_at_last_decoded_frame(synthetic):
+	reader = st.grey_reader(synthetic[0])
+	last = np.array(reader[119])
+
+	#A duration longer than the video, as some containers give, is corrected once decoding runs out of frames.
+	reader.length = 130
+	assert len(reader) == 130
+
+	with pytest.raises(IndexError):
+		reader[125]
+
+	assert len(reader) == 120
+	np.testing.assert_array_equal(reader[119], last)
+
+def test_roi_features_match_whole_frames_inside_the_crop(synthetic, features):
+	video_name, truth = synthetic
+	roi = (40, 20, 80, 70)
+	cropped = st.evaluate_features(video_name, 7, 300, 0, 120, 1, roi = roi)
+
+	frame = np.asarray(st.process_video(video_name)[0])
+	assert np.shares_memory(st.frame_cropper(roi).crop(frame), frame)
+	assert st.frame_cropper(roi).crop(frame).shape == (70, 80)
+
+	#Away from the edges of the crop, where Trackpy's filters see the same pixels, the features are those of whole frames in whole frame pixels.
+	def inside(f):
+		return f[f["x"].between(roi[0] + 7, roi[0] + roi[2] - 7) & f["y"].between(roi[1] + 7, roi[1] + roi[3] - 7)].sort_values(["frame", "x"])
+
+	expected, found = inside(features), inside(cropped)
+
+	assert len(expected) > 0 and len(found) == len(expected)
+	np.testing.assert_array_equal(found["frame"], expected["frame"])
+	np.testing.assert_allclose(found[["x", "y"]].to_numpy(dtype = float), expected[["x", "y"]].to_numpy(dtype = float), atol = 0.05)
+
+def test_found_roi_covers_moving_particles(synthetic):
+	video_name, truth = synthetic
+	x, y, width, height = st.find_roi(video_name, margin = 7)
+	#Particles entering or leaving are visible with their centres just outside the frame, which no rectangle in it can cover.
+	moving = truth[truth["visible"] & truth["x"].between(0, 159) & truth["y"].between(0, 119)]
+
+	assert moving["x"].between(x, x + width).all() and moving["y"].between(y, y + height).all()
+
+	auto = st.evaluate_features(video_name, 7, 300, 0, 120, 1, roi = "auto")
+	found = st.evaluate_features(video_name, 7, 300, 0, 120, 1, roi = (x, y, width, height))
+	pd.testing.assert_frame_equal(auto, found)
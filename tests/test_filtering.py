@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import SandTracking as st
+
+def falling(ID, frames, x0 = 20.0):
+	#Helper function that returns the rows of a particle falling along y = x ** 2 / 40 over a range of frames.
+
+	x = x0 + np.asarray(frames, dtype = float)
+	return pd.DataFrame({"x": x, "y": x ** 2 / 40, "frame": frames, "particle": ID})
+
+def test_merge_fragments_keeps_particles_apart():
+	#Fragments 10 and 11 follow one path but were split from different particles, while 12 and 13 were split from the same one.
+	data_frame = pd.concat([falling(10, range(0, 10)), falling(11, range(12, 22)), falling(12, range(30, 40), 100), falling(13, range(42, 52), 100)],
+						ignore_index = True)
+
+	separate = st.merge_fragments(data_frame, 1, fragments = [10, 11, 12, 13], origins = [1, 2, 3, 3])
+	joined = st.merge_fragments(data_frame, 1, fragments = [10, 11, 12, 13])
+
+	assert sorted(separate["particle"].unique()) == [10, 11, 12]
+	assert sorted(joined["particle"].unique()) == [10, 12]
+
+def test_postfiltering_passes_merge_limits(trajectories):
+	angle = math.pi * 15 / 180 * 0.3
+
+	results = []
+
+	for search_size, max_gap in [(50, 30), (0, 0)]:
+		results.append(st.postfiltering(trajectories.copy(), None, 100, math.inf, angle, 1, 3, y_restriction = -1, columnar = True,
+										search_size = search_size, max_gap = max_gap))
+
+	expected = st.filter_trajectories(trajectories, 100, math.inf, angle, 3, y_restriction = -1, error_tolerance = 1)
+
+	assert results[0].index.equals(expected.index)
+	np.testing.assert_array_equal(results[0]["particle"].to_numpy(), expected["particle"].to_numpy())
+	assert results[1]["particle"].nunique() > results[0]["particle"].nunique()
+
+def test_particle_store_splits_every_particle_at_once():
+	data_frame = pd.concat([falling(3, range(0, 10)), falling(5, range(0, 8), 100), falling(7, range(0, 6), 200)], ignore_index = True)
+	data_frame = data_frame.assign(ep = 0.1, size = 2.0, ecc = 0.0).sample(frac = 1, random_state = 0)
+	store = st.particle_store(data_frame)
+
+	#Particle 3 is cut at its 4th and 9th rows and particle 5 at its 3rd, so particle 3's last two rows and particle 5's first two are stubs.
+	fragments, origins = store.split({3: [3, 8], 5: [12]}, 3)
+	t = store.to_frame(data_frame)
+
+	np.testing.assert_array_equal(fragments, [8, 9, 12])
+	np.testing.assert_array_equal(origins, [3, 3, 5])
+	assert t.groupby("particle").size().to_dict() == {7: 6, 8: 3, 9: 5, 12: 6}
+
+def test_fit_polylines_matches_polyfit(trajectories):
+	polyline_data, residuals = st.fit_polylines(trajectories)
+
+	assert len(polyline_data) == trajectories["particle"].nunique()
+
+	for ID, p in trajectories.groupby("particle"):
+		expected = np.polyfit(p["x"], p["y"], 2)
+		fitted = polyline_data.loc[ID, ["quadratic", "linear", "constant"]].to_numpy(dtype = float)
+
+		np.testing.assert_allclose(np.polyval(fitted, p["x"]), np.polyval(expected, p["x"]), atol = 1e-6)
+		np.testing.assert_allclose(residuals[(trajectories["particle"] == ID).to_numpy()], np.polyval(fitted, p["x"]) - p["y"], atol = 1e-9)
+		assert polyline_data.loc[ID, "rms"] == pytest.approx(np.sqrt(np.mean((np.polyval(expected, p["x"]) - p["y"]) ** 2)), abs = 1e-6)
+
+def test_polyline_cache_refits_changed_particles(trajectories):
+	cache = st.polyline_cache()
+	cache.fit(trajectories)
+	assert cache.fitted == trajectories["particle"].nunique()
+
+	#Dropping rows of one particle and relabelling another changes only those two.
+	changed = trajectories.drop(trajectories.index[trajectories["particle"] == trajectories["particle"].iloc[0]][:3])
+	changed.loc[changed["particle"] == changed["particle"].iloc[-1], "particle"] = changed["particle"].max() + 1
+
+	polyline_data, residuals = cache.fit(changed)
+	expected, expected_residuals = st.fit_polylines(changed)
+
+	assert cache.fitted == 2
+	pd.testing.assert_frame_equal(polyline_data, expected, check_exact = False, rtol = 1e-9, atol = 1e-9, check_index_type = False,
+								check_dtype = False)
+	np.testing.assert_allclose(residuals, expected_residuals, atol = 1e-6)
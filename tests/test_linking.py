@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+import SandTracking as st
+
+@pytest.mark.parametrize("pieces", [dict(segments = 3), dict(strips = 2), dict(strips = 2, segments = 2, processes = 2)],
+						ids = ["segments", "strips", "both"])
+def test_pieces_approximate_serial_linking(features, pieces):
+	serial = st.evaluate_trajectories(features, 10, 2, 0.9, 3)
+	t = st.evaluate_trajectories(features, 10, 2, 0.9, 3, **pieces)
+
+	assert sorted(t.index) == sorted(serial.index)
+
+	#Linking pieces separately is an approximation, so only most rows have to be in a trajectory grouped exactly as when linking serially.
+	pairs = pd.crosstab(serial.sort_index()["particle"].to_numpy(), t.sort_index()["particle"].to_numpy())
+	matched = pairs.loc[(pairs > 0).sum(axis = 1) == 1, (pairs > 0).sum(axis = 0) == 1].to_numpy().sum()
+	assert matched >= 0.9 * len(serial)
+
+def test_subnets_are_counted_on_request(features):
+	with st.run_report() as report:
+		st.evaluate_trajectories(features, 10, 2, 0.9, 3)
+
+	assert "subnets" not in report.counters
+
+	with st.run_report() as report:
+		st.evaluate_trajectories(features, 10, 2, 0.9, 3, report = True)
+
+	assert report.counters["subnets"] > 0
+	assert report.counters["subnet particles"] >= 2 * report.counters["subnets"]
+	assert report.counters["largest subnet"] >= 2
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import Live as lv
+import SandTracking as st
+
+def drain(frames):
+	#Helper function that gets every item of a frame_queue up to the None closing it.
+
+	items = []
+
+	while True:
+		item = frames.get()
+
+		if item is None:
+			return items
+
+		items.append(item)
+
+def test_frame_queue_drop_keeps_the_first_frames():
+	frames = lv.frame_queue(2, "drop")
+
+	assert [frames.put((i, 0, None)) for i in range(3)] == [True, True, False]
+	assert [frames.get()[0] for i in range(2)] == [0, 1]
+	assert (frames.received, frames.dropped, frames.peak) == (3, 1, 2)
+
+def test_frame_queue_oldest_keeps_the_newest_frames():
+	frames = lv.frame_queue(2, "oldest")
+
+	assert all(frames.put((i, 0, None)) for i in range(5))
+	assert [frames.get()[0] for i in range(2)] == [3, 4]
+	assert (frames.received, frames.dropped) == (5, 3)
+
+def test_frame_queue_block_holds_the_source_back():
+	frames = lv.frame_queue(1, "block")
+	frames.put((0, 0, None))
+
+	source = threading.Thread(target = frames.put, args = ((1, 0, None), ))
+	source.start()
+	time.sleep(0.2)
+
+	assert source.is_alive()
+	assert frames.get()[0] == 0
+
+	source.join(5)
+	assert frames.get()[0] == 1
+	assert frames.dropped == 0 and frames.stalled >= 0.1
+
+def test_frame_queue_passes_on_errors():
+	frames = lv.frame_queue(1, "drop")
+	frames.put((0, 0, None))
+	error = RuntimeError("camera unplugged")
+
+	#The end of the frames is never dropped, so closing waits for room.
+	closer = threading.Thread(target = frames.close, args = (error, ))
+	closer.start()
+
+	assert drain(frames)[1:] == [error]
+	closer.join(5)
+
+	with pytest.raises(ValueError):
+		lv.frame_queue(1, "newest")
+
+def test_replay_source_emits_the_video(synthetic):
+	frames = lv.frame_queue(4, "block")
+	source = lv.replay_source(synthetic[0], fps = 200, start_frame = 10, length = 20)
+
+	begin = time.perf_counter()
+	source.start(frames)
+	items = drain(frames)
+	source.thread.join(5)
+
+	expected = st.process_video(synthetic[0], decode_grey = True)
+
+	assert [item[0] for item in items] == list(range(10, 30))
+	assert time.perf_counter() - begin >= 19 / 200
+
+	for frame_no, arrived, frame in items:
+		np.testing.assert_array_equal(frame, expected[frame_no])
+
+def test_replay_source_stops_early(synthetic):
+	frames = lv.frame_queue(100, "block")
+	source = lv.replay_source(synthetic[0], fps = 50)
+	source.start(frames)
+	time.sleep(0.1)
+	source.stop()
+
+	assert 0 < len(drain(frames)) < 100
+
+def test_callback_source_closes_once_stopped():
+	frames = lv.frame_queue(4, "block")
+	source = lv.frame_source()
+	source.start(frames)
+	source.emit(0, np.zeros((2, 2)))
+	source.stop()
+
+	assert [item[0] for item in drain(frames)] == [0]
+	source.thread.join(5)
+	assert not source.thread.is_alive()
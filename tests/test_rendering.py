@@ -0,0 +1,74 @@
+import os
+import threading
+
+import numpy as np
+
+import Rendering as rd
+import SandTracking as st
+
+def test_export_video_counts_frames(synthetic, trajectories, tmp_path):
+	with st.run_report() as report:
+		stats = rd.export_video(synthetic[0], trajectories, str(tmp_path / "annotated.avi"), length = 30, codec = "ffv1")
+
+	assert stats["frames"] == report.counters["frames annotated"] == 30
+	assert [stage["stage"] for stage in report.stages] == ["export_video"]
+	assert len(st.grey_reader(str(tmp_path / "annotated.avi"))) == 30
+
+def test_export_video_stops_when_encoder_fails(synthetic, trajectories, tmp_path, monkeypatch):
+	class failing_frame:
+		#Stand-in for PyAV's VideoFrame whose conversion fails, as an encoder error would.
+
+		@staticmethod
+		def from_ndarray(array, format):
+			raise RuntimeError("encoder failed")
+
+	monkeypatch.setattr(rd.av, "VideoFrame", failing_frame)
+	before = threading.active_count()
+	errors = []
+
+	#The export runs in a thread of its own, so that a pipeline left waiting on a full queue fails the test instead of hanging it.
+	def run():
+		try:
+			rd.export_video(synthetic[0], trajectories, str(tmp_path / "annotated.avi"), codec = "ffv1", queue_size = 2)
+		except RuntimeError as error:
+			errors.append(error)
+
+	thread = threading.Thread(target = run, daemon = True)
+	thread.start()
+	thread.join(30)
+
+	assert not thread.is_alive()
+	assert [str(error) for error in errors] == ["encoder failed"]
+	assert threading.active_count() == before
+
+def test_histogram_axes_are_in_pixels_per_second(trajectories, tmp_path, monkeypatch):
+	saved = dict()
+	save_histogram = rd.save_histogram
+
+	def capture(values, file_name, bins, label):
+		saved[os.path.basename(file_name)] = (np.asarray(values), label)
+		return save_histogram(values, file_name, bins, label)
+
+	monkeypatch.setattr(rd, "save_histogram", capture)
+	file_names = rd.derivative_histograms(trajectories, str(tmp_path / "histograms"), y_restriction = -1)
+
+	assert all(os.path.getsize(name) > 0 for name in file_names)
+	assert {name: label for name, (values, label) in saved.items()} == {"x_vel.png": "x_vel [px/s]", "y_vel.png": "y_vel [px/s]",
+																		"x_accel.png": "x_accel [px/s²]", "y_accel.png": "y_accel [px/s²]"}
+
+	#The velocities are the differences of consecutive positions of a particle divided by the time between its frames.
+	p = trajectories.sort_values(["particle", "frame"])
+	p = p[p["particle"] == p["particle"].iloc[0]]
+	expected = np.diff(p["y"].to_numpy()) / np.diff(p["frame"].to_numpy()) * st.frames_per_second
+	np.testing.assert_allclose(saved["y_vel.png"][0][:len(expected)], expected)
+
+def test_trajectory_figures_are_saved(synthetic, trajectories, tmp_path):
+	fig = rd.plot_trajectories(trajectories, str(tmp_path / "trajectories.png"))
+
+	assert (fig.axes[0].get_xlabel(), fig.axes[0].get_ylabel()) == ("x [px]", "y [px]")
+	assert len(fig.axes[0].collections[0].get_paths()) == trajectories["particle"].nunique()
+
+	fig = rd.overlay_frame(synthetic[0], 60, trajectories, str(tmp_path / "overlay.png"), trail = 10)
+
+	assert fig.axes[0].get_xlim() == (-0.5, 159.5)
+	assert os.path.getsize(str(tmp_path / "trajectories.png")) > 0 and os.path.getsize(str(tmp_path / "overlay.png")) > 0
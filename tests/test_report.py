@@ -0,0 +1,12 @@
+import SandTracking as st
+
+def test_report_records_worker_cpu_time(synthetic):
+	with st.run_report() as report:
+		st.evaluate_features(synthetic[0], 7, 300, 0, 60, 1, processes = 2, chunk_size = 30)
+
+	stage = report.stages[0]
+
+	assert stage["stage"] == "evaluate_features"
+	assert stage["child_cpu_time"] > 0
+	assert stage["peak_rss_mb"] > 10
+	assert stage["frames"] == 60
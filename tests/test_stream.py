@@ -0,0 +1,39 @@
+import math
+
+import pandas as pd
+
+import benchmark as bm
+import SandTracking as st
+
+angle = math.pi * 15 / 180
+
+def stream(video_name, output_name, window, max_track_length):
+	#Helper function that streams the whole synthetic video, returning the trajectories written and the peak amount of rows held open.
+
+	with st.run_report() as report:
+		st.evaluate_stream(video_name, 7, 300, 0, 120, 1, 10, 2, 0.9, 3, 100, math.inf, angle, 10, output_name = output_name, window = window,
+						y_restriction = -1, max_track_length = max_track_length)
+
+	return pd.read_csv(output_name, index_col = 0), report.counters["peak open rows"]
+
+def test_stream_matches_filter_trajectories(synthetic, features, tmp_path):
+	t, open_rows = stream(synthetic[0], str(tmp_path / "stream.csv"), 20, None)
+	expected = st.filter_trajectories(st.evaluate_trajectories(features, 10, 2, 0.9, 3), 100, math.inf, angle, 10, y_restriction = -1)
+
+	assert len(expected) > 0
+	assert sorted(t.index) == sorted(expected.index)
+
+	#Particle IDs are renumbered in the order trajectories close, so only the grouping of the rows is compared.
+	pairs = pd.crosstab(t.sort_index()["particle"].to_numpy(), expected.sort_index()["particle"].to_numpy())
+	assert ((pairs > 0).sum(axis = 0) == 1).all() and ((pairs > 0).sum(axis = 1) == 1).all()
+
+def test_stream_bounds_still_grains(synthetic, tmp_path):
+	unbounded, unbounded_rows = stream(synthetic[0], str(tmp_path / "unbounded.csv"), 10, None)
+	bounded, bounded_rows = stream(synthetic[0], str(tmp_path / "bounded.csv"), 10, 30)
+
+	#The still specks are in every frame, so only flushing them keeps them from being held open for the whole video.
+	assert bounded_rows < unbounded_rows / 2
+
+	#Each piece of a still speck is still, so the specks are removed either way and every row left is a falling particle.
+	assert len(bounded) > 0
+	assert (bm.label_truth(synthetic[1], bounded, 1) >= 0).all()
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import Triangulation as tr
+
+intrinsics = np.array([[800, 0, 320], [0, 800, 240], [0, 0, 1]], dtype = float)
+
+def rotation(angle):
+	#Helper function that returns the rotation by an angle about the vertical axis.
+
+	c, s = np.cos(angle), np.sin(angle)
+	return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+def falling_tracks(particles = 6, frames = 60, seed = 0):
+	#Helper function that returns the real space positions, frames and particle IDs of particles falling under gravity in front of the cameras.
+
+	rng = np.random.default_rng(seed)
+	start = np.column_stack((rng.uniform(-1, 1, particles), rng.uniform(-1, -0.5, particles), rng.uniform(4, 6, particles)))
+	velocity = np.column_stack((rng.normal(0, 0.005, particles), rng.uniform(0, 0.01, particles), rng.normal(0, 0.005, particles)))
+	t = np.tile(np.arange(frames), particles)
+	ID = np.repeat(np.arange(particles), frames)
+	points = start[ID] + velocity[ID] * t[:, None] + np.array([0, 0.0005, 0]) * t[:, None] ** 2 / 2
+
+	return points, t, ID
+
+def views(P1, P2, points, frame, ID, offset, seed = 1):
+	#Helper function that projects the tracks into both cameras, with the second camera's frames delayed by offset and its rows shuffled.
+
+	pixels1 = tr.project(P1, points)
+	pixels2 = tr.project(P2, points)
+	order = np.random.default_rng(seed).permutation(len(points))
+
+	data_frame1 = pd.DataFrame({"x": pixels1[:, 0], "y": pixels1[:, 1], "frame": frame, "particle": ID})
+	data_frame2 = pd.DataFrame({"x": pixels2[order, 0], "y": pixels2[order, 1], "frame": frame[order] + offset, "particle": ID[order] + 100},
+							index = order)
+
+	return data_frame1, data_frame2
+
+@pytest.mark.parametrize("rotation2, translation2", [(rotation(-0.3), [-1, 0, 0.2]), (np.eye(3), [-1, 0, 0])], ids = ["converging", "parallel"])
+def test_triangulate_synthetic_tracks(rotation2, translation2):
+	P1 = tr.projection_matrix(intrinsics, np.eye(3), [0, 0, 0])
+	P2 = tr.projection_matrix(intrinsics, rotation2, translation2)
+	points, frame, ID = falling_tracks()
+	data_frame1, data_frame2 = views(P1, P2, points, frame, ID, 3)
+
+	t = tr.triangulate_trajectories(data_frame1, data_frame2, P1, P2, offset = 3)
+
+	#Every position is matched with its own projection, the second camera's index being the row it was shuffled from.
+	assert len(t) == len(points)
+	np.testing.assert_array_equal(t["index1"].to_numpy(), t["index2"].to_numpy())
+	np.testing.assert_array_equal(t["particle2"].to_numpy(), t["particle1"].to_numpy() + 100)
+	np.testing.assert_allclose(t[["X", "Y", "Z"]].to_numpy(), points[t["index1"].to_numpy()], atol = 1e-6)
+	assert t[["err1", "err2"]].to_numpy().max() < 1e-6
+
+def test_epipolar_keys_of_parallel_cameras():
+	P1 = tr.projection_matrix(intrinsics, np.eye(3), [0, 0, 0])
+	P2 = tr.projection_matrix(intrinsics, np.eye(3), [-1, 0, 0])
+	points, frame, ID = falling_tracks(particles = 3, frames = 5)
+	p1 = np.column_stack((tr.project(P1, points), np.ones(len(points))))
+	p2 = np.column_stack((tr.project(P2, points), np.ones(len(points))))
+
+	key2, line_key, tolerance, period = tr.epipolar_keys(tr.fundamental_matrix(P1, P2), p1, p2, 2)
+
+	#The epipolar lines are the rows of the image, so the keys are the rows, with no wrapping around.
+	assert period is None
+	assert tolerance == 2
+	np.testing.assert_allclose(np.abs(key2), p2[:, 1])
+	np.testing.assert_allclose(line_key, key2, atol = 1e-6)
+
+def test_noisy_features_are_recovered():
+	P1 = tr.projection_matrix(intrinsics, np.eye(3), [0, 0, 0])
+	P2 = tr.projection_matrix(intrinsics, rotation(-0.3), [-1, 0, 0.2])
+	points, frame, ID = falling_tracks(particles = 10)
+	data_frame1, data_frame2 = views(P1, P2, points, frame, ID, 0)
+	data_frame1[["x", "y"]] += np.random.default_rng(2).normal(0, 0.1, (len(data_frame1), 2))
+
+	t = tr.triangulate_trajectories(data_frame1, data_frame2, P1, P2)
+
+	assert len(t) > 0.95 * len(points)
+	assert (t["index1"] == t["index2"]).all()
+	assert np.median(np.linalg.norm(t[["X", "Y", "Z"]].to_numpy() - points[t["index1"].to_numpy()], axis = 1)) < 0.01